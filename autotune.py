@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午10:50
+@file: autotune.py
+@author: zj
+@description: Pick the fastest CPU inference settings for a model on this host and save them as a profile
+
+Every backend (eager PyTorch, TorchScript, ONNX Runtime with --onnx) is measured over thread counts, and ONNX Runtime
+also over inter-op threads / execution mode and graph optimization level. For --objective latency the batch size is 1;
+for throughput the batch size with the most images per second is also selected. The best settings are saved per model
+file in the profile file (CRNN_AUTOTUNE_PROFILE, see utils/autotune.py). load_ocr_model, ONNXRuntimePredictor and
+build_engine then apply them automatically on hosts with the same CPU.
+
+Usage - Single-image latency of CRNN_Tiny, PyTorch/TorchScript and its ONNX export:
+    $ python3 autotune.py crnn_tiny-plate.pth --arch crnn_tiny --onnx crnn_tiny-plate.onnx
+
+Usage - Throughput of LPRNetPlus (batch size is tuned as well):
+    $ python3 autotune.py lprnet_plus-plate.pth --arch lprnet_plus --onnx lprnet_plus-plate.onnx --objective throughput
+
+Usage - Profile file outside ./runs/autotune, the loaders read the same variable:
+    $ CRNN_AUTOTUNE_PROFILE=/etc/crnn/profiles.json python3 autotune.py crnn_tiny-plate.pth --arch crnn_tiny
+    $ CRNN_AUTOTUNE_PROFILE=/etc/crnn/profiles.json python3 serve_plate.py crnn_tiny-plate.pth
+
+"""
+
+import os
+import argparse
+
+import torch
+
+from utils.general import load_ocr_model, PLATE_ARCHS
+from utils.engine import DATASETS, TorchBackend, TorchScriptBackend, ONNXBackend
+from utils.autotune import save_profile, ort_session_options
+from utils.torchutil import time_sync
+from utils.logger import LOGGER
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description='Autotune CPU inference settings')
+    parser.add_argument('pretrained', metavar='PRETRAINED', type=str, help='path to the pytorch checkpoint')
+    parser.add_argument('--arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                        help='architecture of the checkpoint')
+    parser.add_argument('--dataset', type=str, default='plate', choices=list(DATASETS.keys()), help='dataset type')
+    parser.add_argument('--onnx', type=str, default=None, help='ONNX export of the checkpoint (pth2onnx.py)')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'torchscript', 'onnx'],
+                        choices=['torch', 'torchscript', 'onnx'], help='backends to try')
+    parser.add_argument('--objective', type=str, default='latency', choices=['latency', 'throughput'],
+                        help='latency: batch size 1, throughput: images per second over --batch-sizes')
+    parser.add_argument('--threads', nargs='+', type=int, default=None,
+                        help='intra-op thread counts to try, default: powers of two up to the number of cores')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8, 16, 32, 64],
+                        help='batch sizes to try for --objective throughput')
+    parser.add_argument('--n', type=int, default=30, help='timed iterations per measurement')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def measure(backend, data, n=30, warmup=5):
+    # Median latency (ms) of one backend call
+    for _ in range(warmup):
+        backend(data)
+    times = []
+    for _ in range(n):
+        t0 = time_sync()
+        backend(data)
+        times.append((time_sync() - t0) * 1000)
+    return sorted(times)[n // 2]
+
+
+def sweep(backend, settings, input_shape, batch_sizes, args, results, uint8=False):
+    # Measure one backend configuration at every batch size
+    c, h, w = input_shape
+    for batch_size in batch_sizes:
+        if uint8:
+            data = torch.randint(0, 256, (batch_size, h, w, c), dtype=torch.uint8)
+        else:
+            data = torch.randn(batch_size, c, h, w)
+        latency = measure(backend, data, n=args.n)
+        result = dict(settings, batch_size=batch_size, latency_ms=latency, throughput=batch_size * 1000 / latency)
+        print(f"{result['backend']:>12s}{result['intra_op_threads']:>8d}{result.get('inter_op_threads') or 0:>8d}"
+              f"{result.get('execution_mode', '-'):>16s}{result.get('graph_optimization_level', '-'):>18s}"
+              f"{batch_size:>7d}{latency:>12.3f}{result['throughput']:>12.1f}")
+        results.append(result)
+
+
+def main():
+    args = parse_opt()
+    device = torch.device('cpu')
+
+    spec = DATASETS[args.dataset]
+    kwargs = dict(PLATE_ARCHS[args.arch])
+    kwargs.pop('img_shape')
+    # Same input size as build_engine()
+    h, w = spec['lprnet_size'] if kwargs.get('use_lprnet') else spec['size']
+    c = 1 if spec['color'] == 'gray' else 3
+    input_shape = (c, h, w)
+
+    cpu_count = os.cpu_count()
+    threads = args.threads or sorted({2 ** i for i in range(cpu_count.bit_length()) if 2 ** i <= cpu_count} |
+                                     {cpu_count})
+    batch_sizes = [1] if args.objective == 'latency' else args.batch_sizes
+
+    print(f"{'backend':>12s}{'intra':>8s}{'inter':>8s}{'mode':>16s}{'graph_opt':>18s}{'batch':>7s}"
+          f"{'ms':>12s}{'img/s':>12s}")
+    results = []
+    if 'torch' in args.backends or 'torchscript' in args.backends:
+        # Measure without any previously saved profile
+        model, _ = load_ocr_model(pretrained=args.pretrained, device=device, shape=(1, *input_shape),
+                                  num_classes=len(spec['chars']), apply_profile=False, **kwargs)
+        backends = []
+        if 'torch' in args.backends:
+            backends.append(('torch', TorchBackend(model, device)))
+        if 'torchscript' in args.backends:
+            backends.append(('torchscript', TorchScriptBackend(model, device, example=torch.zeros(1, *input_shape))))
+        for name, backend in backends:
+            for t in threads:
+                torch.set_num_threads(t)
+                sweep(backend, dict(backend=name, intra_op_threads=t), input_shape, batch_sizes, args, results)
+        torch.set_num_threads(cpu_count)
+
+    if 'onnx' in args.backends and args.onnx is not None:
+        from utils.onnxutil import ONNXRuntimePredictor
+
+        for t in threads:
+            for execution_mode, inter in [('ORT_SEQUENTIAL', 1), ('ORT_PARALLEL', 2)]:
+                for level in ['ORT_ENABLE_EXTENDED', 'ORT_ENABLE_ALL']:
+                    settings = dict(backend='onnx', intra_op_threads=t, inter_op_threads=inter,
+                                    execution_mode=execution_mode, graph_optimization_level=level)
+                    predictor = ONNXRuntimePredictor(args.onnx, session_options=ort_session_options(settings))
+                    # Static batch models only run at their own batch size
+                    sizes = [predictor.batch_size] if predictor.batch_size else batch_sizes
+                    sweep(ONNXBackend(predictor), settings, input_shape, sizes, args, results, uint8=predictor.e2e)
+
+    assert len(results) > 0, 'nothing was measured, --backends onnx needs --onnx'
+
+    def score(r):
+        return r['latency_ms'] if args.objective == 'latency' else -r['throughput']
+
+    best = dict(min(results, key=score), objective=args.objective)
+    print(f"\nBest ({args.objective}): {best}")
+
+    # One profile per model file, the loaders of that file apply it
+    torch_results = [r for r in results if r['backend'] in ('torch', 'torchscript')]
+    if len(torch_results) > 0:
+        save_profile(args.pretrained, dict(min(torch_results, key=score), objective=args.objective))
+    onnx_results = [r for r in results if r['backend'] == 'onnx']
+    if len(onnx_results) > 0:
+        save_profile(args.onnx, dict(min(onnx_results, key=score), objective=args.objective))
+    if best['backend'] == 'onnx':
+        LOGGER.info(f"ONNX Runtime is the fastest backend on this host, serve {args.onnx}")
+
+
+if __name__ == '__main__':
+    main()
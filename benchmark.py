@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 上午10:05
+@file: benchmark.py
+@author: zj
+@description:
+
+Usage - Forward latency for every plate architecture and batch size (NCHW vs channels_last):
+    $ python3 benchmark.py latency --device cpu --batch-sizes 1 8 32 128 --channels-last
+    $ python3 benchmark.py latency --device cpu --archs crnn_tiny lprnet_plus_stnet --channels-last --threads 4
+
+Usage - CRNN_Nano against CRNN_Tiny/LPRNetPlus at batch size 1 (the table also reports parameters and GFLOPs):
+    $ python3 benchmark.py latency --device cpu --archs crnn_tiny crnn_nano crnn_nano_w0.5 crnn_nano_conv lprnet_plus --batch-sizes 1 --threads 1
+
+Usage - GRU vs convolutional sequence head at small batch sizes:
+    $ python3 benchmark.py latency --device cpu --archs crnn_tiny crnn_tiny_conv crnn crnn_conv --batch-sizes 1 4 16
+
+Usage - bf16 vs fp32 autocast on CPU (training step time, inference latency and, with checkpoints, plate accuracy):
+    $ python3 benchmark.py amp --device cpu --archs crnn_tiny lprnet_plus --batch-size 128
+    $ python3 benchmark.py amp --device cpu --archs crnn_tiny --pretrained crnn_tiny-plate.pth --val-root ../datasets/chinese_license_plate/recog/
+
+Usage - Load test of a running serve_plate.py (closed loop, one keep-alive connection per concurrent client):
+    $ python3 benchmark.py serve --url http://127.0.0.1:8000 --images assets/plate/ --concurrency 1 8 32 64 --duration 10
+
+Usage - Throughput scaling of the multi-process CPU pool from 1 to N workers:
+    $ python3 benchmark.py pool --pretrained crnn_tiny-plate.pth --arch crnn_tiny --workers 1 2 4 8 16 --batch-size 32
+
+Usage - Cold start of every entry point (fresh interpreter each run): interpreter start, module import, model load and
+first prediction, with the slowest imports (python -X importtime). Exits with 1 when an import exceeds the budget:
+    $ python3 benchmark.py startup --plate crnn_tiny-plate.onnx --emnist crnn_tiny-emnist.onnx --budget-ms 800
+
+"""
+
+import os
+import sys
+import glob
+import json
+import random
+import asyncio
+import argparse
+import subprocess
+import time
+from urllib.parse import urlsplit
+
+import torch
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+from utils.general import load_ocr_model, get_flops, PLATE_ARCHS
+from utils.torchutil import select_device, measure_latency, time_sync, amp_autocast, cpu_bf16_flags
+from utils.loss import CTCLoss
+from utils.evaluator import Evaluator
+from utils.dataset.plate import PlateDataset, PLATE_CHARS
+from utils.serving import HTTPClient
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description='Benchmark CRNN/LPRNet')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    latency_parser = subparsers.add_parser('latency', help='forward latency per architecture and batch size')
+    latency_parser.add_argument('--archs', nargs='+', default=list(PLATE_ARCHS.keys()),
+                                choices=list(PLATE_ARCHS.keys()), help='architectures to benchmark')
+    latency_parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8, 32, 128], help='batch sizes')
+    latency_parser.add_argument('--channels-last', action='store_true', help='also benchmark channels_last (NHWC)')
+    latency_parser.add_argument('--n', type=int, default=50, help='timed iterations per measurement')
+
+    amp_parser = subparsers.add_parser('amp', help='fp32 vs bf16/fp16 autocast, training step time and accuracy')
+    amp_parser.add_argument('--archs', nargs='+', default=['crnn_tiny', 'crnn', 'lprnet_plus'],
+                            choices=list(PLATE_ARCHS.keys()), help='architectures to benchmark')
+    amp_parser.add_argument('--amp-dtypes', nargs='+', default=['fp32', 'bf16'], choices=['fp32', 'fp16', 'bf16'],
+                            help='autocast dtypes to compare, the first one is the reference')
+    amp_parser.add_argument('--batch-size', type=int, default=128, help='batch size of the training step')
+    amp_parser.add_argument('--pretrained', nargs='+', default=None,
+                            help='one checkpoint per arch, used for the inference latency and accuracy')
+    amp_parser.add_argument('--val-root', type=str, default=None, help='plate val dataset for the accuracy column')
+    amp_parser.add_argument('--n', type=int, default=20, help='timed iterations per measurement')
+
+    serve_parser = subparsers.add_parser('serve', help='load test of a running serve_plate.py')
+    serve_parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='address of the service')
+    serve_parser.add_argument('--images', nargs='+', default=['assets/plate/'], help='image files or directories')
+    serve_parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32, 64],
+                              help='concurrent clients, one run each')
+    serve_parser.add_argument('--duration', type=float, default=10., help='seconds per run')
+
+    pool_parser = subparsers.add_parser('pool', help='throughput of the multi-process CPU pool per worker count')
+    pool_parser.add_argument('--pretrained', type=str, required=True, help='.pth, .torchscript or .onnx model')
+    pool_parser.add_argument('--arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                             help='architecture of a .pth checkpoint')
+    pool_parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8], help='worker counts')
+    pool_parser.add_argument('--images', nargs='+', default=['assets/plate/'], help='image files or directories')
+    pool_parser.add_argument('--batch-size', type=int, default=32, help='crops per submitted batch')
+    pool_parser.add_argument('--n', type=int, default=200, help='batches per worker count')
+
+    startup_parser = subparsers.add_parser('startup', help='import time and time to first prediction per entry point')
+    startup_parser.add_argument('--entries', nargs='+', default=list(STARTUP_ENTRIES.keys()),
+                                choices=list(STARTUP_ENTRIES.keys()), help='entry point modules')
+    startup_parser.add_argument('--plate', type=str, default=None, help='plate model, entry points without a model '
+                                                                        'of their dataset only measure the import')
+    startup_parser.add_argument('--custom', type=str, default=None, help='custom plate model')
+    startup_parser.add_argument('--emnist', type=str, default=None, help='EMNIST model')
+    startup_parser.add_argument('--arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                                help='architecture of .pth checkpoints')
+    startup_parser.add_argument('--budget-ms', type=float, default=1000., help='import time budget per entry point')
+    startup_parser.add_argument('--repeat', type=int, default=3, help='runs per entry point, the median is reported')
+    startup_parser.add_argument('--top', type=int, default=5, help='slowest top-level imports shown per entry point')
+
+    for p in subparsers.choices.values():
+        p.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+        p.add_argument('--threads', type=int, default=None, help='torch intra-op threads, default: torch default')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def latency(args):
+    device = select_device(args.device)
+    memory_formats = [torch.contiguous_format]
+    if args.channels_last:
+        memory_formats.append(torch.channels_last)
+
+    results = dict()
+    complexity = dict()
+    for arch in args.archs:
+        kwargs = dict(PLATE_ARCHS[arch])
+        c, h, w = kwargs.pop('img_shape')
+        for memory_format in memory_formats:
+            model, _ = load_ocr_model(device=device, shape=(1, c, h, w), num_classes=len(PLATE_CHARS),
+                                      channels_last=memory_format == torch.channels_last, **kwargs)
+            if arch not in complexity:
+                complexity[arch] = (sum(p.numel() for p in model.parameters()) / 1e6,
+                                    get_flops(model, img_shape=(1, c, h, w)))
+            for batch_size in args.batch_sizes:
+                data = torch.randn(batch_size, c, h, w).to(device, memory_format=memory_format)
+                results[(arch, batch_size, memory_format)] = measure_latency(model, data, n=args.n)
+
+    print(f"\nthreads: {torch.get_num_threads()}")
+    print(f"{'arch':>20s}{'params(M)':>11s}{'GFLOPs':>9s}{'batch':>8s}{'NCHW (ms)':>12s}{'NHWC (ms)':>12s}"
+          f"{'speedup':>10s}{'ms/img':>10s}")
+    for arch in args.archs:
+        n_p, gflops = complexity[arch]
+        for batch_size in args.batch_sizes:
+            t_nchw = results[(arch, batch_size, torch.contiguous_format)]
+            t_nhwc = results.get((arch, batch_size, torch.channels_last), float('nan'))
+            t_best = min(t_nchw, t_nhwc) if args.channels_last else t_nchw
+            print(f"{arch:>20s}{n_p:>11.3f}{gflops:>9.3f}{batch_size:>8d}{t_nchw:>12.3f}{t_nhwc:>12.3f}"
+                  f"{t_nchw / t_nhwc:>10.2f}{t_best / batch_size:>10.3f}")
+
+
+def measure_train_step(model, images, targets, target_lengths, amp_dtype, n=20, warmup=5):
+    # Median time (ms) of forward + CTC loss + backward + optimizer step, and the loss of the last step
+    device = images.device
+    criterion = CTCLoss(blank_label=0)
+    optimizer = optim.Adam(model.parameters(), lr=1e-4)
+    model.train()
+    times = []
+    for i in range(warmup + n):
+        t0 = time_sync()
+        with amp_autocast(device, amp_dtype):
+            loss = criterion(model(images), targets, target_lengths)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        if i >= warmup:
+            times.append((time_sync() - t0) * 1000)
+    return sorted(times)[n // 2], loss.item()
+
+
+@torch.no_grad()
+def plate_accuracy(model, val_root, img_h, img_w, device):
+    val_dataset = PlateDataset(val_root, is_train=False, input_shape=(img_w, img_h))
+    val_dataloader = DataLoader(val_dataset, batch_size=128, shuffle=False, num_workers=4, drop_last=False)
+    evaluator = Evaluator(blank_label=0)
+    for images, targets in val_dataloader:
+        evaluator.update(model(images.to(device)).cpu(), val_dataset.convert(targets))
+    return evaluator.result()
+
+
+def amp(args):
+    device = select_device(args.device)
+    assert args.pretrained is None or len(args.pretrained) == len(args.archs), 'one --pretrained per arch'
+    assert args.val_root is None or args.pretrained is not None, '--val-root needs --pretrained'
+
+    # Fixed synthetic batch, plates of 7/8 characters
+    generator = torch.Generator().manual_seed(0)
+    target_lengths = torch.randint(7, 9, (args.batch_size,), generator=generator, dtype=torch.int32)
+    targets = torch.randint(1, len(PLATE_CHARS), (int(target_lengths.sum()),), generator=generator)
+
+    results = dict()
+    for i, arch in enumerate(args.archs):
+        kwargs = dict(PLATE_ARCHS[arch])
+        c, h, w = kwargs.pop('img_shape')
+        images = torch.randn(args.batch_size, c, h, w, generator=generator).to(device)
+        pretrained = None if args.pretrained is None else args.pretrained[i]
+        for amp_dtype in args.amp_dtypes:
+            # Same fp32 initial weights for every dtype, autocast only changes the compute dtype
+            torch.manual_seed(0)
+            model, _ = load_ocr_model(device=device, shape=(1, c, h, w), num_classes=len(PLATE_CHARS), **kwargs)
+            step_ms, loss = measure_train_step(model, images, targets.to(device), target_lengths.to(device),
+                                               amp_dtype, n=args.n)
+
+            model, _ = load_ocr_model(pretrained=pretrained, device=device, shape=(1, c, h, w),
+                                      num_classes=len(PLATE_CHARS), amp_dtype=amp_dtype, **kwargs)
+            infer_ms = measure_latency(model, images, n=args.n)
+            acc = plate_accuracy(model, args.val_root, h, w, device) if args.val_root else float('nan')
+            results[(arch, amp_dtype)] = (step_ms, loss, infer_ms, acc)
+
+    print(f"\nthreads: {torch.get_num_threads()} batch: {args.batch_size} "
+          f"cpu bf16: {', '.join(cpu_bf16_flags()) or 'none'}")
+    print(f"{'arch':>20s}{'amp':>6s}{'step (ms)':>12s}{'speedup':>10s}{'loss':>10s}{'infer (ms)':>12s}"
+          f"{'speedup':>10s}{'acc (%)':>10s}")
+    for arch in args.archs:
+        ref_step, _, ref_infer, _ = results[(arch, args.amp_dtypes[0])]
+        for amp_dtype in args.amp_dtypes:
+            step_ms, loss, infer_ms, acc = results[(arch, amp_dtype)]
+            print(f"{arch:>20s}{amp_dtype:>6s}{step_ms:>12.2f}{ref_step / step_ms:>10.2f}{loss:>10.4f}"
+                  f"{infer_ms:>12.2f}{ref_infer / infer_ms:>10.2f}{acc * 100:>10.3f}")
+
+
+async def load_client(client, payloads, deadline, latencies, errors):
+    # Closed loop: send the next request as soon as the previous one is answered
+    loop = asyncio.get_event_loop()
+    while loop.time() < deadline:
+        t0 = time_sync()
+        try:
+            status, _ = await client.request('POST', '/predict', random.choice(payloads))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors.append('connection')
+            await client.close()
+            await asyncio.sleep(0.01)
+            continue
+        if status == 200:
+            latencies.append((time_sync() - t0) * 1000)
+        else:
+            errors.append(status)
+    await client.close()
+
+
+async def server_stats(host, port):
+    client = HTTPClient(host, port)
+    _, stats = await client.request('GET', '/stats')
+    await client.close()
+    return json.loads(stats)
+
+
+async def load_run(host, port, payloads, concurrency, duration):
+    # Latencies of the successful requests, errors and the mean batch size of the server during the run
+    latencies, errors = [], []
+    before = await server_stats(host, port)
+    deadline = asyncio.get_event_loop().time() + duration
+    await asyncio.gather(*[load_client(HTTPClient(host, port), payloads, deadline, latencies, errors)
+                           for _ in range(concurrency)])
+    after = await server_stats(host, port)
+    batch_size = (after['requests'] - before['requests']) / max(after['batches'] - before['batches'], 1)
+    return sorted(latencies), errors, batch_size
+
+
+def list_images(sources):
+    paths = []
+    for p in sources:
+        paths.extend(sorted(glob.glob(os.path.join(p, '*.jpg'))) if os.path.isdir(p) else [p])
+    assert len(paths) > 0, sources
+    return paths
+
+
+def serve(args):
+    url = urlsplit(args.url)
+    payloads = []
+    for path in list_images(args.images):
+        with open(path, 'rb') as f:
+            payloads.append(f.read())
+
+    print(f"{'clients':>8s}{'requests':>10s}{'errors':>8s}{'req/s':>10s}{'p50 (ms)':>10s}{'p95 (ms)':>10s}"
+          f"{'p99 (ms)':>10s}{'batch':>8s}")
+    for concurrency in args.concurrency:
+        latencies, errors, batch_size = asyncio.run(load_run(url.hostname, url.port or 80, payloads, concurrency,
+                                                             args.duration))
+        n = len(latencies)
+
+        def pct(q):
+            return latencies[min(int(q * n), n - 1)] if n > 0 else float('nan')
+
+        print(f"{concurrency:>8d}{n:>10d}{len(errors):>8d}{n / args.duration:>10.1f}{pct(0.5):>10.2f}"
+              f"{pct(0.95):>10.2f}{pct(0.99):>10.2f}{batch_size:>8.2f}")
+
+
+def pool(args):
+    import cv2
+    from utils.pool import WorkerPool
+
+    kwargs = dict(PLATE_ARCHS[args.arch])
+    kwargs.pop('img_shape')
+    images = [cv2.imread(path) for path in list_images(args.images)]
+    batch = [images[i % len(images)] for i in range(args.batch_size)]
+
+    results = dict()
+    for num_workers in args.workers:
+        worker_pool = WorkerPool(args.pretrained, num_workers=num_workers, num_slots=4 * num_workers * args.batch_size,
+                                 **kwargs)
+        worker_pool.start()
+        # Keep two batches per worker in flight
+        for future in [worker_pool.submit(batch) for _ in range(2 * num_workers)]:
+            future.result()
+        t0 = time_sync()
+        futures = []
+        for i in range(args.n):
+            futures.append(worker_pool.submit(batch))
+            if len(futures) >= 2 * num_workers:
+                futures.pop(0).result()
+        for future in futures:
+            future.result()
+        results[num_workers] = args.n * args.batch_size / (time_sync() - t0)
+        worker_pool.close()
+
+    print(f"\ncores: {len(os.sched_getaffinity(0))} batch: {args.batch_size}")
+    print(f"{'workers':>8s}{'img/s':>12s}{'speedup':>10s}{'efficiency':>12s}")
+    ref_workers = args.workers[0]
+    for num_workers in args.workers:
+        speedup = results[num_workers] / results[ref_workers]
+        print(f"{num_workers:>8d}{results[num_workers]:>12.1f}{speedup:>10.2f}"
+              f"{speedup * ref_workers / num_workers:>12.2f}")
+
+
+# Entry point module -> dataset of its model, None: import only
+STARTUP_ENTRIES = {
+    'predict_plate': 'plate',
+    'predict_custom': 'custom',
+    'predict_emnist': 'emnist',
+    'predict_bulk': 'plate',
+    'predict_video': 'plate',
+    'serve_plate': 'plate',
+    'eval_plate': None,
+    'pth2onnx': None,
+}
+
+# Run in a fresh interpreter: argv = module, model ('' for none), dataset, arch, device
+STARTUP_CODE = '''
+import sys, json, time
+t0 = time.time()
+import importlib
+importlib.import_module(sys.argv[1])
+result = dict(start=t0, imported=time.time())
+if sys.argv[2]:
+    import numpy as np
+    import torch
+    from utils.engine import build_engine, DATASETS
+    from utils.registry import expand_arch
+    engine = build_engine(sys.argv[2], dataset=sys.argv[3], device=torch.device(sys.argv[5]),
+                          **expand_arch(sys.argv[4]))
+    result['loaded'] = time.time()
+    h, w = DATASETS[sys.argv[3]]['size']
+    engine.predict_batch([np.zeros((h, w, 3), dtype=np.uint8)])
+    result['predicted'] = time.time()
+print(json.dumps(result))
+'''
+
+
+def run_startup(entry, weights, dataset, arch, device, importtime=False):
+    # Timestamps of one cold start relative to the process launch (ms), or the -X importtime report
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+          ['-c', STARTUP_CODE, entry, weights or '', dataset or '', arch, device]
+    launch = time.time()
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert proc.returncode == 0, f"{entry} failed:\n{proc.stderr[-2000:]}"
+    if importtime:
+        return proc.stderr
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {k: (v - launch) * 1000 for k, v in result.items()}
+
+
+def slowest_imports(report, top=5):
+    # Top-level modules of a -X importtime report by cumulative time (ms)
+    modules = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def startup(args):
+    models = {'plate': args.plate, 'custom': args.custom, 'emnist': args.emnist}
+
+    rows = []
+    for entry in args.entries:
+        dataset = STARTUP_ENTRIES[entry]
+        weights = models.get(dataset)
+        runs = [run_startup(entry, weights, dataset, args.arch, args.device) for _ in range(args.repeat)]
+
+        def median(key):
+            values = sorted(run[key] for run in runs if key in run)
+            return values[len(values) // 2] if len(values) > 0 else float('nan')
+
+        start, imported, loaded, predicted = median('start'), median('imported'), median('loaded'), median('predicted')
+        rows.append((entry, start, imported - start, loaded - imported, predicted - loaded, predicted))
+        top = slowest_imports(run_startup(entry, weights, dataset, args.arch, args.device, importtime=True), args.top)
+        print(f"{entry}: " + ', '.join(f"{name} {ms:.0f} ms" for ms, name in top))
+
+    print(f"\n{'entry':<16s}{'python (ms)':>12s}{'import (ms)':>12s}{'load (ms)':>11s}{'predict (ms)':>13s}"
+          f"{'first (ms)':>12s}  budget")
+    over = []
+    for entry, start, import_ms, load_ms, predict_ms, first_ms in rows:
+        ok = import_ms <= args.budget_ms
+        if not ok:
+            over.append(entry)
+        print(f"{entry:<16s}{start:>12.1f}{import_ms:>12.1f}{load_ms:>11.1f}{predict_ms:>13.1f}{first_ms:>12.1f}  "
+              f"{'ok' if ok else 'OVER'}")
+    if len(over) > 0:
+        print(f"Import time over {args.budget_ms:.0f} ms: {', '.join(over)}")
+        sys.exit(1)
+
+
+def main():
+    args = parse_opt()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    if args.command == 'latency':
+        latency(args)
+    elif args.command == 'amp':
+        amp(args)
+    elif args.command == 'serve':
+        serve(args)
+    elif args.command == 'pool':
+        pool(args)
+    elif args.command == 'startup':
+        startup(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午1:40
+@file: calibrate_cascade.py
+@author: zj
+@description: Calibrate the confidence threshold of a fast/slow model cascade (utils/cascade.py) on a validation split
+
+Both models predict every validation image once. For each threshold the cascade accuracy, the fraction of plates
+escalated to the slow model and the average cost per plate (GFLOPs of the architectures and measured ms) follow from
+these predictions. The lowest threshold (fewest escalations) that reaches the target accuracy is selected and written
+to the JSON report together with the sweep.
+
+Usage - CRNN_Tiny first, CRNN for the unsure plates, at most 0.1 points below the accuracy of CRNN:
+    $ python3 calibrate_cascade.py crnn_tiny-plate.pth crnn-plate.pth ../datasets/chinese_license_plate/recog/ --fast-arch crnn_tiny --slow-arch crnn
+
+Usage - LPRNetPlus first (ONNX), 98% target accuracy, no grammar check:
+    $ python3 calibrate_cascade.py lprnet_plus-plate.onnx crnn-plate.onnx ../datasets/chinese_license_plate/recog/ --fast-arch lprnet_plus --slow-arch crnn --target-acc 98 --no-grammar
+
+"""
+
+import os
+import json
+import argparse
+
+import cv2
+import numpy as np
+
+import torch
+
+from utils.general import load_ocr_model, get_flops, PLATE_ARCHS
+from utils.engine import build_engine, DATASETS
+from utils.cascade import sweep_thresholds
+from utils.torchutil import time_sync
+from utils.dataset.plate import PlateDataset, is_plate_valid
+from utils.dataset.custom import CustomPlateDataset
+from utils.logger import LOGGER
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description='Calibrate a fast/slow model cascade')
+    parser.add_argument('fast', metavar='FAST', type=str, help='fast model (.pth/.torchscript/.onnx)')
+    parser.add_argument('slow', metavar='SLOW', type=str, help='slow model (.pth/.torchscript/.onnx)')
+    parser.add_argument('data', metavar='DIR', type=str, help='path to the plate/custom dataset')
+
+    parser.add_argument('--fast-arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                        help='architecture of the fast model')
+    parser.add_argument('--slow-arch', type=str, default='crnn', choices=list(PLATE_ARCHS.keys()),
+                        help='architecture of the slow model')
+    parser.add_argument('--dataset', type=str, default='plate', choices=['plate', 'custom'], help='dataset type')
+    parser.add_argument('--target-acc', type=float, default=None,
+                        help='target cascade accuracy (%%), default: accuracy of the slow model - --max-drop')
+    parser.add_argument('--max-drop', type=float, default=0.1, help='accuracy points below the slow model')
+    parser.add_argument('--no-grammar', action='store_true', help='do not escalate invalid plates (plate dataset)')
+    parser.add_argument('--batch-size', type=int, default=64, help='prediction batch size')
+    parser.add_argument('--device', type=str, default='cpu', help='cpu or cuda')
+    parser.add_argument('--report', type=str, default='runs/cascade.json', help='JSON report')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def load_samples(args):
+    # [(image path, label)] of the validation split
+    if args.dataset == 'plate':
+        return PlateDataset(args.data, is_train=False).data_list
+    dataset = CustomPlateDataset(os.path.join(args.data, 'images'), os.path.join(args.data, 'val.txt'),
+                                 is_train=False)
+    return list(zip(dataset.image_paths, dataset.labels))
+
+
+def arch_gflops(arch, dataset):
+    kwargs = dict(PLATE_ARCHS[arch])
+    c, h, w = kwargs.pop('img_shape')
+    model, _ = load_ocr_model(device=torch.device('cpu'), shape=(1, c, h, w),
+                              num_classes=len(DATASETS[dataset]['chars']), **kwargs)
+    return get_flops(model, img_shape=(1, c, h, w))
+
+
+def predict_all(engine, samples, batch_size):
+    # Predictions of all samples and the model time per image (ms), image decoding is not timed
+    results = []
+    elapsed = 0.
+    for i in range(0, len(samples), batch_size):
+        images = [cv2.imread(path) for path, _ in samples[i:i + batch_size]]
+        t0 = time_sync()
+        results.extend(engine.predict_batch(images))
+        elapsed += time_sync() - t0
+    return results, elapsed * 1000 / len(samples)
+
+
+def main():
+    args = parse_opt()
+    device = torch.device(args.device)
+    samples = load_samples(args)
+    labels = [label for _, label in samples]
+
+    outputs = dict()
+    for name, weights, arch in [('fast', args.fast, args.fast_arch), ('slow', args.slow, args.slow_arch)]:
+        kwargs = dict(PLATE_ARCHS[arch])
+        kwargs.pop('img_shape')
+        engine = build_engine(weights, dataset=args.dataset, device=device, **kwargs)
+        results, ms = predict_all(engine, samples, args.batch_size)
+        correct = np.array([text == label for (text, _), label in zip(results, labels)])
+        outputs[name] = dict(results=results, correct=correct, ms=ms, gflops=arch_gflops(arch, args.dataset))
+        LOGGER.info(f"{name} {weights}: acc {correct.mean() * 100:.3f}% {ms:.3f} ms/img")
+    fast, slow = outputs['fast'], outputs['slow']
+
+    confidences = np.array([confidence for _, confidence in fast['results']])
+    grammar = args.dataset == 'plate' and not args.no_grammar
+    invalid = np.array([not is_plate_valid(text) for text, _ in fast['results']]) if grammar else None
+    thresholds, accuracy, escalated = sweep_thresholds(confidences, fast['correct'], slow['correct'], invalid)
+
+    slow_acc = slow['correct'].mean()
+    target = args.target_acc / 100 if args.target_acc is not None else slow_acc - args.max_drop / 100
+    reached = np.nonzero(accuracy >= target)[0]
+    if len(reached) == 0:
+        LOGGER.warning(f"No threshold reaches {target * 100:.3f}%, escalating everything")
+        best = len(thresholds) - 1
+    else:
+        best = reached[0]
+
+    def cost(e):
+        return fast['gflops'] + e * slow['gflops'], fast['ms'] + e * slow['ms']
+
+    print(f"\nfast: {args.fast} {fast['correct'].mean() * 100:.3f}% {fast['gflops']:.3f} GFLOPs {fast['ms']:.3f} ms/img")
+    print(f"slow: {args.slow} {slow_acc * 100:.3f}% {slow['gflops']:.3f} GFLOPs {slow['ms']:.3f} ms/img")
+    print(f"target: {target * 100:.3f}% grammar: {grammar}\n")
+    print(f"{'threshold':>10s}{'acc (%)':>10s}{'escalated (%)':>15s}{'GFLOPs/plate':>14s}{'ms/plate':>10s}")
+    rows = []
+    for q in [0.5, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99]:
+        k = min(np.searchsorted(thresholds, q), len(thresholds) - 1)
+        rows.append(k)
+    rows = sorted(set(rows + [best]))
+    for k in rows:
+        gflops, ms = cost(escalated[k])
+        mark = ' <-' if k == best else ''
+        print(f"{thresholds[k]:>10.4f}{accuracy[k] * 100:>10.3f}{escalated[k] * 100:>15.2f}{gflops:>14.3f}"
+              f"{ms:>10.3f}{mark}")
+
+    gflops, ms = cost(escalated[best])
+    report = {
+        'fast': {'weights': args.fast, 'arch': args.fast_arch, 'accuracy': float(fast['correct'].mean()),
+                 'gflops': fast['gflops'], 'ms_per_plate': fast['ms']},
+        'slow': {'weights': args.slow, 'arch': args.slow_arch, 'accuracy': float(slow_acc),
+                 'gflops': slow['gflops'], 'ms_per_plate': slow['ms']},
+        'grammar': grammar,
+        'target_accuracy': float(target),
+        'threshold': float(thresholds[best]),
+        'accuracy': float(accuracy[best]),
+        'escalated': float(escalated[best]),
+        'gflops_per_plate': gflops,
+        'ms_per_plate': ms,
+        'sweep': [{'threshold': float(thresholds[k]), 'accuracy': float(accuracy[k]),
+                   'escalated': float(escalated[k])} for k in rows],
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    LOGGER.info(f"Threshold {thresholds[best]:.4f}: {accuracy[best] * 100:.3f}% with {escalated[best] * 100:.2f}% "
+                f"escalated, save report to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
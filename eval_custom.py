@@ -3,11 +3,10 @@ import os
 import torch
 from torch.utils.data import DataLoader
 from utils.dataset.custom import CustomPlateDataset
-from utils.model.crnn import CRNN
-from utils.model.lprnet import LPRNet
-from utils.loss import CTCLoss
+from utils.dataset.collate import pad_collate
+from utils.general import load_ocr_model
 from utils.evaluator import Evaluator
-from utils.torchutil import select_device
+from utils.torchutil import select_device, unwrap_model
 from utils.logger import LOGGER
 from utils.converter import get_custom_plate_chars
 
@@ -20,6 +19,14 @@ def parse_args():
     parser.add_argument('--use-origin-block', action='store_true')
     parser.add_argument('--add-stnet', action='store_true')
     parser.add_argument('--use-lstm', action='store_true')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--amp-dtype', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast dtype for inference, fp16 requires CUDA, bf16 suits CPUs with AMX/AVX512-BF16')
+    parser.add_argument('--keep-ratio', action='store_true',
+                        help='keep the aspect ratio of the crops and pad batches to the widest image (CRNN only)')
     return parser.parse_args()
 
 def main():
@@ -30,27 +37,33 @@ def main():
     input_shape = (94, 24) if args.use_lprnet else (168, 48)
     dataset = CustomPlateDataset(os.path.join(args.data_root, 'images'),
                                 os.path.join(args.data_root, 'val.txt'),
-                                input_shape=input_shape, is_train=False)
-    data_loader = DataLoader(dataset, batch_size=512, shuffle=False, num_workers=4, drop_last=False)
+                                input_shape=input_shape, is_train=False, keep_ratio=args.keep_ratio)
+    data_loader = DataLoader(dataset, batch_size=512, shuffle=False, num_workers=4, drop_last=False,
+                             collate_fn=pad_collate)
 
-    model = LPRNet(in_channel=3, num_classes=len(CUSTOM_CHARS) + 1,
-                   use_origin_block=args.use_origin_block, add_stnet=args.add_stnet).to(device) \
-        if args.use_lprnet else \
-        CRNN(in_channel=3, num_classes=len(CUSTOM_CHARS) + 1, cnn_input_height=input_shape[1],
-             is_tiny=not args.not_tiny, use_gru=not args.use_lstm).to(device)
-    model.load_state_dict(torch.load(args.pretrained, map_location=device))
-    model.eval()
+    # load_pretrained() also restores the channel counts of pruned checkpoints
+    model, device = load_ocr_model(pretrained=args.pretrained, device=device,
+                                   shape=(1, 3, input_shape[1], input_shape[0]), num_classes=len(CUSTOM_CHARS) + 1,
+                                   not_tiny=args.not_tiny, use_lstm=args.use_lstm, use_conv_head=args.use_conv_head,
+                                   use_nano=args.use_nano, width_mult=args.width_mult,
+                                   use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block,
+                                   add_stnet=args.add_stnet, use_compile=args.compile, amp_dtype=args.amp_dtype)
+    output_lengths = unwrap_model(model).output_lengths if args.keep_ratio else None
 
-    criterion = CTCLoss(blank_label=0).to(device)
     evaluator = Evaluator(blank_label=0)
 
     evaluator.reset()
-    for idx, (images, targets) in enumerate(data_loader):
+    for idx, (images, targets, widths) in enumerate(data_loader):
         images = images.to(device)
         targets = dataset.convert(targets)
         with torch.no_grad():
-            outputs = model(images).cpu()
-        acc = evaluator.update(outputs, targets)
+            if args.keep_ratio:
+                outputs = model(images, widths).cpu()
+                lengths = output_lengths(widths)
+            else:
+                outputs = model(images).cpu()
+                lengths = None
+        acc = evaluator.update(outputs, targets, lengths)
         LOGGER.info(f"Batch:{idx} ACC:{acc * 100:.3f}")
     acc = evaluator.result()
     LOGGER.info(f"ACC: {acc * 100:.3f}")
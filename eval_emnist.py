@@ -30,7 +30,13 @@ def parse_opt():
     parser.add_argument('val_root', metavar='DIR', type=str, help='path to val dataset')
 
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='Use this flag to specify non-tiny mode')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--amp-dtype', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast dtype for inference, fp16 requires CUDA, bf16 suits CPUs with AMX/AVX512-BF16')
 
     args = parser.parse_args()
     print(f"args: {args}")
@@ -43,7 +49,10 @@ def val(args, val_root, pretrained):
     digits_per_sequence = 5
 
     model, device = load_ocr_model(pretrained=pretrained, shape=(1, 1, img_h, digits_per_sequence * img_h),
-                                   num_classes=len(DIGITS_CHARS), not_tiny=args.not_tiny, use_lstm=args.use_lstm)
+                                   num_classes=len(DIGITS_CHARS), not_tiny=args.not_tiny, use_lstm=args.use_lstm,
+                                   use_conv_head=args.use_conv_head, use_nano=args.use_nano,
+                                   width_mult=args.width_mult, use_compile=args.compile,
+                                   amp_dtype=args.amp_dtype)
 
     val_dataset = EMNISTDataset(val_root, is_train=False, num_of_sequences=50000,
                                 digits_per_sequence=digits_per_sequence, img_h=img_h)
@@ -10,6 +10,9 @@ Usage - Single-GPU eval using CRNN_Tiny/CRNN:
     $ python3 eval_plate.py crnn_tiny-plate.pth ../datasets/chinese_license_plate/recog/
     $ python3 eval_plate.py crnn-plate.pth ../datasets/chinese_license_plate/recog/ --not-tiny
 
+Usage - Single-GPU eval using CRNN_Tiny with aspect-preserving resize:
+    $ python3 eval_plate.py crnn_tiny_kr-plate.pth ../datasets/chinese_license_plate/recog/ --keep-ratio
+
 Usage - Single-GPU eval using LPRNet/LPRNetPlus:
     $ python3 eval_plate.py lprnet_plus-plate.pth ../datasets/chinese_license_plate/recog/ --use-lprnet
     $ python3 eval_plate.py lprnet-plate.pth ../datasets/chinese_license_plate/recog/ --use-lprnet --use-origin-block
@@ -34,7 +37,9 @@ from torch.utils.data import DataLoader
 
 from utils.general import load_ocr_model
 from utils.dataset.plate import PlateDataset, PLATE_CHARS
+from utils.dataset.collate import pad_collate
 from utils.evaluator import Evaluator
+from utils.torchutil import unwrap_model
 
 
 def parse_opt():
@@ -43,11 +48,24 @@ def parse_opt():
     parser.add_argument('val_root', metavar='DIR', type=str, help='path to val dataset')
 
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='Use this flag to specify non-tiny mode')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--channels-last', action='store_true', help='use channels_last (NHWC) memory format')
+    parser.add_argument('--amp-dtype', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast dtype for inference, fp16 requires CUDA, bf16 suits CPUs with AMX/AVX512-BF16')
+    parser.add_argument('--keep-ratio', action='store_true',
+                        help='keep the aspect ratio of the crops and pad batches to the widest image (CRNN only)')
 
     parser.add_argument("--use-lprnet", action='store_true', help='use LPRNet instead of CRNN')
     parser.add_argument("--use-origin-block", action='store_true', help='use origin small_basic_block impl')
     parser.add_argument("--add-stnet", action='store_true', help='add STNet for training and evaluation')
+    parser.add_argument("--per-sample-norm", action='store_true',
+                        help='LPRNet: normalize the global context per sample (batch-invariant outputs)')
+    parser.add_argument("--stnet-loc-size", type=int, nargs=2, default=[24, 94], metavar=('H', 'W'),
+                        help='input size of the STNet localization network')
 
     parser.add_argument('--only-ccpd2019', action='store_true', help='only eval CCPD2019/test dataset')
     parser.add_argument('--only-ccpd2020', action='store_true', help='only eval CCPD2019/test dataset')
@@ -68,25 +86,38 @@ def val(args, val_root, pretrained):
         img_w = 168
         img_h = 48
     model, device = load_ocr_model(pretrained=pretrained, shape=(1, 3, img_h, img_w), num_classes=len(PLATE_CHARS),
-                                   not_tiny=args.not_tiny, use_lstm=args.use_lstm,
-                                   use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block, add_stnet=args.add_stnet)
-
+                                   not_tiny=args.not_tiny, use_lstm=args.use_lstm, use_conv_head=args.use_conv_head,
+                                   use_nano=args.use_nano, width_mult=args.width_mult,
+                                   use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block, add_stnet=args.add_stnet,
+                                   stnet_loc_size=args.stnet_loc_size, per_sample_norm=args.per_sample_norm,
+                                   use_compile=args.compile, channels_last=args.channels_last,
+                                   amp_dtype=args.amp_dtype)
+
+    assert not (args.keep_ratio and args.use_lprnet), '--keep-ratio only supports CRNN'
     val_dataset = PlateDataset(val_root, is_train=False, input_shape=(img_w, img_h), only_ccpd2019=args.only_ccpd2019,
-                               only_ccpd2020=args.only_ccpd2020, only_others=args.only_others)
+                               only_ccpd2020=args.only_ccpd2020, only_others=args.only_others,
+                               keep_ratio=args.keep_ratio)
     val_dataloader = DataLoader(val_dataset, batch_size=32, shuffle=False, num_workers=4, drop_last=False,
-                                pin_memory=True)
+                                pin_memory=True, collate_fn=pad_collate)
+    output_lengths = unwrap_model(model).output_lengths if args.keep_ratio else None
 
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
     blank_label = 0
     emnist_evaluator = Evaluator(blank_label=blank_label)
 
     pbar = tqdm(val_dataloader)
-    for idx, (images, targets) in enumerate(pbar):
-        images = images.to(device)
+    for idx, (images, targets, widths) in enumerate(pbar):
+        images = images.to(device, memory_format=memory_format)
         targets = val_dataset.convert(targets)
         with torch.no_grad():
-            outputs = model(images).cpu()
-
-        acc = emnist_evaluator.update(outputs, targets)
+            if args.keep_ratio:
+                outputs = model(images, widths).cpu()
+                lengths = output_lengths(widths)
+            else:
+                outputs = model(images).cpu()
+                lengths = None
+
+        acc = emnist_evaluator.update(outputs, targets, lengths)
         info = f"Batch:{idx} ACC:{acc * 100:.3f}"
         pbar.set_description(info)
     acc = emnist_evaluator.result()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午4:10
+@file: predict_bulk.py
+@author: zj
+@description: Bulk recognition of directories and file lists, streamed into a JSONL or CSV file
+
+Paths are streamed from a directory (recursively, sorted, so the order is the same on every run) or from list files
+with one path per line. Images are decoded by --decode-threads threads a few batches ahead of the model, every batch
+is one predict_batch() call. Results are written in large buffered writes, one record per image:
+
+    {"path": "...", "plate": "宁A87J92", "confidence": 0.981, "latency_ms": 0.42}
+
+latency_ms is the model time of the batch divided by its size, unreadable images get "plate": null and an "error".
+Every --checkpoint-interval batches the output is flushed and the number of done paths and the output size are saved to
+OUTPUT.progress. Running the same command again resumes: the output is cut back to the last checkpoint and the done
+paths are skipped. The progress file is removed when the run completes.
+
+Usage - Archive of plate crops, CRNN_Tiny ONNX model:
+    $ python3 predict_bulk.py crnn_tiny-plate.onnx ../datasets/archive/ runs/predict/archive.jsonl
+
+Usage - File lists, LPRNetPlus checkpoint, CSV output, 4 worker processes:
+    $ python3 predict_bulk.py lprnet_plus-plate.pth part-0.txt part-1.txt runs/predict/parts.csv --arch lprnet_plus --workers 4
+
+"""
+
+import os
+import io
+import csv
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from utils.general import PLATE_ARCHS
+from utils.engine import build_engine, DATASETS
+from utils.registry import expand_arch
+from utils.autotune import load_profile
+from utils.logger import LOGGER
+
+IMG_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+CSV_FIELDS = ['path', 'plate', 'confidence', 'latency_ms', 'error']
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description='Bulk recognition into a JSONL or CSV file')
+    parser.add_argument('pretrained', metavar='PRETRAINED', type=str, help='model (.pth/.torchscript/.onnx)')
+    parser.add_argument('sources', metavar='SOURCE', type=str, nargs='+',
+                        help='image directories or list files (one path per line)')
+    parser.add_argument('output', metavar='OUTPUT', type=str, help='result file (.jsonl or .csv)')
+
+    parser.add_argument('--arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                        help='architecture of .pth checkpoints')
+    parser.add_argument('--dataset', type=str, default='plate', choices=list(DATASETS.keys()), help='dataset type')
+    parser.add_argument('--backend', type=str, default=None, choices=['torch', 'torchscript', 'onnx'],
+                        help='inference backend, default: from the file suffix (.pth/.torchscript/.onnx)')
+    parser.add_argument('--device', type=str, default=None, help='cpu or cuda, default: cuda if available')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='images per model call, default: the autotune.py profile, else 64')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='CPU worker processes (utils/pool.py), 0: predict in this process')
+    parser.add_argument('--decode-threads', type=int, default=8, help='image decoding threads')
+    parser.add_argument('--prefetch', type=int, default=4, help='batches decoded ahead of the model')
+    parser.add_argument('--format', type=str, default=None, choices=['jsonl', 'csv'],
+                        help='output format, default: from the output suffix')
+    parser.add_argument('--checkpoint-interval', type=int, default=50, help='batches between progress checkpoints')
+    parser.add_argument('--restart', action='store_true', help='ignore the progress file and start over')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def iter_paths(sources):
+    # Image paths in a stable order, directories are walked lazily
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMG_SUFFIXES):
+                        yield os.path.join(root, name)
+        else:
+            with open(source, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) > 0 and not line.startswith('#'):
+                        yield line
+
+
+def iter_batches(paths, batch_size, skip=0):
+    batch = []
+    for i, path in enumerate(paths):
+        if i < skip:
+            continue
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def decode(path):
+    image = cv2.imread(path)
+    if image is not None and image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+def iter_decoded(batches, executor, prefetch):
+    # (paths, images) with up to prefetch batches decoding in the background
+    pending = deque()
+    for paths in batches:
+        pending.append((paths, [executor.submit(decode, path) for path in paths]))
+        if len(pending) > prefetch:
+            paths, futures = pending.popleft()
+            yield paths, [f.result() for f in futures]
+    while len(pending) > 0:
+        paths, futures = pending.popleft()
+        yield paths, [f.result() for f in futures]
+
+
+class ResultWriter:
+    """Records of one batch are formatted in memory and appended with a single write to a large buffer"""
+
+    def __init__(self, path, fmt, offset=0, buffer_size=1 << 22):
+        self.path = path
+        self.fmt = fmt
+        self.progress_path = path + '.progress'
+        new = offset == 0
+        mode = 'r+b' if not new and os.path.isfile(path) else 'wb'
+        self.f = open(path, mode, buffering=buffer_size)
+        # Drop records written after the last checkpoint
+        self.f.seek(offset)
+        self.f.truncate()
+        if new and fmt == 'csv':
+            self.f.write((','.join(CSV_FIELDS) + '\r\n').encode('utf-8'))
+
+    def write(self, records):
+        buf = io.StringIO()
+        if self.fmt == 'csv':
+            writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS, restval='')
+            writer.writerows(records)
+        else:
+            for record in records:
+                buf.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.f.write(buf.getvalue().encode('utf-8'))
+
+    def checkpoint(self, done):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        tmp = self.progress_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'done': done, 'offset': self.f.tell(), 'format': self.fmt}, f)
+        os.replace(tmp, self.progress_path)
+
+    def close(self, completed):
+        self.f.close()
+        if completed and os.path.isfile(self.progress_path):
+            os.remove(self.progress_path)
+
+
+def load_progress(args, fmt):
+    path = args.output + '.progress'
+    if args.restart or not os.path.isfile(path):
+        return 0, 0
+    with open(path) as f:
+        progress = json.load(f)
+    if not os.path.isfile(args.output):
+        LOGGER.warning(f"{args.output} is missing, start over")
+        return 0, 0
+    assert progress['format'] == fmt, f"{args.output} was written as {progress['format']}"
+    return progress['done'], progress['offset']
+
+
+def resolve_batch_size(args):
+    # --batch-size, else the batch size of the autotune.py profile of the model, else 64
+    if args.batch_size is not None:
+        return args.batch_size
+    profile = load_profile(args.pretrained)
+    if profile is not None and profile.get('batch_size', 1) > 1:
+        return profile['batch_size']
+    return 64
+
+
+def build_predictor(args, batch_size):
+    kwargs = dict(dataset=args.dataset, backend=args.backend, **expand_arch(args.arch))
+    if args.workers > 0:
+        from utils.pool import WorkerPool
+
+        pool = WorkerPool(args.pretrained, num_workers=args.workers, num_slots=2 * args.workers * batch_size,
+                          **kwargs)
+        pool.start()
+        return pool
+    device = None
+    if args.device is not None:
+        import torch
+        device = torch.device(args.device)
+    return build_engine(args.pretrained, device=device, **kwargs)
+
+
+def main():
+    args = parse_opt()
+    fmt = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    done, offset = load_progress(args, fmt)
+    if done > 0:
+        LOGGER.info(f"Resume {args.output} after {done} images")
+
+    # Final before the worker pool is sized with it
+    batch_size = resolve_batch_size(args)
+    predictor = build_predictor(args, batch_size)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    writer = ResultWriter(args.output, fmt, offset=offset)
+
+    completed = False
+    t_start = time.time()
+    num_images = num_errors = 0
+    model_time = 0.
+    try:
+        with ThreadPoolExecutor(args.decode_threads) as executor:
+            batches = iter_batches(iter_paths(args.sources), batch_size, skip=done)
+            for i, (paths, images) in enumerate(iter_decoded(batches, executor, args.prefetch)):
+                valid = [j for j, image in enumerate(images) if image is not None]
+                t0 = time.perf_counter()
+                results = predictor.predict_batch([images[j] for j in valid]) if len(valid) > 0 else []
+                elapsed = time.perf_counter() - t0
+                model_time += elapsed
+                latency_ms = elapsed * 1000 / max(len(valid), 1)
+
+                records = [{'path': path, 'plate': None, 'confidence': None, 'latency_ms': None,
+                            'error': 'cannot decode the image'} for path in paths]
+                for j, (text, confidence) in zip(valid, results):
+                    records[j] = {'path': paths[j], 'plate': text, 'confidence': round(float(confidence), 5),
+                                  'latency_ms': round(latency_ms, 4)}
+                writer.write(records)
+                done += len(paths)
+                num_images += len(paths)
+                num_errors += len(paths) - len(valid)
+
+                if (i + 1) % args.checkpoint_interval == 0:
+                    writer.checkpoint(done)
+                    duration = time.time() - t_start
+                    LOGGER.info(f"{done} images done, {num_images / duration:.1f} img/s "
+                                f"(model {model_time / max(num_images, 1) * 1000:.3f} ms/img), {num_errors} errors")
+        completed = True
+    finally:
+        if not completed:
+            # Interrupted: keep the progress of the last completed batch
+            writer.checkpoint(done)
+        writer.close(completed)
+        close = getattr(predictor, 'close', None)
+        if close is not None:
+            close()
+
+    duration = time.time() - t_start
+    LOGGER.info(f"{num_images} images in {duration:.1f} s ({num_images / max(duration, 1e-6):.1f} img/s), "
+                f"{num_errors} errors, save to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
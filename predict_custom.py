@@ -1,13 +1,8 @@
 import argparse
 import os
 import time
-import torch
-from PIL import Image
-import torchvision.transforms as transforms
-from utils.dataset.custom import CustomPlateDataset
-from utils.model.crnn import CRNN
-from utils.model.lprnet import LPRNet
-from utils.converter import StrLabelConverter, get_custom_plate_chars
+import cv2
+from utils.engine import build_engine
 from utils.torchutil import select_device
 from utils.logger import LOGGER
 
@@ -21,40 +16,30 @@ def parse_args():
     parser.add_argument('--use-origin-block', action='store_true')
     parser.add_argument('--add-stnet', action='store_true')
     parser.add_argument('--use-lstm', action='store_true')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--keep-ratio', action='store_true', help='keep the aspect ratio of the crop (CRNN only)')
+    parser.add_argument('--backend', type=str, default=None, choices=['torch', 'torchscript', 'onnx'],
+                        help='inference backend, default: from the file suffix (.pth/.torchscript/.onnx)')
     return parser.parse_args()
 
 def main():
     args = parse_args()
     device = select_device('', batch_size=1)
-    CUSTOM_CHARS = get_custom_plate_chars()
-    converter = StrLabelConverter()
 
-    input_shape = (94, 24) if args.use_lprnet else (168, 48)
-    model = LPRNet(in_channel=3, num_classes=len(CUSTOM_CHARS) + 1,
-                   use_origin_block=args.use_origin_block, add_stnet=args.add_stnet).to(device) \
-        if args.use_lprnet else \
-        CRNN(in_channel=3, num_classes=len(CUSTOM_CHARS) + 1, cnn_input_height=input_shape[1],
-             is_tiny=not args.not_tiny, use_gru=not args.use_lstm).to(device)
-    model.load_state_dict(torch.load(args.pretrained, map_location=device))
-    model.eval()
-
-    transform = transforms.Compose([
-        transforms.Resize((input_shape[1], input_shape[0])),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-    ])
-    image = Image.open(args.image_path).convert('RGB')
-    image = transform(image).unsqueeze(0).to(device)
+    engine = build_engine(args.pretrained, dataset='custom', backend=args.backend, device=device,
+                          keep_ratio=args.keep_ratio, not_tiny=args.not_tiny, use_lstm=args.use_lstm,
+                          use_conv_head=args.use_conv_head, use_nano=args.use_nano, width_mult=args.width_mult,
+                          use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block,
+                          add_stnet=args.add_stnet, use_compile=args.compile)
 
+    image = cv2.imread(args.image_path)
     t0 = time.time()
-    with torch.no_grad():
-        preds = model(image)
-        preds_size = torch.IntTensor([preds.size(0)]).to(device)
-        _, preds = preds.max(2)
-        preds = preds.transpose(1, 0).contiguous().view(-1)
-        pred_text = converter.decode(preds.data, preds_size.data, raw=False)
+    pred_text, confidence = engine.predict_batch([image])[0]
     predict_time = (time.time() - t0) * 1000
-    LOGGER.info(f"Pred: {pred_text} - Predict time: {predict_time:.1f} ms")
+    LOGGER.info(f"Pred: {pred_text} Conf: {confidence:.3f} - Predict time: {predict_time:.1f} ms")
 
     os.makedirs(args.save_dir, exist_ok=True)
     save_path = os.path.join(args.save_dir, f"plate_{os.path.basename(args.image_path)}")
@@ -16,13 +16,11 @@ import argparse
 
 import os
 import numpy as np
-from itertools import groupby
-import matplotlib.pyplot as plt
 
 import torch
 
-from utils.general import load_ocr_model
-from utils.dataset.emnist import EMNISTDataset, DIGITS_CHARS
+from utils.engine import build_engine
+from utils.dataset.emnist import EMNISTDataset
 
 
 def parse_opt():
@@ -32,7 +30,15 @@ def parse_opt():
     parser.add_argument('save_dir', metavar='DST', type=str, help='path to save dir')
 
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='Use this flag to specify non-tiny mode')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--backend', type=str, default=None, choices=['torch', 'torchscript', 'onnx'],
+                        help='inference backend, default: from the file suffix (.pth/.torchscript/.onnx)')
+    parser.add_argument('--amp-dtype', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast dtype for inference, fp16 requires CUDA, bf16 suits CPUs with AMX/AVX512-BF16')
 
     args = parser.parse_args()
     print(f"args: {args}")
@@ -44,28 +50,23 @@ def predict(args, val_root, pretrained, save_dir):
     img_h = 32
     digits_per_sequence = 5
 
-    model, device = load_ocr_model(pretrained=pretrained, shape=(1, 1, img_h, digits_per_sequence * img_h),
-                                   num_classes=len(DIGITS_CHARS), not_tiny=args.not_tiny, use_lstm=args.use_lstm)
+    engine = build_engine(pretrained, dataset='emnist', backend=args.backend, not_tiny=args.not_tiny,
+                          use_lstm=args.use_lstm, use_conv_head=args.use_conv_head, use_nano=args.use_nano,
+                          width_mult=args.width_mult, use_compile=args.compile, amp_dtype=args.amp_dtype)
 
     val_dataset = EMNISTDataset(val_root, is_train=False, num_of_sequences=50000,
                                 digits_per_sequence=digits_per_sequence, img_h=img_h)
 
-    plt.figure(figsize=(10, 6))
+    import matplotlib.pyplot as plt
 
-    blank_label = len(DIGITS_CHARS) - 1
-    for i in range(1, 7):
-        random_index = np.random.randint(len(val_dataset))
-        sequence, emnist_labels, transformed_images = val_dataset.__getitem__(random_index, return_tf=True)
+    plt.figure(figsize=(10, 6))
 
-        # [1, H, N*W] -> [1, 1, H, N*W]
-        images = sequence.unsqueeze(0).to(device)
-        with torch.no_grad():
-            output = model(images).cpu()[0]
+    samples = [val_dataset.__getitem__(np.random.randint(len(val_dataset)), return_tf=True) for _ in range(6)]
+    # One batch of the (unresized) digit sequences, the engine resizes them to the model input like EMNISTDataset
+    preds = engine.predict_batch([transformed_images for _, _, transformed_images in samples])
 
-        _, max_index = torch.max(output, dim=1)
-        raw_pred = list(max_index.numpy())
-        pred = torch.IntTensor([c for c, _ in groupby(raw_pred) if c != blank_label])
-        pred = pred.numpy()
+    for i, ((_, emnist_labels, transformed_images), (pred, _)) in enumerate(zip(samples, preds), 1):
+        pred = np.array([int(c) for c in pred])
         emnist_labels = emnist_labels.numpy()
         # print(pred, emnist_labels)
 
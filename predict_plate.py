@@ -10,6 +10,9 @@ Usage: Predict Plate using CRNN_Tiny/CRNN:
     $ python predict_plate.py crnn_tiny-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/
     $ python predict_plate.py crnn-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --not-tiny
 
+Usage: Predict Plate using CRNN_Tiny trained with --keep-ratio:
+    $ python predict_plate.py crnn_tiny_kr-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --keep-ratio
+
 Usage: Predict Plate using LPRNet/LPRNetPlus:
     $ python predict_plate.py lprnet_plus-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --use-lprnet
     $ python predict_plate.py lprnet-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --use-lprnet --use-origin-block
@@ -18,23 +21,23 @@ Usage: Predict Plate using LPRNet/LPRNetPlus+STNet:
     $ python predict_plate.py lprnet_plus_stnet-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --use-lprnet --add-stnet
     $ python predict_plate.py lprnet_stnet-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --use-lprnet --use-origin-block --add-stnet
 
+Usage: Predict Plate using LPRNetPlus+STNet, sampling the input directly from the original crop:
+    $ python predict_plate.py lprnet_plus_stnet-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --use-lprnet --add-stnet --stn-source
+
+Usage: Predict Plate with ONNX Runtime (pth2onnx.py) or TorchScript:
+    $ python predict_plate.py crnn_tiny-plate.onnx ./assets/plate/宁A87J92_0.jpg runs/predict/plate/
+    $ python predict_plate.py crnn_tiny-plate.pth ./assets/plate/宁A87J92_0.jpg runs/predict/plate/ --backend torchscript
+
 """
 
 import os
 import argparse
 import time
-from itertools import groupby
 
 import cv2
-import matplotlib.pyplot as plt
 
 import torch
 
-# cp assets/fonts/simhei.ttf /usr/share/fonts/truetype/noto/
-# rm -rf ~/.cache/matplotlib/*
-plt.rcParams["font.sans-serif"] = ["SimHei"]  # 设置字体
-plt.rcParams["axes.unicode_minus"] = False  # 该语句解决图像中的“-”负号的乱码问题
-
 import importlib
 
 # 根据脚本是否作为主模块运行来决定导入方式
@@ -43,22 +46,20 @@ if __name__ == '__main__':
     # CRNN = importlib.import_module('utils.model.crnn').CRNN
     # LPRNet = importlib.import_module('utils.model.lprnet').LPRNet
     PLATE_CHARS = importlib.import_module('utils.dataset.plate').PLATE_CHARS
-    model_info = importlib.import_module('utils.general').model_info
-    load_ocr_model = importlib.import_module('utils.general').load_ocr_model
+    build_engine = importlib.import_module('utils.engine').build_engine
 else:
     # 被导入时，尝试使用相对导入，如果失败则回退到绝对导入
     try:
         # CRNN = importlib.import_module('.utils.model.crnn', package=__package__).CRNN
         # LPRNet = importlib.import_module('.utils.model.lprnet', package=__package__).LPRNet
         PLATE_CHARS = importlib.import_module('.utils.dataset.plate', package=__package__).PLATE_CHARS
-        model_info = importlib.import_module('.utils.general', package=__package__).model_info
-        load_ocr_model = importlib.import_module('.utils.general', package=__package__).load_ocr_model
-    except ValueError:
+        build_engine = importlib.import_module('.utils.engine', package=__package__).build_engine
+    except (ValueError, TypeError):
+        # Top-level module (empty __package__)
         # CRNN = importlib.import_module('utils.model.crnn').CRNN
         # LPRNet = importlib.import_module('utils.model.lprnet').LPRNet
         PLATE_CHARS = importlib.import_module('utils.dataset.plate').PLATE_CHARS
-        model_info = importlib.import_module('.utils.general').model_info
-        load_ocr_model = importlib.import_module('.utils.general').load_ocr_model
+        build_engine = importlib.import_module('utils.engine').build_engine
 
 
 def parse_opt():
@@ -70,9 +71,25 @@ def parse_opt():
     parser.add_argument("--use-lprnet", action='store_true', help='use LPRNet instead of CRNN')
     parser.add_argument("--use-origin-block", action='store_true', help='use origin small_basic_block impl')
     parser.add_argument("--add-stnet", action='store_true', help='add STNet for training and evaluation')
+    parser.add_argument("--per-sample-norm", action='store_true',
+                        help='LPRNet: normalize the global context per sample (batch-invariant outputs)')
+    parser.add_argument("--stnet-loc-size", type=int, nargs=2, default=[24, 94], metavar=('H', 'W'),
+                        help='input size of the STNet localization network')
+    parser.add_argument("--stn-source", action='store_true',
+                        help='STNet samples the 24x94 input directly from the original crop (one interpolation)')
 
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='Use this flag to specify non-tiny mode')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--channels-last', action='store_true', help='use channels_last (NHWC) memory format')
+    parser.add_argument('--amp-dtype', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast dtype for inference, fp16 requires CUDA, bf16 suits CPUs with AMX/AVX512-BF16')
+    parser.add_argument('--keep-ratio', action='store_true', help='keep the aspect ratio of the crop (CRNN only)')
+    parser.add_argument('--backend', type=str, default=None, choices=['torch', 'torchscript', 'onnx'],
+                        help='inference backend, default: from the file suffix (.pth/.torchscript/.onnx)')
 
     args = parser.parse_args()
     print(f"args: {args}")
@@ -80,35 +97,19 @@ def parse_opt():
 
 
 @torch.no_grad()
-def predict_plate(image, model=None, device=None, img_h=48, img_w=168):
+def predict_plate(image, engine):
     start_time = time.time()
 
-    # Data
-    resize_image = cv2.resize(image, (img_w, img_h))
-
-    data = torch.from_numpy(resize_image).float() / 255.
-    # HWC -> CHW
-    data = data.permute(2, 0, 1)
-
-    # Infer
-    # [1, H, N*W] -> [1, 1, H, N*W]
-    data = data.unsqueeze(0).to(device)
-    with torch.no_grad():
-        output = model(data).cpu()[0]
-
-    _, max_index = torch.max(output, dim=1)
-    raw_pred = list(max_index.numpy())
-    blank_label = 0
-    pred = torch.IntTensor([c for c, _ in groupby(raw_pred) if c != blank_label])
-    pred = pred.numpy()
-
-    pred_plate = [PLATE_CHARS[i] for i in pred]
-    # pred_plate = ''.join(pred_plate)
-    pred_plate = ''.join(pred_plate[:2]) + "·" + ''.join(pred_plate[2:])
+    # Preprocessing, inference and decoding, see utils/engine.py
+    pred_plate, confidence = engine.predict_batch([image])[0]
+    pred_plate = pred_plate[:2] + "·" + pred_plate[2:]
 
     end_time = time.time()
     predict_time = (end_time - start_time) * 1000
-    print(f"Pred: {pred_plate} - Predict time: {predict_time :.1f} ms")
+    # Stage breakdown of the last batch (OCREngine only)
+    timings = getattr(engine, 'timings', None)
+    stages = f" ({', '.join(f'{k} {v * 1000:.1f}' for k, v in timings.items())})" if timings else ''
+    print(f"Pred: {pred_plate} Conf: {confidence:.3f} - Predict time: {predict_time :.1f} ms{stages}")
     return pred_plate, predict_time
 
 
@@ -122,21 +123,27 @@ def main():
         image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
 
     # Model
-    if args.use_lprnet:
-        img_w = 94
-        img_h = 24
-    else:
-        img_w = 168
-        img_h = 48
-    model, device = load_ocr_model(pretrained=args.pretrained, shape=(1, 3, img_h, img_w), num_classes=len(PLATE_CHARS),
-                                   not_tiny=args.not_tiny, use_lstm=args.use_lstm,
-                                   use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block,
-                                   add_stnet=args.add_stnet)
+    assert not (args.keep_ratio and args.use_lprnet), '--keep-ratio only supports CRNN'
+    assert not args.stn_source or (args.use_lprnet and args.add_stnet), '--stn-source needs LPRNet+STNet'
+    engine = build_engine(args.pretrained, dataset='plate', backend=args.backend, keep_ratio=args.keep_ratio,
+                          stn_source=args.stn_source, channels_last=args.channels_last,
+                          not_tiny=args.not_tiny, use_lstm=args.use_lstm, use_conv_head=args.use_conv_head,
+                          use_nano=args.use_nano, width_mult=args.width_mult,
+                          use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block,
+                          add_stnet=args.add_stnet, stnet_loc_size=args.stnet_loc_size,
+                          per_sample_norm=args.per_sample_norm,
+                          use_compile=args.compile, amp_dtype=args.amp_dtype)
 
     # Predict
-    pred_plate, _ = predict_plate(image=image, model=model, device=device, img_h=img_h, img_w=img_w)
+    pred_plate, _ = predict_plate(image=image, engine=engine)
+
+    # Draw, matplotlib is only imported (and its fonts configured) here, so importing predict_plate stays light
+    import matplotlib.pyplot as plt
 
-    # Draw
+    # cp assets/fonts/simhei.ttf /usr/share/fonts/truetype/noto/
+    # rm -rf ~/.cache/matplotlib/*
+    plt.rcParams["font.sans-serif"] = ["SimHei"]  # 设置字体
+    plt.rcParams["axes.unicode_minus"] = False  # 该语句解决图像中的“-”负号的乱码问题
     plt.figure()
     title = f"Pred: {pred_plate}"
 
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午3:40
+@file: predict_video.py
+@author: zj
+@description: Recognize the plates of a video, one fused plate per tracked box (utils/video.py)
+
+The plate boxes of every frame come from a sidecar file (--boxes, e.g. the output of a detector), without it the whole
+frame is the plate crop. Boxes are tracked across frames by IoU; a track is recognized every --every frames or when
+its crop changes by more than --change-threshold, and the recognitions are fused by voting. The report lists one
+plate per track and the fraction of crops that went through the model.
+
+Usage - CRNN_Tiny ONNX model, boxes of a detector, recognize every 5th frame per track:
+    $ python3 predict_video.py crnn_tiny-plate.onnx gate.mp4 runs/predict/video/ --boxes gate.txt --every 5
+
+Usage - Video of an already cropped plate, LPRNetPlus checkpoint, every frame decoded but only every 10th recognized:
+    $ python3 predict_video.py lprnet_plus-plate.pth plate.mp4 runs/predict/video/ --arch lprnet_plus --every 10
+
+Sidecar format, one box per line (frame index, box in pixels, extra columns such as a score are ignored):
+    0 412 630 588 676 0.93
+    1 414 631 590 677 0.95
+
+"""
+
+import os
+import json
+import time
+import argparse
+
+from utils.general import PLATE_ARCHS
+from utils.engine import build_engine, DATASETS
+from utils.registry import expand_arch
+from utils.video import VideoPlateRecognizer, read_frames, load_boxes
+from utils.dataset.plate import is_plate_valid
+from utils.logger import LOGGER
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description='Recognize the plates of a video')
+    parser.add_argument('pretrained', metavar='PRETRAINED', type=str, help='model (.pth/.torchscript/.onnx)')
+    parser.add_argument('video', metavar='VIDEO', type=str, help='path to the video file')
+    parser.add_argument('save_dir', metavar='DST', type=str, help='path to save dir')
+
+    parser.add_argument('--arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                        help='architecture of .pth checkpoints')
+    parser.add_argument('--dataset', type=str, default='plate', choices=['plate', 'custom'], help='dataset type')
+    parser.add_argument('--backend', type=str, default=None, choices=['torch', 'torchscript', 'onnx'],
+                        help='inference backend, default: from the file suffix (.pth/.torchscript/.onnx)')
+    parser.add_argument('--device', type=str, default=None, help='cpu or cuda, default: cuda if available')
+    parser.add_argument('--boxes', type=str, default=None,
+                        help='sidecar file of the plate boxes per frame (.txt/.json), default: the whole frame')
+    parser.add_argument('--every', type=int, default=5, help='recognize a track every N frames')
+    parser.add_argument('--change-threshold', type=float, default=0.25,
+                        help='fraction of changed dHash bits of the crop that triggers a recognition, <0: disabled')
+    parser.add_argument('--iou', type=float, default=0.3, help='IoU to continue a track')
+    parser.add_argument('--max-age', type=int, default=10, help='frames a track survives without a box')
+    parser.add_argument('--min-frames', type=int, default=3, help='drop tracks seen in fewer frames')
+    parser.add_argument('--stride', type=int, default=1, help='decode every N-th frame of the video')
+    parser.add_argument('--no-grammar', action='store_true', help='do not prefer valid plates in the vote (plate)')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def main():
+    args = parse_opt()
+    assert os.path.isfile(args.video), args.video
+
+    device = None
+    if args.device is not None:
+        import torch
+        device = torch.device(args.device)
+    engine = build_engine(args.pretrained, dataset=args.dataset, backend=args.backend, device=device,
+                          **expand_arch(args.arch))
+
+    if args.boxes is not None:
+        boxes = load_boxes(args.boxes)
+
+        def box_fn(frame, frame_idx):
+            return boxes.get(frame_idx, [])
+    else:
+        def box_fn(frame, frame_idx):
+            h, w = frame.shape[:2]
+            return [[0, 0, w, h]]
+
+    grammar = is_plate_valid if args.dataset == 'plate' and not args.no_grammar else None
+    recognizer = VideoPlateRecognizer(engine, every=args.every,
+                                      change_threshold=args.change_threshold if args.change_threshold >= 0 else None,
+                                      iou_threshold=args.iou, max_age=args.max_age, grammar=grammar)
+    t0 = time.time()
+    recognizer.process(read_frames(args.video, stride=args.stride), box_fn)
+    elapsed = time.time() - t0
+    tracks = recognizer.finish(min_frames=args.min_frames)
+    stats = recognizer.stats()
+
+    for track in tracks:
+        print(f"Track {track['id']:>4d} frames {track['first_frame']}-{track['last_frame']}: {track['plate']} "
+              f"Conf: {track['confidence']:.3f} ({track['recognitions']} of {track['frames']} crops recognized)")
+    LOGGER.info(f"{stats['frames']} frames in {elapsed:.1f} s ({stats['frames'] / max(elapsed, 1e-6):.1f} FPS), "
+                f"{stats['recognitions']} of {stats['crops']} crops recognized ({stats['recognized_rate'] * 100:.1f}%)")
+
+    os.makedirs(args.save_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.video))[0]
+    res_path = os.path.join(args.save_dir, f"{name}.json")
+    with open(res_path, 'w') as f:
+        json.dump({'video': args.video, 'model': args.pretrained, 'stats': stats, 'tracks': tracks}, f,
+                  indent=2, ensure_ascii=False)
+    print(f'Save to {res_path}')
+
+
+if __name__ == '__main__':
+    main()
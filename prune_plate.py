@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午2:40
+@file: prune_plate.py
+@author: zj
+@description: Prune a trained plate model to a FLOPs budget, then fine-tune it with the training loop of train_plate.py
+
+The pruned model is dense (channels are removed, not masked). Its checkpoints keep the usual file names and load with
+the same architecture flags as the unpruned model, e.g. eval_plate.py crnn-plate-b512-e10.pth ... --not-tiny
+LPRNet requires fine-tuning (--epochs > 0): see utils/prune.py.
+
+Usage - Prune CRNN to 1 GFLOPs and fine-tune for 10 epochs:
+    $ python3 prune_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_pruned-plate-b512/ --pretrained crnn-plate.pth --not-tiny --target-gflops 1.0 --device 0
+
+Usage - Prune LPRNetPlus+STNet:
+    $ python3 prune_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet_plus_stnet_pruned-plate-b512/ --pretrained lprnet_plus_stnet-plate.pth --use-lprnet --add-stnet --target-gflops 0.2 --device 0
+
+"""
+
+import torch
+
+from utils.general import load_ocr_model
+from utils.prune import prune_to_flops
+from utils.logger import LOGGER
+from utils.dataset.plate import PLATE_CHARS
+
+import train_plate
+
+
+def parse_opt():
+    parser = train_plate.make_parser()
+    parser.add_argument('--target-gflops', type=float, required=True, help='FLOPs budget of the pruned model')
+    parser.add_argument('--min-ratio', type=float, default=0.25, help='minimum ratio of channels kept per layer')
+    parser.set_defaults(epochs=10, lr=1e-4)
+
+    args = parser.parse_args()
+    assert args.pretrained, '--pretrained is required, it is the checkpoint to prune'
+    # Pruning the LPRNet stem changes the normalization of its global context feature, see utils/prune.py
+    assert not args.use_lprnet or args.epochs > 0, 'pruned LPRNet models must be fine-tuned, use --epochs > 0'
+    LOGGER.info(f"args: {args}")
+    return args
+
+
+def main():
+    opt = parse_opt()
+
+    img_shape = (1, 3, 24, 94) if opt.use_lprnet else (1, 3, 48, 168)
+    model, _ = load_ocr_model(pretrained=opt.pretrained, device=torch.device('cpu'), shape=img_shape,
+                              num_classes=len(PLATE_CHARS), not_tiny=opt.not_tiny, use_lstm=opt.use_lstm,
+                              use_lprnet=opt.use_lprnet, use_origin_block=opt.use_origin_block,
+                              add_stnet=opt.add_stnet, use_conv_head=opt.use_conv_head, use_nano=opt.use_nano,
+                              width_mult=opt.width_mult, per_sample_norm=opt.per_sample_norm)
+    model, _ = prune_to_flops(model, opt.target_gflops, img_shape=img_shape, min_ratio=opt.min_ratio)
+
+    # The pruned weights are passed in directly, do not load the unpruned checkpoint again
+    opt.pretrained = None
+    train_plate.main(opt, model=model)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,18 @@ Usage: Pytorch to ONNX:
     $ python3 pth2onnx.py crnn_tiny-emnist.pth crnn_tiny-emnist.onnx
     $ python3 pth2onnx.py crnn_tiny-plate.pth crnn_tiny-plate.onnx
 
+Usage: Dynamic batch (and width) axes, checked against PyTorch at batch sizes 1/4/16:
+    $ python3 pth2onnx.py crnn_tiny-plate.pth crnn_tiny-plate.onnx --dynamic
+    $ python3 pth2onnx.py crnn_tiny-plate.pth crnn_tiny-plate.onnx --dynamic --dynamic-width
+
+Usage: LPRNet/LPRNetPlus(+STNet), STNet needs opset 16 for grid_sample:
+    $ python3 pth2onnx.py lprnet_plus-plate.pth lprnet_plus-plate.onnx --use-lprnet --dynamic
+    $ python3 pth2onnx.py lprnet_plus_stnet-plate.pth lprnet_plus_stnet-plate.onnx --use-lprnet --add-stnet --dynamic
+
+Usage: End-to-end model, uint8 HWC BGR images in, per-frame argmax indices and probabilities out:
+    $ python3 pth2onnx.py crnn_tiny-plate.pth crnn_tiny-plate-e2e.onnx --dynamic --e2e resize
+    $ python3 pth2onnx.py lprnet_plus_stnet-plate.pth lprnet_plus_stnet-plate-e2e.onnx --use-lprnet --add-stnet --e2e resize --stn-source
+
 """
 
 import argparse
@@ -17,13 +29,13 @@ import os.path
 
 import numpy as np
 
-import onnx
-import onnxruntime
-
-import torch.onnx
+import torch
 import torch.nn as nn
 
 from utils.general import load_ocr_model
+from utils.model.e2e import EndToEnd
+from utils.engine import DATASETS
+from utils.converter import get_custom_plate_chars
 from utils.dataset.emnist import DIGITS_CHARS
 from utils.dataset.plate import PLATE_CHARS
 
@@ -34,7 +46,30 @@ def parse_opt():
     parser.add_argument("save", metavar="SAVE", type=str, default=None, help="Saving ONNX Path")
 
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='Use this flag to specify non-tiny mode')
+    parser.add_argument("--use-lprnet", action='store_true', help='use LPRNet instead of CRNN')
+    parser.add_argument("--use-origin-block", action='store_true', help='use origin small_basic_block impl')
+    parser.add_argument("--add-stnet", action='store_true', help='add STNet for training and evaluation')
+    parser.add_argument("--per-sample-norm", action='store_true',
+                        help='LPRNet: normalize the global context per sample (batch-invariant outputs)')
+    parser.add_argument("--stnet-loc-size", type=int, nargs=2, default=[24, 94], metavar=('H', 'W'),
+                        help='input size of the STNet localization net')
+
+    parser.add_argument('--dataset', type=str, default=None, choices=['emnist', 'plate', 'custom'],
+                        help='dataset of the model, default: inferred from the file name (plate or emnist)')
+    parser.add_argument('--dynamic', action='store_true', help='dynamic batch axis')
+    parser.add_argument('--dynamic-width', action='store_true', help='dynamic input width (and output frames) axis')
+    parser.add_argument('--opset', type=int, default=None, help='ONNX opset, default: 12, or 16 with STNet')
+    parser.add_argument('--check-batch-sizes', type=int, nargs='+', default=[1, 4, 16],
+                        help='batch sizes of the ONNXRuntime/PyTorch parity check (with --dynamic)')
+    parser.add_argument('--e2e', type=str, default=None, choices=['fixed', 'resize'],
+                        help='export with preprocessing and argmax in the graph, the input is uint8 [N, H, W, C] BGR. '
+                             'fixed: images already have the model input size, resize: any size, resized in the graph')
+    parser.add_argument("--stn-source", action='store_true',
+                        help='with --e2e resize and LPRNet+STNet, sample the STNet output from the full-size image')
 
     args = parser.parse_args()
     print(f"args: {args}")
@@ -43,11 +78,15 @@ def parse_opt():
 
 
 def check_onnx(onnx_path='pytorch.onnx'):
+    import onnx
+
     onnx_model = onnx.load(onnx_path)
     onnx.checker.check_model(onnx_model)
 
 
-def check_output(x, torch_out, onnx_path='pytorch.onnx'):
+def check_output(torch_model, shapes, onnx_path='pytorch.onnx'):
+    import onnxruntime
+
     # See https://blog.csdn.net/zunzunle/article/details/130087922
     print("Supported onnxruntime version: ", onnxruntime.__version__)
     print("Supported Opset versions: ", onnxruntime.get_available_providers())
@@ -63,35 +102,60 @@ def check_output(x, torch_out, onnx_path='pytorch.onnx'):
     def to_numpy(tensor):
         return tensor.detach().cpu().numpy() if tensor.requires_grad else tensor.cpu().numpy()
 
-    # compute ONNX Runtime output prediction
-    ort_inputs = {ort_session.get_inputs()[0].name: to_numpy(x)}
-    ort_outs = ort_session.run(None, ort_inputs)
-    print(x.shape, ort_outs[0].shape)
+    for shape in shapes:
+        x = torch.randn(shape)
+        with torch.no_grad():
+            torch_out = torch_model(x)
 
-    # compare ONNX Runtime and PyTorch results
-    np.testing.assert_allclose(to_numpy(torch_out), ort_outs[0], rtol=1e-03, atol=1e-05)
+        # compute ONNX Runtime output prediction
+        ort_inputs = {ort_session.get_inputs()[0].name: to_numpy(x)}
+        ort_outs = ort_session.run(None, ort_inputs)
+        print(x.shape, ort_outs[0].shape)
+
+        # compare ONNX Runtime and PyTorch results
+        np.testing.assert_allclose(to_numpy(torch_out), ort_outs[0], rtol=1e-03, atol=1e-05)
     print("Exported model has been tested with ONNXRuntime, and the result looks good!")
 
 
-def export_to_onnx(torch_model, shape=None, onnx_path="pytorch.onnx", is_dynamic=False):
+def add_metadata(onnx_path, metadata):
+    # Shown by ONNXRuntimePredictor (custom_metadata_map)
+    import onnx
+
+    onnx_model = onnx.load(onnx_path)
+    for key, value in metadata.items():
+        entry = onnx_model.metadata_props.add()
+        entry.key = key
+        entry.value = str(value)
+    onnx.save(onnx_model, onnx_path)
+
+
+def export_to_onnx(torch_model, shape=None, onnx_path="pytorch.onnx", is_dynamic=False, dynamic_width=False,
+                   opset_version=12, check_batch_sizes=(1,)):
     assert isinstance(torch_model, nn.Module)
+    # torch.onnx imports onnx (and onnxruntime), only load it when exporting
+    import torch.onnx
 
     # Input to the model
+    # Export with batch size 1, see the GRU warning in main(). The batch axis is made dynamic below
     x = torch.randn(shape, requires_grad=True)
-    torch_out = torch_model(x)
 
     # Export the model
+    # variable length axes, the output frames follow the input width
+    dynamic_axes = {'input': {}, 'output': {}}
     if is_dynamic:
-        # variable length axes
-        dynamic_axes = {'input': {0: 'batch_size'}, 'output': {0: 'batch_size'}}
-    else:
+        dynamic_axes['input'][0] = 'batch_size'
+        dynamic_axes['output'][0] = 'batch_size'
+    if dynamic_width:
+        dynamic_axes['input'][3] = 'width'
+        dynamic_axes['output'][1] = 'frames'
+    if not (is_dynamic or dynamic_width):
         dynamic_axes = None
 
     torch.onnx.export(torch_model,  # model being run
                       x,  # model input (or a tuple for multiple inputs)
                       onnx_path,  # where to save the model (can be a file or file-like object)
                       export_params=True,  # store the trained parameter weights inside the model file
-                      opset_version=12,  # the ONNX version to export the model to
+                      opset_version=opset_version,  # the ONNX version to export the model to
                       do_constant_folding=True,  # whether to execute constant folding for optimization
                       input_names=['input'],  # the model's input names
                       output_names=['output'],  # the model's output names
@@ -99,25 +163,125 @@ def export_to_onnx(torch_model, shape=None, onnx_path="pytorch.onnx", is_dynamic
                       )
 
     check_onnx(onnx_path=onnx_path)
-    check_output(x, torch_out, onnx_path=onnx_path)
+
+    # Parity at every batch size (and at twice the width), a static model is only checked with its own shape
+    N, C, H, W = shape
+    batch_sizes = check_batch_sizes if is_dynamic else [N]
+    widths = [W, W * 2] if dynamic_width else [W]
+    check_output(torch_model, [(n, C, H, w) for n in batch_sizes for w in widths], onnx_path=onnx_path)
+
+
+def check_e2e_output(torch_model, shapes, onnx_path='pytorch.onnx'):
+    import onnxruntime
+
+    ort_session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    print("Onnx info:")
+    print(f"    input: {ort_session.get_inputs()[0]}")
+    for output in ort_session.get_outputs():
+        print(f"    output: {output}")
+
+    for shape in shapes:
+        x = torch.randint(0, 256, shape, dtype=torch.uint8)
+        with torch.no_grad():
+            indices, probs = torch_model(x)
+        ort_indices, ort_probs = ort_session.run(None, {ort_session.get_inputs()[0].name: x.numpy()})
+        print(x.shape, ort_indices.shape, ort_probs.shape)
+
+        # Resize rounding can flip a few pixels at .5, which may change the argmax of a frame close to a tie
+        same = ort_indices == indices.numpy()
+        assert same.mean() > 0.99, f"{(~same).sum()}/{same.size} frames have a different argmax"
+        np.testing.assert_allclose(probs.numpy()[same], ort_probs[same], rtol=1e-03, atol=1e-04)
+    print("Exported model has been tested with ONNXRuntime, and the result looks good!")
+
+
+def export_e2e_to_onnx(torch_model, shape=None, onnx_path="pytorch.onnx", is_dynamic=False, dynamic_width=False,
+                       opset_version=12, check_batch_sizes=(1,)):
+    assert isinstance(torch_model, EndToEnd)
+    import torch.onnx
+    N, C, H, W = shape
+    # Export with a non-trivial image size, so that the traced Resize does not depend on the input being the model size
+    in_h, in_w = (H * 2 + 3, W * 2 + 5) if torch_model.resize else (H, W)
+    x = torch.randint(0, 256, (N, in_h, in_w, C), dtype=torch.uint8)
+
+    dynamic_axes = {'input': {}, 'indices': {}, 'probs': {}}
+    if is_dynamic:
+        for name in dynamic_axes:
+            dynamic_axes[name][0] = 'batch_size'
+    if torch_model.resize:
+        # Any image size, the output frames are fixed by the model input size
+        dynamic_axes['input'].update({1: 'height', 2: 'width'})
+    elif dynamic_width:
+        dynamic_axes['input'][2] = 'width'
+        dynamic_axes['indices'][1] = 'frames'
+        dynamic_axes['probs'][1] = 'frames'
+
+    torch.onnx.export(torch_model, x, onnx_path,
+                      export_params=True,
+                      opset_version=opset_version,
+                      do_constant_folding=True,
+                      input_names=['input'],
+                      output_names=['indices', 'probs'],
+                      dynamic_axes=dynamic_axes)
+
+    check_onnx(onnx_path=onnx_path)
+
+    batch_sizes = check_batch_sizes if is_dynamic else [N]
+    if torch_model.resize:
+        sizes = [(H, W), (in_h, in_w), (H * 3, W * 3 // 2)]
+    else:
+        sizes = [(H, W), (H, W * 2)] if dynamic_width else [(H, W)]
+    check_e2e_output(torch_model, [(n, h, w, C) for n in batch_sizes for h, w in sizes], onnx_path=onnx_path)
 
 
 def main(args):
     # UserWarning: Exporting a model to ONNX with a batch_size other than 1, with a variable length with GRU can cause an error when running the ONNX model with a different batch size.
     # Make sure to save the model with a batch size of 1, or define the initial states (h0/c0) as inputs of the model.
-    if 'plate' in os.path.basename(args.pretrained):
-        shape = (1, 3, 48, 168)
-        num_classes = len(PLATE_CHARS)
-    else:
+    dataset = args.dataset
+    if dataset is None:
+        dataset = 'plate' if 'plate' in os.path.basename(args.pretrained) else 'emnist'
+    if dataset == 'emnist':
+        assert not args.use_lprnet, 'LPRNet is only trained on plates'
         shape = (1, 1, 32, 160)
         num_classes = len(DIGITS_CHARS)
+    else:
+        shape = (1, 3, 24, 94) if args.use_lprnet else (1, 3, 48, 168)
+        num_classes = len(PLATE_CHARS) if dataset == 'plate' else len(get_custom_plate_chars()) + 1
 
     model, _ = load_ocr_model(pretrained=args.pretrained, device=torch.device("cpu"),
                               shape=shape, num_classes=num_classes,
-                              not_tiny=args.not_tiny, use_lstm=args.use_lstm)
+                              not_tiny=args.not_tiny, use_lstm=args.use_lstm, use_conv_head=args.use_conv_head,
+                              use_nano=args.use_nano, width_mult=args.width_mult,
+                              use_lprnet=args.use_lprnet, use_origin_block=args.use_origin_block,
+                              add_stnet=args.add_stnet, stnet_loc_size=args.stnet_loc_size,
+                              per_sample_norm=args.per_sample_norm)
+
+    # F.grid_sample (STNet) is exported as GridSample, which needs opset 16
+    opset_version = args.opset
+    if opset_version is None:
+        opset_version = 16 if args.use_lprnet and args.add_stnet else 12
+    assert not (args.use_lprnet and args.add_stnet) or opset_version >= 16, 'STNet needs --opset 16 or higher'
 
     onnx_path = args.save
-    export_to_onnx(model, shape=shape, onnx_path=onnx_path, is_dynamic=False)
+    metadata = {'dataset': dataset, 'input_shape': list(shape), 'num_classes': num_classes,
+                'dynamic_batch': args.dynamic, 'dynamic_width': args.dynamic_width}
+    if args.e2e is not None:
+        assert not args.stn_source or (args.use_lprnet and args.add_stnet), '--stn-source needs LPRNet+STNet'
+        assert not (args.stn_source and args.e2e == 'fixed'), '--stn-source needs --e2e resize'
+        assert not (args.dynamic_width and args.e2e == 'resize'), 'with --e2e resize any image width is accepted'
+        spec = DATASETS[dataset]
+        # eval() on the wrapper: torch.onnx.export restores the wrapper's training flag on all submodules afterwards
+        model = EndToEnd(model, input_size=shape[2:], resize=args.e2e == 'resize', stn_source=args.stn_source,
+                         rgb=spec['color'] == 'rgb', mean=spec['mean'], std=spec['std']).eval()
+        export_e2e_to_onnx(model, shape=shape, onnx_path=onnx_path, is_dynamic=args.dynamic,
+                           dynamic_width=args.dynamic_width, opset_version=opset_version,
+                           check_batch_sizes=args.check_batch_sizes)
+        input_format = 'uint8 NHWC BGR' if shape[1] == 3 else 'uint8 NHWC gray'
+        metadata.update({'e2e': args.e2e, 'input_format': input_format, 'stn_source': args.stn_source})
+    else:
+        export_to_onnx(model, shape=shape, onnx_path=onnx_path, is_dynamic=args.dynamic,
+                       dynamic_width=args.dynamic_width, opset_version=opset_version,
+                       check_batch_sizes=args.check_batch_sizes)
+    add_metadata(onnx_path, metadata)
     print(f"Save to {onnx_path}")
 
 
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午9:20
+@file: quantize_onnx.py
+@author: zj
+@description: Static int8 (QDQ) quantization of an exported plate ONNX model, calibrated on PlateDataset/CustomPlateDataset
+
+Calibration images are drawn from the training split, accuracy is measured on the val/test split for the fp32 and the
+int8 model. The report (size, latency, accuracy of both models) is printed and written next to the int8 model as JSON.
+
+Usage - CRNN_Tiny (export with pth2onnx.py first, --dynamic lets the evaluation run batched):
+    $ python3 pth2onnx.py crnn_tiny-plate.pth crnn_tiny-plate.onnx --dynamic
+    $ python3 quantize_onnx.py crnn_tiny-plate.onnx crnn_tiny-plate-int8.onnx ../datasets/chinese_license_plate/recog/
+
+Usage - LPRNetPlus on a custom dataset, entropy calibration with per-channel weights:
+    $ python3 quantize_onnx.py lprnet_plus-custom.onnx lprnet_plus-custom-int8.onnx datasets/custom/ --dataset custom --calibrate-method entropy --per-channel
+
+"""
+
+import os
+import json
+import argparse
+
+import onnx
+from onnxruntime.quantization import quantize_static, QuantFormat, QuantType, CalibrationMethod
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from utils.onnxutil import ONNXRuntimePredictor, DatasetCalibrationReader, evaluate_onnx, onnx_latency, file_size_mb
+from utils.dataset.plate import PlateDataset
+from utils.dataset.custom import CustomPlateDataset
+from utils.logger import LOGGER
+
+CALIBRATE_METHODS = {
+    'minmax': CalibrationMethod.MinMax,
+    'entropy': CalibrationMethod.Entropy,
+    'percentile': CalibrationMethod.Percentile,
+}
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description="Static int8 ONNX quantization")
+    parser.add_argument("model", metavar="MODEL", type=str, help="fp32 ONNX model exported by pth2onnx.py")
+    parser.add_argument("save", metavar="SAVE", type=str, help="path of the int8 ONNX model")
+    parser.add_argument('data', metavar='DIR', type=str, help='path to the plate/custom dataset')
+
+    parser.add_argument('--dataset', type=str, default='plate', choices=['plate', 'custom'], help='dataset type')
+    parser.add_argument('--num-calib', type=int, default=512, help='number of calibration images')
+    parser.add_argument('--calibrate-method', type=str, default='minmax', choices=list(CALIBRATE_METHODS.keys()),
+                        help='activation range calibration')
+    parser.add_argument('--per-channel', action='store_true', help='per-channel weight quantization')
+    parser.add_argument('--batch-size', type=int, default=64, help='evaluation batch size (dynamic batch models)')
+    parser.add_argument('--report', type=str, default=None, help='JSON report, default: SAVE with .json suffix')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def build_datasets(args, input_shape):
+    # input_shape: (W, H)
+    if args.dataset == 'plate':
+        calib_dataset = PlateDataset(args.data, is_train=True, input_shape=input_shape, augment=False)
+        val_dataset = PlateDataset(args.data, is_train=False, input_shape=input_shape)
+    else:
+        # is_train=False disables the random augmentation of the training split
+        calib_dataset = CustomPlateDataset(os.path.join(args.data, 'images'), os.path.join(args.data, 'train.txt'),
+                                           input_shape=input_shape, is_train=False)
+        val_dataset = CustomPlateDataset(os.path.join(args.data, 'images'), os.path.join(args.data, 'val.txt'),
+                                         input_shape=input_shape, is_train=False)
+    return calib_dataset, val_dataset
+
+
+def main():
+    args = parse_opt()
+
+    fp32_model = ONNXRuntimePredictor(args.model)
+    assert not fp32_model.e2e, 'quantize the float-input model, not the end-to-end (--e2e) export'
+    if 'input_shape' in fp32_model.meta:
+        _, c, h, w = json.loads(fp32_model.meta['input_shape'])
+    else:
+        _, c, h, w = fp32_model.input_shape
+    calib_dataset, val_dataset = build_datasets(args, input_shape=(w, h))
+
+    # Shape inference and graph optimization before quantization, as recommended by onnxruntime
+    prep_path = os.path.splitext(args.save)[0] + '-prep.onnx'
+    quant_pre_process(args.model, prep_path)
+
+    input_name = onnx.load(prep_path).graph.input[0].name
+    reader = DatasetCalibrationReader(calib_dataset, input_name=input_name, batch_size=fp32_model.batch_size or 1,
+                                      num_samples=args.num_calib)
+    LOGGER.info(f"Calibrate with {args.num_calib} images, {args.calibrate_method}")
+    # QDQ: QuantizeLinear/DequantizeLinear pairs around the quantized ops, uint8 activations and int8 weights (U8S8)
+    # run on the VNNI kernels of x86 CPUs. Ops without int8 kernels (GRU/LSTM) stay in fp32
+    quantize_static(prep_path, args.save, reader,
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=args.per_channel,
+                    calibrate_method=CALIBRATE_METHODS[args.calibrate_method])
+    os.remove(prep_path)
+    LOGGER.info(f"Save to {args.save}")
+
+    report = dict()
+    for name, path in [('fp32', args.model), ('int8', args.save)]:
+        model = fp32_model if name == 'fp32' else ONNXRuntimePredictor(path)
+        batch_size = model.batch_size or args.batch_size
+        report[name] = {
+            'path': path,
+            'size_mb': file_size_mb(path),
+            'latency_b1_ms': onnx_latency(model, (1, c, h, w)) if model.batch_size in (None, 1) else None,
+            f'latency_b{batch_size}_ms': onnx_latency(model, (batch_size, c, h, w)),
+            'accuracy': evaluate_onnx(model, val_dataset, batch_size=args.batch_size),
+        }
+    report['settings'] = {'dataset': args.dataset, 'num_calib': args.num_calib,
+                          'calibrate_method': args.calibrate_method, 'per_channel': args.per_channel}
+
+    print(f"{'model':>6s}{'size (MB)':>12s}{'b1 (ms)':>10s}{'acc (%)':>10s}")
+    for name in ['fp32', 'int8']:
+        r = report[name]
+        latency = r['latency_b1_ms'] if r['latency_b1_ms'] is not None else float('nan')
+        print(f"{name:>6s}{r['size_mb']:>12.3f}{latency:>10.3f}{r['accuracy'] * 100:>10.3f}")
+
+    report_path = args.report or os.path.splitext(args.save)[0] + '.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    LOGGER.info(f"Save report to {report_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午11:20
+@file: serve_plate.py
+@author: zj
+@description: HTTP plate recognition service with dynamic micro-batching
+
+Concurrent requests are grouped into batches of up to --max-batch-size crops, a batch is started at the latest
+--max-wait-ms after its first request arrived (see utils/serving.py). A larger wait forms larger batches and raises the
+throughput at the cost of latency at low load, --max-wait-ms 0 only batches the requests that queue up while the
+previous batch runs.
+
+Models are served from a registry (utils/registry.py): PRETRAINED can be a directory of versions, the newest file is
+served, and a new or replaced file is loaded, warmed up and swapped in without dropping requests. --models adds more
+named models (plate, custom, emnist) to the same process.
+
+    POST /predict         body: encoded image (jpg/png/...)  ->  {"plate": "宁A87J92", "confidence": 0.98, ...}
+    POST /predict/NAME    the same for the model NAME of --models
+    GET  /health          ->  {"status": "ok"}
+    GET  /models          ->  version of every model
+    GET  /stats           ->  requests, batches, mean batch size, queue wait, cache hit rate per model
+    GET  /metrics         ->  Prometheus histograms of the stages (decode_image, preprocess, forward, ctc_decode),
+                              batch size, queue wait and request latency, see utils/metrics.py
+
+Usage - CRNN_Tiny ONNX model on port 8000:
+    $ python3 serve_plate.py crnn_tiny-plate.onnx --port 8000
+    $ curl --data-binary @assets/plate/宁A87J92_0.jpg http://127.0.0.1:8000/predict
+
+Usage - LPRNetPlus checkpoint, favour latency:
+    $ python3 serve_plate.py lprnet_plus-plate.pth --arch lprnet_plus --max-batch-size 16 --max-wait-ms 1
+
+Usage - 8 worker processes on a 32-core host (4 cores and threads each):
+    $ python3 serve_plate.py crnn_tiny-plate.pth --arch crnn_tiny --workers 8
+
+Usage - Parking-gate cameras repeating the same crop, cache near-identical crops for 2 seconds:
+    $ python3 serve_plate.py crnn_tiny-plate.onnx --cache-size 4096 --cache-ttl 2 --cache-key perceptual
+
+Usage - CRNN_Tiny first, CRNN for the plates below the threshold calibrated by calibrate_cascade.py:
+    $ python3 serve_plate.py crnn_tiny-plate.onnx --cascade runs/cascade.json
+
+Usage - Hot reload: copy new versions into runs/models/plate/, serve EMNIST digits as well:
+    $ python3 serve_plate.py runs/models/plate/ --arch crnn_tiny --models emnist=runs/models/emnist/
+
+Usage - Load test from another shell:
+    $ python3 benchmark.py serve --url http://127.0.0.1:8000 --concurrency 1 8 32 64 --duration 10
+
+"""
+
+import time
+import asyncio
+import argparse
+
+import cv2
+import numpy as np
+
+from utils.general import PLATE_ARCHS
+from utils.engine import build_engine, DATASETS
+from utils.registry import ModelRegistry, expand_arch, latest_model
+from utils.autotune import load_profile
+from utils.serving import MicroBatcher, HTTPServer, QueueFullError, json_response
+from utils.metrics import METRICS, REQUESTS, REQUEST_SECONDS, observe_stage
+from utils.logger import LOGGER
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser(description='Plate recognition HTTP service with dynamic batching')
+    parser.add_argument('pretrained', metavar='PRETRAINED', type=str,
+                        help='.pth, .torchscript or .onnx model, or a directory of versions (hot reload)')
+    parser.add_argument('--arch', type=str, default='crnn_tiny', choices=list(PLATE_ARCHS.keys()),
+                        help='architecture of a .pth checkpoint')
+    parser.add_argument('--dataset', type=str, default='plate', choices=list(DATASETS.keys()), help='dataset type')
+    parser.add_argument('--models', nargs='+', default=[], metavar='NAME=SOURCE',
+                        help='more models served at /predict/NAME, NAME is the dataset type unless the config.json '
+                             'of the SOURCE directory sets "dataset" (and "arch")')
+    parser.add_argument('--reload-interval', type=float, default=2.,
+                        help='seconds between checks for new model versions, 0: no hot reload')
+    parser.add_argument('--backend', type=str, default=None, choices=['torch', 'torchscript', 'onnx'],
+                        help='inference backend, default: from the file suffix (.pth/.torchscript/.onnx)')
+    parser.add_argument('--device', type=str, default=None, help='cpu or cuda, default: cuda if available')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=8000, help='listen port')
+    parser.add_argument('--max-batch-size', type=int, default=None,
+                        help='largest batch, default: the autotune.py throughput batch size, else 32')
+    parser.add_argument('--max-wait-ms', type=float, default=5., help='longest wait for a batch to fill')
+    parser.add_argument('--max-queue', type=int, default=1024, help='queued requests before answering 503')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='LRU cache of predictions keyed by the crop content (utils/cache.py), 0: disabled')
+    parser.add_argument('--cache-ttl', type=float, default=2., help='seconds a cached prediction stays valid')
+    parser.add_argument('--cache-key', type=str, default='content', choices=['content', 'perceptual'],
+                        help='content: identical pixels, perceptual: near-identical crops share an entry')
+    parser.add_argument('--cascade', type=str, default=None,
+                        help='calibrate_cascade.py report, plates below its threshold are re-run by its slow model')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='CPU worker processes pinned to their own cores (utils/pool.py), 0: run in this process')
+
+    args = parser.parse_args()
+    print(f"args: {args}")
+    return args
+
+
+def decode_images(items):
+    # Encoded image bytes to BGR images, None for bytes OpenCV cannot decode
+    return [cv2.imdecode(np.frombuffer(item, dtype=np.uint8), cv2.IMREAD_COLOR) for item in items]
+
+
+def make_predict_fn(engine):
+    def predict_fn(items):
+        t0 = time.perf_counter()
+        images = decode_images(items)
+        observe_stage('decode_image', t0)
+        valid = [i for i, image in enumerate(images) if image is not None]
+        results = [None] * len(items)
+        for i, result in zip(valid, engine.predict_batch([images[i] for i in valid])):
+            results[i] = result
+        return results
+
+    predict_fn.engine = engine
+    return predict_fn
+
+
+def predictor_stats(engine):
+    # CachedPredictor and CascadePredictor counters
+    stats = dict()
+    if hasattr(engine, 'cache'):
+        stats['cache'] = engine.cache.stats()
+        engine = engine.predictor
+    if hasattr(engine, 'stats'):
+        stats['cascade'] = engine.stats()
+    return stats
+
+
+def make_routes(batchers, registry, default):
+    def make_predict(batcher):
+        async def predict(body):
+            t0 = time.perf_counter()
+            try:
+                result = await batcher.submit(body)
+            except QueueFullError:
+                REQUESTS.inc('503')
+                raise
+            if result is None:
+                REQUESTS.inc('400')
+                return json_response({'error': 'cannot decode the image'}, 400)
+            plate, confidence = result
+            latency = time.perf_counter() - t0
+            REQUEST_SECONDS.observe(latency)
+            REQUESTS.inc('200')
+            return json_response({'plate': plate, 'confidence': float(confidence), 'latency_ms': latency * 1000})
+
+        return predict
+
+    async def health(body):
+        return json_response({'status': 'ok'})
+
+    async def metrics(body):
+        return 200, 'text/plain; version=0.0.4; charset=utf-8', METRICS.render().encode('utf-8')
+
+    async def models(body):
+        return json_response(registry.versions())
+
+    async def stats(body):
+        return json_response({name: {**batcher.stats(), **predictor_stats(batcher.predict_fn.engine)}
+                              for name, batcher in batchers.items()})
+
+    routes = {('POST', '/predict'): make_predict(batchers[default]), ('GET', '/health'): health,
+              ('GET', '/models'): models, ('GET', '/stats'): stats, ('GET', '/metrics'): metrics}
+    for name, batcher in batchers.items():
+        routes[('POST', f'/predict/{name}')] = make_predict(batcher)
+    return routes
+
+
+def resolve_batch_size(args):
+    # --max-batch-size, else the batch size of the autotune.py throughput profile of the served model, else 32
+    if args.max_batch_size is not None:
+        return args.max_batch_size
+    latest = latest_model(args.pretrained)
+    profile = load_profile(latest[0]) if latest is not None else None
+    if profile is not None and profile.get('batch_size', 1) > 1:
+        return profile['batch_size']
+    return 32
+
+
+def make_build_fn(args, max_batch_size):
+    # Engine in this process, or a worker pool that is closed when its version is retired
+    device = None
+    if args.device is not None and args.workers == 0:
+        import torch
+        device = torch.device(args.device)
+
+    def build(path, **kwargs):
+        kwargs = expand_arch(**kwargs)
+        if args.workers > 0:
+            from utils.pool import WorkerPool
+
+            pool = WorkerPool(path, num_workers=args.workers, num_slots=2 * args.workers * max_batch_size, **kwargs)
+            pool.start()
+            return pool
+        return build_engine(path, device=device, **kwargs)
+
+    return build
+
+
+def build_cascade(args, registry, name, fast):
+    # Fast model first, the slow model of the calibrate_cascade.py report for the plates below its threshold
+    import json
+    from utils.cascade import CascadePredictor
+    from utils.dataset.plate import is_plate_valid
+
+    with open(args.cascade) as f:
+        report = json.load(f)
+    registry.register(f'{name}_slow', report['slow']['weights'], dataset=args.dataset, arch=report['slow']['arch'])
+    print(f"cascade: {report['slow']['weights']} below {report['threshold']:.4f}")
+    grammar = is_plate_valid if report['grammar'] else None
+    return CascadePredictor(fast, registry.predictor(f'{name}_slow'), threshold=report['threshold'], grammar=grammar)
+
+
+async def serve(args, registry, predictors, max_batch_size):
+    concurrency = max(args.workers, 1)
+    batchers = dict()
+    for name, predictor in predictors.items():
+        batchers[name] = MicroBatcher(make_predict_fn(predictor), max_batch_size=max_batch_size,
+                                      max_wait_ms=args.max_wait_ms, max_queue=args.max_queue,
+                                      concurrency=concurrency)
+        batchers[name].start()
+    print(f"models: {list(predictors.keys())} max batch size: {max_batch_size} max wait: {args.max_wait_ms} ms "
+          f"concurrency: {concurrency}")
+    try:
+        await HTTPServer(make_routes(batchers, registry, default=args.dataset)).serve(args.host, args.port)
+    finally:
+        for batcher in batchers.values():
+            await batcher.stop()
+
+
+def main():
+    args = parse_opt()
+
+    # The batch size is final before the registry warms up engines and sizes worker pools with it
+    max_batch_size = resolve_batch_size(args)
+    # Warm up new versions at the largest batch size, the first calls allocate memory and pick kernels
+    registry = ModelRegistry(poll_interval=args.reload_interval, warmup_batch_sizes=(1, max_batch_size),
+                             build_fn=make_build_fn(args, max_batch_size))
+    sources = {args.dataset: (args.pretrained, dict(dataset=args.dataset, arch=args.arch, backend=args.backend))}
+    arch_kwargs = expand_arch(args.arch)
+    if arch_kwargs.get('use_lprnet') and not arch_kwargs.get('per_sample_norm') and max_batch_size > 1:
+        LOGGER.warning(f"{args.arch} normalizes its global context over the whole batch, batched predictions depend on "
+                       f"the other requests of the batch. Use a *_psn architecture (train_plate.py --per-sample-norm)")
+    for item in args.models:
+        name, source = item.split('=', 1)
+        sources[name] = (source, dict(dataset=name) if name in DATASETS else dict())
+
+    predictors = dict()
+    for name, (source, kwargs) in sources.items():
+        registry.register(name, source, **kwargs)
+        predictors[name] = registry.predictor(name)
+
+    if args.cascade is not None:
+        predictors[args.dataset] = build_cascade(args, registry, args.dataset, predictors[args.dataset])
+    if args.cache_size > 0:
+        from utils.cache import CachedPredictor, PredictionCache
+
+        caches = dict()
+        for name in list(predictors.keys()):
+            caches[name] = PredictionCache(max_size=args.cache_size, ttl=args.cache_ttl, key=args.cache_key)
+            predictors[name] = CachedPredictor(predictors[name], caches[name])
+
+        def clear_cache(name, version):
+            # Predictions of a replaced version are stale, the slow model of the cascade feeds the default model
+            caches.get(name, caches[args.dataset]).clear()
+
+        registry.add_listener(clear_cache)
+    if args.reload_interval > 0:
+        registry.start()
+
+    try:
+        asyncio.run(serve(args, registry, predictors, max_batch_size))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.stop()
+
+
+if __name__ == '__main__':
+    main()
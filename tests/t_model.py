@@ -7,6 +7,8 @@
 @description: 
 """
 
+from copy import deepcopy
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -88,6 +90,280 @@ def t_model():
     print(data.shape, outputs.shape)
 
 
+def t_conv_head():
+    from utils.model.crnn import CRNN
+
+    data = torch.randn(4, 3, 48, 168)
+    for is_tiny in [True, False]:
+        gru_model = CRNN(in_channel=3, num_classes=76, cnn_input_height=48, is_tiny=is_tiny).eval()
+        conv_model = CRNN(in_channel=3, num_classes=76, cnn_input_height=48, is_tiny=is_tiny, use_conv_head=True).eval()
+
+        with torch.no_grad():
+            gru_out = gru_model(data)
+            conv_out = conv_model(data)
+        # The conv head is a drop-in replacement: same number of frames and classes
+        assert gru_out.shape == conv_out.shape, (gru_out.shape, conv_out.shape)
+        assert torch.allclose(conv_out.exp().sum(-1), torch.ones(conv_out.shape[:2]), atol=1e-5)
+
+
+def t_nano():
+    from utils.model.crnn_nano import CRNNNano
+
+    for data, num_classes in [(torch.randn(4, 3, 48, 168), 76), (torch.randn(4, 1, 32, 160), 11)]:
+        for width_mult in [0.5, 1.0]:
+            for use_conv_head in [False, True]:
+                model = CRNNNano(in_channel=data.shape[1], num_classes=num_classes, cnn_input_height=data.shape[2],
+                                 width_mult=width_mult, use_conv_head=use_conv_head).eval()
+                with torch.no_grad():
+                    outputs = model(data)
+                # stride 2 along the width in the stem only
+                assert outputs.shape == (4, data.shape[3] // 2, num_classes), outputs.shape
+
+
+def t_variable_width():
+    from utils.model.crnn import CRNN
+    from utils.model.crnn_nano import CRNNNano
+    from utils.dataset.collate import pad_collate
+    from utils.loss import CTCLoss
+
+    widths = [60, 101, 168, 250]
+    batch = [(torch.randn(3, 48, w), 'label') for w in widths]
+    images, _, widths = pad_collate(batch)
+    assert images.shape == (4, 3, 48, 250)
+
+    for model in [CRNN(in_channel=3, num_classes=76, cnn_input_height=48, is_tiny=True),
+                  CRNN(in_channel=3, num_classes=76, cnn_input_height=48, is_tiny=False),
+                  CRNN(in_channel=3, num_classes=76, cnn_input_height=48, use_conv_head=True),
+                  CRNNNano(in_channel=3, num_classes=76, cnn_input_height=48),
+                  CRNNNano(in_channel=3, num_classes=76, cnn_input_height=48, use_conv_head=True)]:
+        model.eval()
+        lengths = model.output_lengths(widths)
+        with torch.no_grad():
+            outputs = model(images, widths)
+            # output_lengths() matches the number of frames of each unpadded image, and the padding does not leak into
+            # the frames of the padded batch
+            for i, ((image, _), length) in enumerate(zip(batch, lengths)):
+                single = model(image.unsqueeze(0))
+                assert single.shape[1] == length
+                assert torch.allclose(outputs[i, :length], single[0], atol=1e-4)
+        assert outputs.shape[1] == lengths.max()
+
+        targets = torch.randint(1, 76, (4 * 5,), dtype=torch.int32)
+        loss = CTCLoss(blank_label=0)(outputs, targets, torch.IntTensor([5] * 4), input_lengths=lengths)
+        assert torch.isfinite(loss)
+
+        # In train mode the BatchNorm statistics come from the unpadded columns only: an image padded to the batch
+        # width gives the same outputs and running statistics as the image alone
+        image = batch[0][0]
+        padded = torch.zeros(1, 3, 48, 250)
+        padded[..., :image.size(-1)] = image
+        alone, masked = deepcopy(model).train(), deepcopy(model).train()
+        with torch.no_grad():
+            single = alone(image.unsqueeze(0))
+            outputs = masked(padded, widths[:1])
+        assert torch.allclose(outputs[0, :lengths[0]], single[0], atol=1e-4)
+        for (name, buf), buf_masked in zip(alone.named_buffers(), masked.buffers()):
+            assert torch.allclose(buf.float(), buf_masked.float(), atol=1e-4), name
+
+
+def t_stnet():
+    from utils.model.stnet import STNet, affine_grid
+
+    theta = torch.randn(4, 2, 3)
+    size = (4, 3, 24, 94)
+    assert torch.allclose(affine_grid(theta, size), F.affine_grid(theta, size, align_corners=False), atol=1e-4)
+
+    model = STNet().eval()
+    src = torch.randn(2, 3, 70, 220)
+    x = F.interpolate(src, size=(24, 94), mode='bilinear', align_corners=False)
+    with torch.no_grad():
+        # STNet is initialized to the identity, sampling from the source equals resize
+        assert torch.allclose(model(x, src=src), x, atol=1e-4)
+
+        # Crops of different sizes in a zero-padded batch
+        padded = torch.zeros(2, 3, 140, 300)
+        padded[0, :, :70, :220] = src[0]
+        padded[1, :, :140, :300] = F.interpolate(src[1:], size=(140, 300), mode='bilinear', align_corners=False)
+        src_sizes = torch.tensor([[70, 220], [140, 300]])
+        out = model(x, src=padded, src_sizes=src_sizes)
+        assert torch.allclose(out[0], x[0], atol=1e-4)
+
+
+def t_lprnet_batch_invariance():
+    from utils.model.lprnet import LPRNet
+
+    torch.manual_seed(0)
+    x = torch.randn(256, 3, 24, 94)
+    # Contrast differs between crops, as between dark and bright plates
+    x[128:] *= 4
+    model = LPRNet(num_classes=76, per_sample_norm=True).eval()
+    # Same parameters, the batch-normalized model converts by loading its state_dict
+    old = LPRNet(num_classes=76).eval()
+    old.load_state_dict(model.state_dict())
+    with torch.no_grad():
+        batched = model(x)
+        single = torch.cat([model(x[i:i + 1]) for i in range(len(x))])
+        assert torch.allclose(batched, single, atol=1e-5)
+
+        # At batch size 1 both normalizations agree, in a batch the old one depends on the other samples
+        assert torch.allclose(old(x[:1]), single[:1], atol=1e-6)
+        assert not torch.allclose(old(x)[:1], single[:1], atol=1e-3)
+
+
+def t_e2e():
+    import cv2
+    import numpy as np
+    from utils.model.crnn import CRNN
+    from utils.model.e2e import EndToEnd, greedy_decode
+
+    crnn = CRNN(in_channel=3, num_classes=77, cnn_input_height=48).eval()
+    model = EndToEnd(crnn, input_size=(48, 168)).eval()
+    image = np.random.randint(0, 256, (70, 220, 3), dtype=np.uint8)
+    with torch.no_grad():
+        indices, probs = model(torch.from_numpy(image[None]))
+        # Same as the Python preprocessing of predict_plate.py
+        data = torch.from_numpy(cv2.resize(image, (168, 48))).float() / 255.
+        log_probs = crnn(data.permute(2, 0, 1).unsqueeze(0))
+    assert indices.shape == probs.shape == log_probs.shape[:2]
+    assert (indices == log_probs.argmax(dim=-1)).float().mean() > 0.95
+
+    assert greedy_decode([0, 3, 3, 0, 3, 5, 0], np.array([1., .5, .8, 1., .9, .5, 1.])) == ([3, 3, 5], .8 * .9 * .5)
+
+
+def t_e2e_onnx():
+    import os
+    import tempfile
+    import numpy as np
+    import onnxruntime
+    from utils.model.crnn import CRNN
+    from utils.model.e2e import EndToEnd
+    from utils.engine import OCREngine, TorchBackend, build_engine
+    from pth2onnx import export_e2e_to_onnx
+
+    crnn = CRNN(in_channel=3, num_classes=77, cnn_input_height=48)
+    # Trained BN statistics, so that a graph (or a check) running BN in train mode differs
+    with torch.no_grad():
+        for m in crnn.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.running_mean.uniform_(-0.5, 0.5)
+                m.running_var.uniform_(0.5, 2.)
+    model = EndToEnd(crnn, input_size=(48, 168)).eval()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_path = os.path.join(tmp_dir, 'e2e.onnx')
+        # Also compares the graph with the torch model at several image sizes
+        export_e2e_to_onnx(model, shape=(1, 3, 48, 168), onnx_path=onnx_path, is_dynamic=True,
+                           check_batch_sizes=(1, 3))
+        assert not any(m.training for m in model.modules())
+
+        image = np.random.randint(0, 256, (2, 70, 220, 3), dtype=np.uint8)
+        session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        ort_indices, ort_probs = session.run(None, {session.get_inputs()[0].name: image})
+    with torch.no_grad():
+        indices, probs = model(torch.from_numpy(image))
+    assert (ort_indices == indices.numpy()).mean() > 0.99
+    assert np.allclose(ort_probs, probs.numpy(), atol=1e-3)
+
+    # --e2e fixed graphs do not resize, the engine resizes crops of any size as for the float model
+    crops = [np.random.randint(0, 256, (h, w, 3), dtype=np.uint8) for h, w in [(70, 220), (30, 100), (48, 168)]]
+    expected = OCREngine(TorchBackend(crnn.eval(), torch.device('cpu')), dataset='plate').predict_batch(crops)
+    fixed = EndToEnd(crnn, input_size=(48, 168), resize=False).eval()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_path = os.path.join(tmp_dir, 'e2e_fixed.onnx')
+        export_e2e_to_onnx(fixed, shape=(1, 3, 48, 168), onnx_path=onnx_path, is_dynamic=True)
+        engine = build_engine(onnx_path, dataset='plate')
+        assert engine.backend.e2e_fixed
+        results = engine.predict_batch(crops)
+    for (text, confidence), (expected_text, expected_confidence) in zip(results, expected):
+        assert text == expected_text and abs(confidence - expected_confidence) < 1e-3
+
+
+def t_engine():
+    import numpy as np
+    from utils.model.crnn import CRNN
+    from utils.engine import OCREngine, TorchBackend
+
+    model = CRNN(in_channel=3, num_classes=77, cnn_input_height=48).eval()
+    images = [np.random.randint(0, 256, (h, w, 3), dtype=np.uint8) for h, w in [(40, 150), (70, 220), (30, 200)]]
+    for keep_ratio in [False, True]:
+        engine = OCREngine(TorchBackend(model, torch.device('cpu')), dataset='plate', keep_ratio=keep_ratio)
+        results = engine.predict_batch(images)
+        assert len(results) == len(images)
+        # Batched prediction equals one image at a time
+        for image, (text, confidence) in zip(images, results):
+            single_text, single_confidence = engine.predict_batch([image])[0]
+            assert text == single_text and abs(confidence - single_confidence) < 1e-4, (text, single_text)
+            assert 0. <= confidence <= 1.
+
+
+def t_lazy_imports():
+    import os
+    import sys
+    import subprocess
+
+    # Importing an entry point must not load the optional heavy modules, they are imported by the features using them
+    code = ("import sys, predict_plate, pth2onnx, utils.general; "
+            "loaded = [m for m in ('thop', 'matplotlib', 'onnx', 'onnxruntime', 'torchvision', "
+            "'utils.model.crnn', 'utils.model.lprnet') if m in sys.modules]; "
+            "assert not loaded, loaded")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
+
+
+def t_prune():
+    from utils.model.crnn import CRNN
+    from utils.model.lprnet import LPRNet
+    from utils.prune import prune_model, rebuild_from_state_dict
+
+    def spread(model):
+        # Fresh models have all BN gammas at 1 and near-equal filter norms, give the channel scores a spread
+        with torch.no_grad():
+            for m in model.modules():
+                if isinstance(m, (nn.Conv2d, nn.BatchNorm2d)):
+                    scale = torch.linspace(0.1, 1., m.weight.shape[0])[torch.randperm(m.weight.shape[0])]
+                    m.weight.mul_(scale.view(-1, *[1] * (m.weight.dim() - 1)))
+        return model
+
+    def channels(model):
+        return sum(m.out_channels for m in model.modules() if isinstance(m, nn.Conv2d))
+
+    torch.manual_seed(0)
+    for build, data in [(lambda n: CRNN(in_channel=3, num_classes=n, cnn_input_height=48, is_tiny=False),
+                         torch.randn(2, 3, 48, 168)),
+                        (lambda n: LPRNet(num_classes=n, add_stnet=True), torch.randn(2, 3, 24, 94))]:
+        model = spread(build(76)).eval()
+        pruned = prune_model(model, threshold=0.5, min_ratio=0.25)
+        assert channels(pruned) < channels(model)
+        assert sum(p.numel() for p in pruned.parameters()) < sum(p.numel() for p in model.parameters())
+        with torch.no_grad():
+            assert pruned(data).shape == model(data).shape
+
+        # Pruned checkpoints load into the default architecture
+        rebuilt = rebuild_from_state_dict(build(76), pruned.state_dict())
+        rebuilt.load_state_dict(pruned.state_dict(), strict=True)
+        rebuilt.eval()
+        with torch.no_grad():
+            assert torch.allclose(rebuilt(data), pruned(data), atol=1e-5)
+
+        # Other mismatches, e.g. the number of classes, still fail the strict load
+        other = rebuild_from_state_dict(build(78), pruned.state_dict())
+        try:
+            other.load_state_dict(pruned.state_dict(), strict=True)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('a 76-class checkpoint loaded into a 78-class model')
+
+
 if __name__ == '__main__':
     t_model()
     t_module()
+    t_conv_head()
+    t_nano()
+    t_variable_width()
+    t_stnet()
+    t_lprnet_batch_invariance()
+    t_e2e()
+    t_e2e_onnx()
+    t_engine()
+    t_lazy_imports()
+    t_prune()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午5:30
+@file: t_serving.py
+@author: zj
+@description: Tests of the serving and batch-prediction utilities (cache, cascade, metrics, video, HTTP, worker pool,
+autotune profiles)
+"""
+
+
+def t_cache():
+    import numpy as np
+    from utils.cache import CachedPredictor, PredictionCache
+
+    class Counter:
+        calls = 0
+
+        def predict_batch(self, images):
+            self.calls += len(images)
+            return [(str(int(image.sum())), 1.) for image in images]
+
+    images = [np.random.default_rng(i).integers(0, 256, (48, 168, 3), dtype=np.uint8) for i in range(3)]
+    expected = [(str(int(image.sum())), 1.) for image in images]
+    for key in ['content', 'perceptual']:
+        predictor = CachedPredictor(Counter(), PredictionCache(max_size=2, key=key))
+        assert predictor.predict_batch(images[:2] * 2) == expected[:2] * 2
+        if key == 'content':
+            # Duplicates in a batch run once, the third image evicts the least recently used entry
+            assert predictor.predictor.calls == 2 and predictor.cache.stats()['misses'] == 4
+            assert predictor.predict_batch([images[1], images[2]]) == [expected[1], expected[2]]
+            assert predictor.predictor.calls == 3 and predictor.cache.stats()['hits'] == 1
+            assert predictor.cache.stats()['evictions'] == 1
+
+
+def t_cascade():
+    import numpy as np
+    from utils.cascade import sweep_thresholds
+
+    rng = np.random.default_rng(0)
+    confidences = rng.choice([0.3, 0.6, 0.9, 0.99], size=200)
+    fast_correct, slow_correct, invalid = rng.random(200) < confidences, rng.random(200) < 0.98, rng.random(200) < 0.1
+    thresholds, accuracy, escalated = sweep_thresholds(confidences, fast_correct, slow_correct, invalid)
+    # Against the cascade rule applied per threshold
+    for t, acc, esc in zip(thresholds, accuracy, escalated):
+        mask = (confidences < t) | invalid
+        assert abs(acc - np.where(mask, slow_correct, fast_correct).mean()) < 1e-9
+        assert abs(esc - mask.mean()) < 1e-9
+    assert escalated[0] == invalid.mean() and escalated[-1] == 1.
+
+
+def t_metrics():
+    from utils.metrics import Histogram
+
+    hist = Histogram('t_seconds', 'test', buckets=(0.001, 0.01, 0.1), label_names=('stage',))
+    for value in [0.0005, 0.005, 0.005, 0.05, 1.]:
+        hist.observe(value, 'forward')
+    lines = hist.render()
+    # Cumulative buckets, +Inf equals the count
+    assert 't_seconds_bucket{stage="forward",le="0.01"} 3' in lines
+    assert 't_seconds_bucket{stage="forward",le="+Inf"} 5' in lines and 't_seconds_count{stage="forward"} 5' in lines
+    assert hist.quantile(0.5, 'forward') == 0.01 and hist.quantile(0.99, 'forward') == float('inf')
+
+
+def t_video():
+    import numpy as np
+    from utils.video import VideoPlateRecognizer, vote
+
+    # Character-wise vote, the confidence of the weakest character over all results
+    text, confidence = vote([('宁A87J92', 0.9), ('宁A87J92', 0.9), ('宁A81J92', 0.5), ('宁A87J9', 0.4)])
+    assert text == '宁A87J92' and abs(confidence - 1.8 / 4) < 1e-9
+
+    class Reader:
+        calls = 0
+
+        def predict_batch(self, images):
+            self.calls += len(images)
+            return [('宁A87J92', 0.9)] * len(images)
+
+    frame = np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    recognizer = VideoPlateRecognizer(Reader(), every=5, change_threshold=None, max_age=2)
+    for frame_idx in range(20):
+        # One box moving slowly, a second one from frame 10
+        boxes = [[10 + frame_idx, 10, 110 + frame_idx, 40]] + ([[150, 100, 250, 130]] if frame_idx >= 10 else [])
+        recognizer.update(frame, frame_idx, boxes)
+    tracks = recognizer.finish()
+    assert [(t['id'], t['frames'], t['recognitions']) for t in tracks] == [(0, 20, 4), (1, 10, 2)]
+    assert recognizer.predictor.calls == 6 and tracks[0]['plate'] == '宁A87J92'
+
+
+def t_http_server():
+    import asyncio
+    from utils.serving import HTTPServer, json_response
+
+    async def echo(body):
+        return json_response({'size': len(body)}, 200)
+
+    async def request(port, raw):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(raw)
+        await writer.drain()
+        # Every case gets one response and the connection closed by the server
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return response.split(b'\r\n')[0].decode()
+
+    async def run():
+        server = await asyncio.start_server(HTTPServer({('POST', '/echo'): echo}, max_body=16).handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            head = b'POST /echo HTTP/1.1\r\nConnection: close\r\n'
+            assert await request(port, head + b'Content-Length: 3\r\n\r\nabc') == 'HTTP/1.1 200 OK'
+            # Rejected on the header, the 1 MB body is never sent
+            assert await request(port, head + b'Content-Length: 1048576\r\n\r\n') == 'HTTP/1.1 413 Payload Too Large'
+            assert await request(port, b'GARBAGE\r\n\r\n') == 'HTTP/1.1 400 Bad Request'
+            # Without Connection: close, the server closes after rejecting the length
+            for length in [b'abc', b'-5', b'1e3']:
+                raw = b'POST /echo HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\nabc'
+                assert await request(port, raw) == 'HTTP/1.1 400 Bad Request'
+        finally:
+            server.close()
+
+    asyncio.run(run())
+
+def t_pool():
+    import os
+    import signal
+    import tempfile
+    import numpy as np
+    import torch
+    from utils.model.crnn import CRNN
+    from utils.dataset.plate import PLATE_CHARS
+    from utils.engine import build_engine
+    from utils.pool import WorkerPool
+
+    rng = np.random.default_rng(0)
+    crops = [rng.integers(0, 256, (int(rng.integers(30, 90)), int(rng.integers(100, 300)), 3), dtype=np.uint8)
+             for _ in range(10)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        weights = os.path.join(tmp_dir, 'crnn_tiny-plate.pth')
+        torch.save(CRNN(in_channel=3, num_classes=len(PLATE_CHARS), cnn_input_height=48).state_dict(), weights)
+        expected = build_engine(weights, device=torch.device('cpu')).predict_batch(crops)
+
+        # Fewer slots than crops, the batch is split
+        pool = WorkerPool(weights, num_workers=2, num_slots=4, cores=[0])
+        pool.start()
+        try:
+            results = pool.predict_batch(crops)
+            assert [text for text, _ in results] == [text for text, _ in expected]
+            assert np.allclose([c for _, c in results], [c for _, c in expected], atol=1e-4)
+
+            # A worker dies while running a task: the task fails instead of blocking, and the worker is replaced
+            pids = [p.pid for p in pool.processes]
+            os.kill(pids[0], signal.SIGSTOP)
+            future = pool.submit(crops[:2])
+            assert pool.pending[max(pool.pending)][2] == 0
+            os.kill(pids[0], signal.SIGKILL)
+            try:
+                future.result(timeout=30)
+            except RuntimeError as e:
+                assert 'died' in str(e)
+            else:
+                raise AssertionError('the task of a dead worker succeeded')
+            assert pool.processes[0].pid != pids[0]
+            assert [text for text, _ in pool.predict_batch(crops[:4])] == [text for text, _ in results[:4]]
+        finally:
+            pool.close()
+
+
+
+def t_autotune_profile():
+    import os
+    import tempfile
+    from utils.autotune import load_profile, save_profile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'profiles.json')
+        # Models with the same file name in different directories keep separate profiles
+        save_profile(os.path.join(tmp, 'a', 'crnn_tiny-plate.pth'), dict(intra_op_threads=2), path=path)
+        save_profile(os.path.join(tmp, 'b', 'crnn_tiny-plate.pth'), dict(intra_op_threads=4), path=path)
+        assert load_profile(os.path.join(tmp, 'a', 'crnn_tiny-plate.pth'), path=path)['intra_op_threads'] == 2
+        assert load_profile(os.path.join(tmp, 'b', 'crnn_tiny-plate.pth'), path=path)['intra_op_threads'] == 4
+        assert load_profile(os.path.join(tmp, 'c', 'crnn_tiny-plate.pth'), path=path) is None
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(tmp)
+            assert load_profile(os.path.join('a', 'crnn_tiny-plate.pth'), path=path)['intra_op_threads'] == 2
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    t_cache()
+    t_cascade()
+    t_metrics()
+    t_video()
+    t_http_server()
+    t_pool()
+    t_autotune_profile()
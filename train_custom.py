@@ -7,6 +7,8 @@
 Usage - Single-GPU training using CRNN_Tiny/CRNN:
     $ python3 train_custom.py datasets/custom/ runs/crnn_tiny-custom-b512/ --batch-size 512 --device 0
     $ python3 train_custom.py datasets/custom/ runs/crnn-custom-b512/ --batch-size 512 --device 0 --not-tiny
+Usage - Single-GPU training using CRNN_Tiny with aspect-preserving resize (long labels are not squeezed):
+    $ python3 train_custom.py datasets/custom/ runs/crnn_tiny_kr-custom-b512/ --batch-size 512 --device 0 --keep-ratio
 Usage - Single-GPU training using LPRNet/LPRNetPlus:
     $ python3 train_custom.py datasets/custom/ runs/lprnet_plus-custom-b512/ --batch-size 512 --device 0 --use-lprnet
     $ python3 train_custom.py datasets/custom/ runs/lprnet-custom-b512/ --batch-size 512 --device 0 --use-lprnet --use-origin-block
@@ -23,16 +25,17 @@ import torch
 import torch.optim as optim
 import torch.distributed as dist
 from torch.utils.data import DataLoader, distributed
-from torch.amp import GradScaler, autocast
 from utils.model.crnn import CRNN
+from utils.model.crnn_nano import CRNNNano
 from utils.model.lprnet import LPRNet
 from utils.loss import CTCLoss
 from utils.evaluator import Evaluator
-from utils.torchutil import select_device
+from utils.torchutil import select_device, compile_model, select_amp_dtype, amp_autocast, amp_grad_scaler
 from utils.ddputil import smart_DDP
 from utils.logger import LOGGER
 from utils.general import init_seeds
 from utils.dataset.custom import CustomPlateDataset
+from utils.dataset.collate import pad_collate
 from utils.converter import get_custom_plate_chars
 
 LOCAL_RANK = int(os.getenv('LOCAL_RANK', -1))
@@ -45,10 +48,19 @@ def parse_opt():
     parser.add_argument('output', metavar='OUTPUT', type=str, help='path to output')
     parser.add_argument('--batch-size', type=int, default=512, help='total batch size for all GPUs')
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='use full CRNN instead of CRNN_Tiny')
+    parser.add_argument('--keep-ratio', action='store_true',
+                        help='keep the aspect ratio of the crops and pad batches to the widest image (CRNN only)')
     parser.add_argument('--use-lprnet', action='store_true', help='use LPRNet instead of CRNN')
     parser.add_argument('--use-origin-block', action='store_true', help='use origin small_basic_block impl')
     parser.add_argument('--add-stnet', action='store_true', help='add STNet for training and evaluation')
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--channels-last', action='store_true', help='use channels_last (NHWC) memory format')
+    parser.add_argument('--amp-dtype', type=str, default='auto', choices=['auto', 'fp32', 'fp16', 'bf16'],
+                        help='autocast dtype, auto: fp16 on CUDA and fp32 on CPU, use bf16 on CPUs with AMX/AVX512-BF16')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--seed', type=int, default=0, help='Global training seed')
     parser.add_argument('--local_rank', type=int, default=-1, help='Automatic DDP Multi-GPU argument')
@@ -62,10 +74,14 @@ def adjust_learning_rate(lr, warmup_epoch, optimizer, epoch: int, step: int, len
         param_group['lr'] = lr
 
 def train(opt, device):
-    data_root, batch_size, not_tiny, use_lstm, use_lprnet, use_origin_block, add_stnet, output = \
-        opt.data, opt.batch_size, opt.not_tiny, opt.use_lstm, opt.use_lprnet, opt.use_origin_block, opt.add_stnet, opt.output
+    data_root, batch_size, not_tiny, use_lstm, use_conv_head, use_lprnet, use_origin_block, add_stnet, output = \
+        opt.data, opt.batch_size, opt.not_tiny, opt.use_lstm, opt.use_conv_head, opt.use_lprnet, opt.use_origin_block, \
+        opt.add_stnet, opt.output
+    use_nano, width_mult = opt.use_nano, opt.width_mult
     if RANK in {-1, 0} and not os.path.exists(output):
         os.makedirs(output)
+    keep_ratio = opt.keep_ratio
+    assert not (keep_ratio and use_lprnet), '--keep-ratio only supports CRNN, LPRNet needs a fixed input width'
 
     LOGGER.info("=> Create Model")
     CUSTOM_CHARS = get_custom_plate_chars()
@@ -76,11 +92,23 @@ def train(opt, device):
         model_prefix = 'lprnet' if use_origin_block else 'lprnet_plus'
         if add_stnet:
             model_prefix += '_stnet'
+    elif use_nano:
+        input_shape = (168, 48)
+        model = CRNNNano(in_channel=3, num_classes=len(CUSTOM_CHARS) + 1, cnn_input_height=input_shape[1],
+                         width_mult=width_mult, use_gru=not use_lstm, use_conv_head=use_conv_head).to(device)
+        model_prefix = 'crnn_nano' if width_mult == 1.0 else f'crnn_nano_w{width_mult:g}'
+        if use_conv_head:
+            model_prefix += '_conv'
     else:
         input_shape = (168, 48)
         model = CRNN(in_channel=3, num_classes=len(CUSTOM_CHARS) + 1, cnn_input_height=input_shape[1],
-                     is_tiny=not not_tiny, use_gru=not use_lstm).to(device)
+                     is_tiny=not not_tiny, use_gru=not use_lstm, use_conv_head=use_conv_head).to(device)
         model_prefix = 'crnn' if not_tiny else 'crnn_tiny'
+        if use_conv_head:
+            model_prefix += '_conv'
+
+    memory_format = torch.channels_last if opt.channels_last else torch.contiguous_format
+    model = model.to(memory_format=memory_format)
 
     blank_label = 0
     criterion = CTCLoss(blank_label=blank_label).to(device)
@@ -94,27 +122,35 @@ def train(opt, device):
     LOGGER.info("=> Load data")
     train_dataset = CustomPlateDataset(data_root=os.path.join(data_root, 'images'),
                                       label_file=os.path.join(data_root, 'train.txt'),
-                                      input_shape=input_shape, is_train=True)
+                                      input_shape=input_shape, is_train=True, keep_ratio=keep_ratio)
     sampler = None if LOCAL_RANK == -1 else distributed.DistributedSampler(train_dataset, shuffle=True)
+    # pad_collate appends the image widths to every batch
     train_dataloader = DataLoader(train_dataset, batch_size=batch_size, shuffle=(sampler is None),
-                                  sampler=sampler, num_workers=4, drop_last=True, pin_memory=True)
+                                  sampler=sampler, num_workers=4, drop_last=True, pin_memory=True,
+                                  collate_fn=pad_collate)
     if RANK in {-1, 0}:
         val_dataset = CustomPlateDataset(data_root=os.path.join(data_root, 'images'),
                                         label_file=os.path.join(data_root, 'val.txt'),
-                                        input_shape=input_shape, is_train=False)
+                                        input_shape=input_shape, is_train=False, keep_ratio=keep_ratio)
         val_dataloader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=4,
-                                   drop_last=False, pin_memory=True)
+                                   drop_last=False, pin_memory=True, collate_fn=pad_collate)
         LOGGER.info("=> Load evaluator")
         evaluator = Evaluator(blank_label=blank_label)
 
     LOGGER.info("=> Start training")
     t0 = time.time()
-    amp = True
-    scaler = GradScaler('cuda', enabled=amp)
+    amp_dtype = select_amp_dtype(opt.amp_dtype, device)
+    LOGGER.info(f"AMP dtype: {amp_dtype}")
+    scaler = amp_grad_scaler(amp_dtype)
+
+    # Frames per sample of padded batches, taken before the model is wrapped by DDP/torch.compile
+    output_lengths = model.output_lengths if keep_ratio else None
 
     cuda = device.type != 'cpu'
     if cuda and RANK != -1:
         model = smart_DDP(model)
+    if opt.compile:
+        model = compile_model(model, device=device)
 
     epochs = 200
     start_epoch = 1
@@ -128,15 +164,20 @@ def train(opt, device):
         if LOCAL_RANK in {-1, 0}:
             pbar = tqdm(pbar)
         optimizer.zero_grad()
-        for idx, (images, targets) in enumerate(pbar):
+        for idx, (images, targets, widths) in enumerate(pbar):
             batch_size = len(images)
             targets = train_dataset.convert(targets)
             target_lengths = torch.IntTensor([len(t) for t in targets]).to(device)
             targets = torch.concat(targets).to(device)
 
-            with autocast('cuda', enabled=amp):
-                outputs = model(images.to(device))
-                loss = criterion(outputs, targets, target_lengths)
+            images = images.to(device, memory_format=memory_format)
+            with amp_autocast(device, amp_dtype):
+                if keep_ratio:
+                    outputs = model(images, widths)
+                    loss = criterion(outputs, targets, target_lengths, input_lengths=output_lengths(widths))
+                else:
+                    outputs = model(images)
+                    loss = criterion(outputs, targets, target_lengths)
             scaler.scale(loss).backward()
 
             if epoch <= warmup_epoch:
@@ -155,16 +196,22 @@ def train(opt, device):
             model.eval()
             save_path = os.path.join(output, f"{model_prefix}-custom-b{batch_size}-e{epoch}.pth")
             LOGGER.info(f"Save to {save_path}")
-            torch.save(model.state_dict(), save_path)
+            # Save the weights of the original module, not the torch.compile wrapper (_orig_mod.*)
+            torch.save(getattr(model, '_orig_mod', model).state_dict(), save_path)
 
             evaluator.reset()
             pbar = tqdm(val_dataloader)
-            for idx, (images, targets) in enumerate(pbar):
-                images = images.to(device)
+            for idx, (images, targets, widths) in enumerate(pbar):
+                images = images.to(device, memory_format=memory_format)
                 targets = val_dataset.convert(targets)
                 with torch.no_grad():
-                    outputs = model(images).cpu()
-                acc = evaluator.update(outputs, targets)
+                    if keep_ratio:
+                        outputs = model(images, widths).cpu()
+                        lengths = output_lengths(widths)
+                    else:
+                        outputs = model(images).cpu()
+                        lengths = None
+                acc = evaluator.update(outputs, targets, lengths)
                 info = f"Batch:{idx} ACC:{acc * 100:.3f}"
                 pbar.set_description(info)
             acc = evaluator.result()
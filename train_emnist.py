@@ -24,9 +24,10 @@ import torch.distributed as dist
 from torch.utils.data import DataLoader, distributed
 
 from utils.model.crnn import CRNN
+from utils.model.crnn_nano import CRNNNano
 from utils.loss import CTCLoss
 from utils.evaluator import Evaluator
-from utils.torchutil import select_device
+from utils.torchutil import select_device, compile_model, select_amp_dtype, amp_autocast, amp_grad_scaler
 from utils.ddputil import smart_DDP
 from utils.logger import LOGGER
 from utils.general import init_seeds
@@ -44,8 +45,15 @@ def parse_opt():
 
     parser.add_argument('--batch-size', type=int, default=512, help='total batch size for all GPUs, -1 for autobatch')
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='Use this flag to specify non-tiny mode')
 
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--channels-last', action='store_true', help='use channels_last (NHWC) memory format')
+    parser.add_argument('--amp-dtype', type=str, default='auto', choices=['auto', 'fp32', 'fp16', 'bf16'],
+                        help='autocast dtype, auto: fp16 on CUDA and fp32 on CPU, use bf16 on CPUs with AMX/AVX512-BF16')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--seed', type=int, default=0, help='Global training seed')
     parser.add_argument('--local_rank', type=int, default=-1, help='Automatic DDP Multi-GPU argument, do not modify')
@@ -65,7 +73,8 @@ def adjust_learning_rate(lr, warmup_epoch, optimizer, epoch: int, step: int, len
 
 
 def train(opt, device):
-    data_root, batch_size, not_tiny, use_lstm, output = opt.data, opt.batch_size, opt.not_tiny, opt.use_lstm, opt.output
+    data_root, batch_size, not_tiny, use_lstm, use_conv_head, output = \
+        opt.data, opt.batch_size, opt.not_tiny, opt.use_lstm, opt.use_conv_head, opt.output
     if RANK in {-1, 0} and not os.path.exists(output):
         os.makedirs(output)
 
@@ -75,8 +84,19 @@ def train(opt, device):
     input_shape = (digits_per_sequence * 5, img_h)
 
     LOGGER.info("=> Create Model")
-    model = CRNN(in_channel=1, num_classes=len(DIGITS_CHARS), cnn_input_height=input_shape[1], is_tiny=not not_tiny,
-                 use_gru=not use_lstm).to(device)
+    if opt.use_nano:
+        model = CRNNNano(in_channel=1, num_classes=len(DIGITS_CHARS), cnn_input_height=input_shape[1],
+                         width_mult=opt.width_mult, use_gru=not use_lstm, use_conv_head=use_conv_head).to(device)
+        model_prefix = 'crnn_nano' if opt.width_mult == 1.0 else f'crnn_nano_w{opt.width_mult:g}'
+    else:
+        model = CRNN(in_channel=1, num_classes=len(DIGITS_CHARS), cnn_input_height=input_shape[1],
+                     is_tiny=not not_tiny, use_gru=not use_lstm, use_conv_head=use_conv_head).to(device)
+        model_prefix = 'crnn' if not_tiny else 'crnn_tiny'
+    if use_conv_head:
+        model_prefix += '_conv'
+    memory_format = torch.channels_last if opt.channels_last else torch.contiguous_format
+    model = model.to(memory_format=memory_format)
+
     blank_label = len(DIGITS_CHARS) - 1
     criterion = CTCLoss(blank_label=blank_label).to(device)
 
@@ -108,13 +128,16 @@ def train(opt, device):
 
     LOGGER.info("=> Start training")
     t0 = time.time()
-    amp = True
-    scaler = torch.cuda.amp.GradScaler(enabled=amp)
+    amp_dtype = select_amp_dtype(opt.amp_dtype, device)
+    LOGGER.info(f"AMP dtype: {amp_dtype}")
+    scaler = amp_grad_scaler(amp_dtype)
 
     # DDP mode
     cuda = device.type != 'cpu'
     if cuda and RANK != -1:
         model = smart_DDP(model)
+    if opt.compile:
+        model = compile_model(model, device=device)
 
     epochs = 100
     start_epoch = 1
@@ -130,10 +153,10 @@ def train(opt, device):
             pbar = tqdm(pbar)
         optimizer.zero_grad()
         for idx, (images, targets) in enumerate(pbar):
-            images = images.to(device)
+            images = images.to(device, memory_format=memory_format)
             targets = targets.to(device)
 
-            with torch.cuda.amp.autocast(amp):
+            with amp_autocast(device, amp_dtype):
                 outputs = model(images)
                 loss = criterion(outputs, targets)
             scaler.scale(loss).backward()
@@ -152,17 +175,15 @@ def train(opt, device):
 
         if RANK in {-1, 0} and epoch % 5 == 0 and epoch > 0:
             model.eval()
-            if not_tiny:
-                save_path = os.path.join(output, f"crnn-emnist-b{batch_size}-e{epoch}.pth")
-            else:
-                save_path = os.path.join(output, f"crnn_tiny-emnist-b{batch_size}-e{epoch}.pth")
+            save_path = os.path.join(output, f"{model_prefix}-emnist-b{batch_size}-e{epoch}.pth")
             LOGGER.info(f"Save to {save_path}")
-            torch.save(model.state_dict(), save_path)
+            # Save the weights of the original module, not the torch.compile wrapper (_orig_mod.*)
+            torch.save(getattr(model, '_orig_mod', model).state_dict(), save_path)
 
             emnist_evaluator.reset()
             pbar = tqdm(val_dataloader)
             for idx, (images, targets) in enumerate(pbar):
-                images = images.to(device)
+                images = images.to(device, memory_format=memory_format)
                 with torch.no_grad():
                     outputs = model(images).cpu()
 
@@ -10,6 +10,26 @@ Usage - Single-GPU training using CRNN_Tiny/CRNN:
     $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_tiny-plate-b512/ --batch-size 512 --device 0
     $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn-plate-b512/ --batch-size 512 --device 0 --not-tiny
 
+Usage - Single-GPU training using CRNN_Tiny/CRNN with the convolutional sequence head:
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_tiny_conv-plate-b512/ --batch-size 512 --device 0 --use-conv-head
+
+Usage - Fine-tune from a checkpoint (e.g. a pruned model, see prune_plate.py):
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_pruned-plate-b512/ --batch-size 512 --device 0 --not-tiny --pretrained runs/crnn_pruned-plate-b512/crnn-plate-b512-e10.pth --epochs 20 --lr 1e-4
+
+Usage - Distill CRNN into CRNN_Tiny/LPRNetPlus (teacher log-probs cached on disk, which disables augmentation):
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_tiny_kd-plate-b512/ --batch-size 512 --device 0 --teacher crnn-plate.pth --teacher-arch crnn
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet_plus_kd-plate-b512/ --batch-size 512 --device 0 --use-lprnet --teacher crnn-plate.pth --teacher-arch crnn --teacher-cache ./runs/teacher_cache/
+
+Usage - Single-GPU training using CRNN_Nano (width multiplier 1.0/0.5):
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_nano-plate-b512/ --batch-size 512 --device 0 --use-nano
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_nano_w0.5-plate-b512/ --batch-size 512 --device 0 --use-nano --width-mult 0.5
+
+Usage - Single-GPU training using CRNN_Tiny with aspect-preserving resize (variable-width, padded batches):
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_tiny_kr-plate-b512/ --batch-size 512 --device 0 --keep-ratio
+
+Usage - CPU-only training with bf16 autocast (CPUs with AMX/AVX512-BF16):
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/crnn_tiny_bf16-plate-b512/ --batch-size 512 --device cpu --amp-dtype bf16
+
 Usage - Single-GPU training using LPRNet/LPRNetPlus:
     $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet_plus-plate-b512/ --batch-size 512 --device 0 --use-lprnet
     $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet-plate-b512/ --batch-size 512 --device 0 --use-lprnet --use-origin-block
@@ -18,6 +38,10 @@ Usage - Single-GPU training using LPRNet/LPRNetPlus+STNet:
     $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet_plus_stnet-plate-b512/ --batch-size 512 --device 0 --use-lprnet --add-stnet
     $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet_stnet-plate-b512/ --batch-size 512 --device 0 --use-lprnet --use-origin-block --add-stnet
 
+Usage - Fine-tune an LPRNetPlus checkpoint to the batch-invariant per-sample normalization (same parameters, so the
+checkpoint loads as is and already matches its old batch size 1 outputs):
+    $ python3 train_plate.py ../datasets/chinese_license_plate/recog/ ./runs/lprnet_plus_psn-plate-b512/ --batch-size 512 --device 0 --use-lprnet --per-sample-norm --pretrained lprnet_plus-plate.pth --epochs 10 --lr 1e-4
+
 """
 
 import argparse
@@ -32,38 +56,69 @@ import torch.distributed as dist
 from torch.utils.data import DataLoader, distributed
 
 from utils.model.crnn import CRNN
+from utils.model.crnn_nano import CRNNNano
 from utils.model.lprnet import LPRNet
-from utils.loss import CTCLoss
+from utils.loss import CTCLoss, DistillLoss
 from utils.evaluator import Evaluator
-from utils.torchutil import select_device
+from utils.torchutil import select_device, compile_model, select_amp_dtype, amp_autocast, amp_grad_scaler
 from utils.ddputil import smart_DDP
 from utils.logger import LOGGER
-from utils.general import init_seeds
+from utils.general import init_seeds, load_pretrained, PLATE_ARCHS
+from utils.distill import Teacher, IndexedDataset
 from utils.dataset.plate import PlateDataset, PLATE_CHARS
+from utils.dataset.collate import pad_collate
 
 LOCAL_RANK = int(os.getenv('LOCAL_RANK', -1))  # https://pytorch.org/docs/stable/elastic/run.html
 RANK = int(os.getenv('RANK', -1))
 WORLD_SIZE = int(os.getenv('WORLD_SIZE', 1))
 
 
-def parse_opt():
+def make_parser():
     parser = argparse.ArgumentParser(description='Training')
     parser.add_argument('data', metavar='DIR', type=str, help='path to chinese_license_plate dataset')
     parser.add_argument('output', metavar='OUTPUT', type=str, help='path to output')
 
     parser.add_argument('--batch-size', type=int, default=512, help='total batch size for all GPUs, -1 for autobatch')
+    parser.add_argument('--epochs', type=int, default=100, help='number of training epochs')
+    parser.add_argument('--lr', type=float, default=0.001, help='learning rate per GPU')
+    parser.add_argument('--pretrained', type=str, default=None, help='initial weights, i.e. a (pruned) checkpoint')
     parser.add_argument('--use-lstm', action='store_true', help='use nn.LSTM instead of nn.GRU')
+    parser.add_argument('--use-conv-head', action='store_true', help='use temporal 1D convolutions instead of nn.GRU')
+    parser.add_argument('--use-nano', action='store_true', help='use CRNN_Nano instead of CRNN')
+    parser.add_argument('--width-mult', type=float, default=1.0, help='width multiplier of CRNN_Nano')
     parser.add_argument('--not-tiny', action='store_true', help='use this flag to specify non-tiny mode')
 
+    parser.add_argument('--keep-ratio', action='store_true',
+                        help='keep the aspect ratio of the crops and pad batches to the widest image (CRNN only)')
+
     parser.add_argument("--use-lprnet", action='store_true', help='use LPRNet instead of CRNN')
     parser.add_argument("--use-origin-block", action='store_true', help='use origin small_basic_block impl')
     parser.add_argument("--add-stnet", action='store_true', help='add STNet for training and evaluation')
-
+    parser.add_argument("--per-sample-norm", action='store_true',
+                        help='LPRNet: normalize the global context per sample (batch-invariant outputs)')
+    parser.add_argument("--stnet-loc-size", type=int, nargs=2, default=[24, 94], metavar=('H', 'W'),
+                        help='input size of the STNet localization network')
+
+    parser.add_argument('--teacher', type=str, default=None, help='teacher checkpoint for knowledge distillation')
+    parser.add_argument('--teacher-arch', type=str, default='crnn', choices=list(PLATE_ARCHS.keys()),
+                        help='teacher architecture')
+    parser.add_argument('--teacher-cache', type=str, default=None,
+                        help='directory to cache the teacher log-probs, disables data augmentation')
+    parser.add_argument('--distill-alpha', type=float, default=1.0, help='weight of the distillation KL loss')
+    parser.add_argument('--distill-temperature', type=float, default=2.0, help='distillation temperature')
+
+    parser.add_argument('--compile', action='store_true', help='compile the model with torch.compile')
+    parser.add_argument('--channels-last', action='store_true', help='use channels_last (NHWC) memory format')
+    parser.add_argument('--amp-dtype', type=str, default='auto', choices=['auto', 'fp32', 'fp16', 'bf16'],
+                        help='autocast dtype, auto: fp16 on CUDA and fp32 on CPU, use bf16 on CPUs with AMX/AVX512-BF16')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--seed', type=int, default=0, help='Global training seed')
     parser.add_argument('--local_rank', type=int, default=-1, help='Automatic DDP Multi-GPU argument, do not modify')
+    return parser
 
-    args = parser.parse_args()
+
+def parse_opt():
+    args = make_parser().parse_args()
     LOGGER.info(f"args: {args}")
     return args
 
@@ -77,73 +132,130 @@ def adjust_learning_rate(lr, warmup_epoch, optimizer, epoch: int, step: int, len
         param_group['lr'] = lr
 
 
-def train(opt, device):
-    data_root, batch_size, not_tiny, use_lstm, use_lprnet, use_origin_block, add_stnet, output = \
-        opt.data, opt.batch_size, opt.not_tiny, opt.use_lstm, opt.use_lprnet, opt.use_origin_block, opt.add_stnet, opt.output
+def train(opt, device, model=None):
+    data_root, batch_size, not_tiny, use_lstm, use_conv_head, use_lprnet, use_origin_block, add_stnet, output = \
+        opt.data, opt.batch_size, opt.not_tiny, opt.use_lstm, opt.use_conv_head, opt.use_lprnet, opt.use_origin_block, \
+        opt.add_stnet, opt.output
+    use_nano, width_mult = opt.use_nano, opt.width_mult
     if RANK in {-1, 0} and not os.path.exists(output):
         os.makedirs(output)
+    keep_ratio = opt.keep_ratio
+    assert not (keep_ratio and use_lprnet), '--keep-ratio only supports CRNN, LPRNet needs a fixed input width'
+    assert not (keep_ratio and opt.teacher), '--keep-ratio is not supported for distillation'
 
     LOGGER.info("=> Create Model")
     if use_lprnet:
         # (W, H)
         input_shape = (94, 24)
-        model = LPRNet(in_channel=3, num_classes=len(PLATE_CHARS), use_origin_block=use_origin_block,
-                       add_stnet=add_stnet).to(device)
+        if model is None:
+            model = LPRNet(in_channel=3, num_classes=len(PLATE_CHARS), use_origin_block=use_origin_block,
+                           add_stnet=add_stnet, stnet_loc_size=opt.stnet_loc_size,
+                           per_sample_norm=opt.per_sample_norm)
         if use_origin_block:
             model_prefix = 'lprnet'
         else:
             model_prefix = "lprnet_plus"
         if add_stnet:
             model_prefix += '_stnet'
+        if opt.per_sample_norm:
+            model_prefix += '_psn'
+    elif use_nano:
+        input_shape = (168, 48)
+        if model is None:
+            model = CRNNNano(in_channel=3, num_classes=len(PLATE_CHARS), cnn_input_height=input_shape[1],
+                             width_mult=width_mult, use_gru=not use_lstm, use_conv_head=use_conv_head)
+        model_prefix = 'crnn_nano' if width_mult == 1.0 else f'crnn_nano_w{width_mult:g}'
+        if use_conv_head:
+            model_prefix += '_conv'
     else:
         input_shape = (168, 48)
-        model = CRNN(in_channel=3, num_classes=len(PLATE_CHARS), cnn_input_height=input_shape[1], is_tiny=not not_tiny,
-                     use_gru=not use_lstm).to(device)
+        if model is None:
+            model = CRNN(in_channel=3, num_classes=len(PLATE_CHARS), cnn_input_height=input_shape[1],
+                         is_tiny=not not_tiny, use_gru=not use_lstm, use_conv_head=use_conv_head)
         if not_tiny:
             model_prefix = 'crnn'
         else:
             model_prefix = "crnn_tiny"
+        if use_conv_head:
+            model_prefix += '_conv'
+
+    if opt.pretrained:
+        LOGGER.info(f"Loading pretrained: {opt.pretrained}")
+        model = load_pretrained(model, opt.pretrained)
+    memory_format = torch.channels_last if opt.channels_last else torch.contiguous_format
+    model = model.to(device, memory_format=memory_format)
 
     blank_label = 0
-    criterion = CTCLoss(blank_label=blank_label).to(device)
+    if opt.teacher:
+        criterion = DistillLoss(blank_label=blank_label, alpha=opt.distill_alpha,
+                                temperature=opt.distill_temperature).to(device)
+    else:
+        criterion = CTCLoss(blank_label=blank_label).to(device)
 
-    learn_rate = 0.001 * WORLD_SIZE
+    epochs = opt.epochs
+    learn_rate = opt.lr * WORLD_SIZE
     weight_decay = 1e-5
     LOGGER.info(f"Final learning rate: {learn_rate}, weight decay: {weight_decay}")
     optimizer = optim.Adam(model.parameters(), lr=learn_rate, weight_decay=weight_decay)
-    scheduler = optim.lr_scheduler.MultiStepLR(optimizer, milestones=[40, 70, 90])
+    scheduler = optim.lr_scheduler.MultiStepLR(optimizer, milestones=[int(epochs * m) for m in (0.4, 0.7, 0.9)])
 
     LOGGER.info("=> Load data")
-    train_dataset = PlateDataset(data_root, is_train=True, input_shape=input_shape)
+    # Cached teacher log-probs are only valid for deterministic inputs
+    augment = not (opt.teacher and opt.teacher_cache)
+    if not augment:
+        LOGGER.info("Data augmentation is disabled because the teacher log-probs are cached")
+    # The teacher input is resized from the original crop, not upsampled from the student input
+    teacher_shape = None
+    if opt.teacher:
+        _, h, w = PLATE_ARCHS[opt.teacher_arch]['img_shape']
+        teacher_shape = (w, h)
+    train_dataset = PlateDataset(data_root, is_train=True, input_shape=input_shape, augment=augment,
+                                 keep_ratio=keep_ratio, teacher_shape=teacher_shape)
     sampler = None if LOCAL_RANK == -1 else distributed.DistributedSampler(train_dataset, shuffle=True)
-    train_dataloader = DataLoader(train_dataset,
+    # pad_collate appends the image widths to every batch, samples are (image, label[, teacher image], index)
+    train_dataloader = DataLoader(IndexedDataset(train_dataset),
                                   batch_size=batch_size,
                                   shuffle=True and sampler is None,
                                   sampler=sampler,
                                   num_workers=4,
                                   drop_last=True,
-                                  pin_memory=True)
+                                  pin_memory=True,
+                                  collate_fn=pad_collate)
     if RANK in {-1, 0}:
-        val_dataset = PlateDataset(data_root, is_train=False, input_shape=input_shape)
+        val_dataset = PlateDataset(data_root, is_train=False, input_shape=input_shape, keep_ratio=keep_ratio)
         val_dataloader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=4, drop_last=False,
-                                    pin_memory=True)
+                                    pin_memory=True, collate_fn=pad_collate)
 
         LOGGER.info("=> Load evaluator")
         evaluator = Evaluator(blank_label=blank_label)
 
+    teacher = None
+    if opt.teacher:
+        LOGGER.info("=> Load teacher")
+        with torch.no_grad():
+            model.eval()
+            width = model(torch.zeros(1, 3, input_shape[1], input_shape[0], device=device)).shape[1]
+        teacher = Teacher(opt.teacher, opt.teacher_arch, device, num_classes=len(PLATE_CHARS), width=width,
+                          cache_dir=opt.teacher_cache, dataset_len=len(train_dataset))
+
     LOGGER.info("=> Start training")
     t0 = time.time()
-    amp = True
-    scaler = torch.cuda.amp.GradScaler(enabled=amp)
+    amp_dtype = select_amp_dtype(opt.amp_dtype, device)
+    LOGGER.info(f"AMP dtype: {amp_dtype}")
+    scaler = amp_grad_scaler(amp_dtype)
+
+    # Frames per sample of padded batches, taken before the model is wrapped by DDP/torch.compile
+    output_lengths = model.output_lengths if keep_ratio else None
 
     # DDP mode
     cuda = device.type != 'cpu'
     if cuda and RANK != -1:
         model = smart_DDP(model)
+    if opt.compile:
+        model = compile_model(model, device=device)
 
-    epochs = 100
     start_epoch = 1
-    warmup_epoch = 5
+    warmup_epoch = min(5, epochs)
     for epoch in range(start_epoch, epochs + start_epoch):
         # epoch: start from 1
         model.train()
@@ -154,16 +266,27 @@ def train(opt, device):
         if LOCAL_RANK in {-1, 0}:
             pbar = tqdm(pbar)
         optimizer.zero_grad()
-        for idx, (images, targets) in enumerate(pbar):
+        for idx, (images, targets, *teacher_images, indices, widths) in enumerate(pbar):
             batch_size = len(images)
 
             targets = train_dataset.convert(targets)
             target_lengths = torch.IntTensor([len(t) for t in targets]).to(device)
             targets = torch.concat(targets).to(device)
 
-            with torch.cuda.amp.autocast(amp):
-                outputs = model(images.to(device))
-                loss = criterion(outputs, targets, target_lengths)
+            images = images.to(device, memory_format=memory_format)
+            if teacher is not None:
+                teacher_images = teacher_images[0].to(device)
+            with amp_autocast(device, amp_dtype):
+                if keep_ratio:
+                    outputs = model(images, widths)
+                    loss = criterion(outputs, targets, target_lengths, input_lengths=output_lengths(widths))
+                else:
+                    outputs = model(images)
+                    if teacher is not None:
+                        teacher_preds = teacher(teacher_images, indices)
+                        loss = criterion(outputs, targets, target_lengths, teacher_preds=teacher_preds)
+                    else:
+                        loss = criterion(outputs, targets, target_lengths)
             scaler.scale(loss).backward()
 
             if epoch <= warmup_epoch:
@@ -178,21 +301,30 @@ def train(opt, device):
                 info = f"Epoch:{epoch} Batch:{idx} LR:{lr:.6f} Loss:{loss:.6f}"
                 pbar.set_description(info)
 
-        if RANK in {-1, 0} and epoch % 5 == 0 and epoch > 0:
+        if teacher is not None:
+            teacher.flush()
+
+        if RANK in {-1, 0} and (epoch % 5 == 0 or epoch == epochs) and epoch > 0:
             model.eval()
             save_path = os.path.join(output, f"{model_prefix}-plate-b{batch_size}-e{epoch}.pth")
             LOGGER.info(f"Save to {save_path}")
-            torch.save(model.state_dict(), save_path)
+            # Save the weights of the original module, not the torch.compile wrapper (_orig_mod.*)
+            torch.save(getattr(model, '_orig_mod', model).state_dict(), save_path)
 
             evaluator.reset()
             pbar = tqdm(val_dataloader)
-            for idx, (images, targets) in enumerate(pbar):
-                images = images.to(device)
+            for idx, (images, targets, widths) in enumerate(pbar):
+                images = images.to(device, memory_format=memory_format)
                 targets = val_dataset.convert(targets)
                 with torch.no_grad():
-                    outputs = model(images).cpu()
-
-                acc = evaluator.update(outputs, targets)
+                    if keep_ratio:
+                        outputs = model(images, widths).cpu()
+                        lengths = output_lengths(widths)
+                    else:
+                        outputs = model(images).cpu()
+                        lengths = None
+
+                acc = evaluator.update(outputs, targets, lengths)
                 info = f"Batch:{idx} ACC:{acc * 100:.3f}"
                 pbar.set_description(info)
             acc = evaluator.result()
@@ -202,7 +334,7 @@ def train(opt, device):
     LOGGER.info(f'\n{epochs} epochs completed in {(time.time() - t0) / 3600:.3f} hours.')
 
 
-def main(opt):
+def main(opt, model=None):
     # DDP mode
     device = select_device(opt.device, batch_size=opt.batch_size)
     if LOCAL_RANK != -1:
@@ -216,7 +348,7 @@ def main(opt):
 
     init_seeds(opt.seed + 1 + RANK, deterministic=False)
     # LOGGER.info(f"LOCAL_RANK: {LOCAL_RANK} RANK: {RANK} WORLD_SIZE: {WORLD_SIZE}")
-    train(opt, device)
+    train(opt, device, model=model)
 
 
 if __name__ == '__main__':
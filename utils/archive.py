@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午11:40
+@file: archive.py
+@author: zj
+@description: Sampled, non-blocking persistence of request images into append-only tar archives.
+
+    writer = ArchiveWriter('./runs/uploads/', sample_rate=0.1)
+    writer.submit(pil_image)    # returns at once, the JPEG encoding and the disk write run in a background thread
+
+Images go through a bounded queue: when the disk falls behind, new images are dropped (and counted) instead of
+blocking the request. The writer thread takes up to batch_size queued images at a time, encodes them and appends them
+to the current archive with one flush. An archive is rotated to a new file once it exceeds max_archive_mb, so the
+images of a burst end up in a few large files instead of many small ones:
+
+    ./runs/uploads/images-20261019-234000-9b1e.tar   20261019-234001-000001-3fa2c1.jpg, ...
+
+Extract with `tar -xf images-*.tar`. An archive that was not closed (killed process) lacks the end-of-archive
+blocks, tar and tarfile still read all complete members.
+"""
+
+import io
+import os
+import time
+import glob
+import uuid
+import queue
+import random
+import atexit
+import tarfile
+import threading
+from datetime import datetime
+
+from .logger import LOGGER
+
+
+class ArchiveWriter:
+
+    def __init__(self, root, sample_rate=1., max_queue=256, batch_size=32, max_archive_mb=512, max_archives=None,
+                 quality=90):
+        """
+        sample_rate: fraction of the submitted images that are kept
+        max_queue: images waiting for the writer thread, further images are dropped
+        max_archives: keep at most this many archives in root, the oldest ones are deleted on rotation
+        """
+        self.root = root
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.max_archive_bytes = max_archive_mb * 1024 * 1024
+        self.max_archives = max_archives
+        self.quality = quality
+        os.makedirs(root, exist_ok=True)
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_sampled_out = 0
+
+        self.archive = None
+        self.archive_path = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='archive-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def unique_name(self):
+        # Timestamp, process-wide counter and a random suffix: unique across requests, threads and processes
+        with self.lock:
+            self.counter += 1
+            counter = self.counter
+        return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{counter:06d}-{uuid.uuid4().hex[:6]}.jpg"
+
+    def submit(self, image):
+        """
+        image: PIL image or uint8 BGR ndarray. Never blocks, returns the archive member name or None when the image
+        was sampled out or dropped
+        """
+        if self.closed:
+            return None
+        if self.sample_rate < 1. and random.random() >= self.sample_rate:
+            self.num_sampled_out += 1
+            return None
+        name = self.unique_name()
+        try:
+            self.queue.put_nowait((name, image))
+        except queue.Full:
+            self.num_dropped += 1
+            return None
+        return name
+
+    def encode(self, image):
+        if hasattr(image, 'save'):
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, format='JPEG', quality=self.quality)
+            return buffer.getvalue()
+        import cv2
+        _, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return data.tobytes()
+
+    def open_archive(self):
+        if self.archive is not None:
+            self.archive.close()
+        if self.max_archives is not None:
+            archives = sorted(glob.glob(os.path.join(self.root, 'images-*.tar')), key=os.path.getmtime)
+            for path in archives[:max(len(archives) - self.max_archives + 1, 0)]:
+                os.remove(path)
+        self.archive_path = os.path.join(self.root, f"images-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+                                                    f"-{uuid.uuid4().hex[:4]}.tar")
+        self.archive = tarfile.open(self.archive_path, mode='w')
+        LOGGER.info(f"Archive uploads to {self.archive_path}")
+
+    def write_batch(self, batch):
+        if self.archive is None or self.archive.fileobj.tell() > self.max_archive_bytes:
+            self.open_archive()
+        now = time.time()
+        for name, image in batch:
+            data = self.encode(image)
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = now
+            self.archive.addfile(info, io.BytesIO(data))
+        self.archive.fileobj.flush()
+        self.num_written += len(batch)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self.write_batch(batch)
+            except Exception:
+                LOGGER.exception(f"Failed to archive {len(batch)} images")
+            if stop:
+                break
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def close(self, timeout=10.):
+        # Write what is queued and finish the archive
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join(timeout=timeout)
+
+    def stats(self):
+        return {'written': self.num_written, 'dropped': self.num_dropped, 'sampled_out': self.num_sampled_out,
+                'queued': self.queue.qsize(), 'archive': self.archive_path}
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午10:40
+@file: autotune.py
+@author: zj
+@description: Per-host inference profiles written by autotune.py and applied by the model loaders.
+
+Profiles are stored in one JSON file (CRNN_AUTOTUNE_PROFILE, default ./runs/autotune/profiles.json), keyed by the CPU
+model and core count of the host and then by the absolute path of the model file:
+
+    {"Intel(R) Xeon(R) Platinum 8480+ x112": {"/models/crnn_tiny-plate.onnx": {"backend": "onnx", ...}}}
+
+so a profile tuned on one type of machine is not applied on another, and models with the same file name in different
+directories keep separate profiles. The tuner and the loaders both read the file from CRNN_AUTOTUNE_PROFILE, so set it
+for both when the default location is not used.
+"""
+
+import os
+import json
+import platform
+
+import torch
+
+from .logger import LOGGER
+
+PROFILE_PATH = os.getenv('CRNN_AUTOTUNE_PROFILE', './runs/autotune/profiles.json')
+
+
+def host_key():
+    # CPU model name and number of logical cores
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{cpu} x{os.cpu_count()}"
+
+
+def load_profiles(path=PROFILE_PATH):
+    if not os.path.isfile(path):
+        return dict()
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_profile(weights, path=PROFILE_PATH):
+    # Profile of the model file on this host, None if it was not tuned here
+    if weights is None:
+        return None
+    return load_profiles(path).get(host_key(), dict()).get(os.path.abspath(weights))
+
+
+def save_profile(weights, profile, path=PROFILE_PATH):
+    profiles = load_profiles(path)
+    profiles.setdefault(host_key(), dict())[os.path.abspath(weights)] = profile
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+    LOGGER.info(f"Save autotune profile of {os.path.abspath(weights)} to {path}")
+
+
+def apply_torch_profile(profile):
+    # Intra-op threads can change at any time, inter-op threads only before the first parallel region
+    torch.set_num_threads(profile['intra_op_threads'])
+    if profile.get('inter_op_threads'):
+        try:
+            torch.set_num_interop_threads(profile['inter_op_threads'])
+        except RuntimeError:
+            pass
+    LOGGER.info(f"Autotune profile: {profile['intra_op_threads']} torch threads")
+
+
+def ort_session_options(profile=None):
+    # onnxruntime.SessionOptions of a profile, the onnxruntime defaults without one
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if profile is None:
+        return options
+    options.intra_op_num_threads = profile['intra_op_threads']
+    options.inter_op_num_threads = profile.get('inter_op_threads', 1)
+    options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel,
+                                               profile.get('graph_optimization_level', 'ORT_ENABLE_ALL'))
+    options.execution_mode = getattr(onnxruntime.ExecutionMode, profile.get('execution_mode', 'ORT_SEQUENTIAL'))
+    LOGGER.info(f"Autotune profile: intra {options.intra_op_num_threads} inter {options.inter_op_num_threads} "
+                f"{profile.get('graph_optimization_level')} {profile.get('execution_mode')}")
+    return options
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午12:50
+@file: cache.py
+@author: zj
+@description: Bounded LRU/TTL cache of plate predictions keyed by the crop content.
+
+    predictor = CachedPredictor(build_engine('crnn_tiny-plate.onnx'), PredictionCache(max_size=4096, ttl=2.))
+    predictor.predict_batch(images)      # same interface as OCREngine / WorkerPool
+    predictor.cache.stats()              # hits, misses, hit_rate, ...
+
+Keys:
+    content: hash of the raw pixels, only byte-identical crops hit (repeated frames, retried requests)
+    perceptual: difference hash of the crop downscaled to the 48x168 model input, so near-identical crops of a
+        stationary car (sensor noise, JPEG artifacts, small brightness changes) share a key. Different crops can
+        collide, the ttl bounds how long a wrong entry is served
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def content_key(image):
+    # Shape and pixels, hashed without copying contiguous images
+    h = hashlib.blake2b(str(image.shape).encode(), digest_size=16)
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+def perceptual_key(image, input_size=(48, 168), hash_size=(8, 32)):
+    # dHash: sign of the horizontal gradient of a small gray thumbnail of the model input
+    h, w = input_size
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray = cv2.resize(gray, (w, h), interpolation=cv2.INTER_AREA)
+    small = cv2.resize(gray, (hash_size[1] + 1, hash_size[0]), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+KEY_FUNCS = {
+    'content': content_key,
+    'perceptual': perceptual_key,
+}
+
+
+class PredictionCache:
+
+    def __init__(self, max_size=4096, ttl=None, key='content'):
+        """
+        max_size: entries kept, the least recently used one is evicted first
+        ttl: seconds an entry stays valid, None: no expiry
+        """
+        assert key in KEY_FUNCS, key
+        self.max_size = max_size
+        self.ttl = ttl
+        self.key_func = KEY_FUNCS[key]
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, image):
+        return self.key_func(image)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0., 'evictions': self.evictions,
+                'expirations': self.expirations}
+
+
+class CachedPredictor:
+    """Wrap anything with predict_batch(images) -> [(text, confidence), ...], only cache misses reach the model"""
+
+    def __init__(self, predictor, cache):
+        self.predictor = predictor
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # batch_size, close(), ... of the wrapped predictor
+        return getattr(self.predictor, name)
+
+    def predict_batch(self, images):
+        keys = [self.cache.key(image) for image in images]
+        results = [self.cache.get(key) for key in keys]
+
+        # Misses, duplicates within the batch run once
+        missing = OrderedDict()
+        for i, (key, result) in enumerate(zip(keys, results)):
+            if result is None:
+                missing.setdefault(key, []).append(i)
+        if len(missing) > 0:
+            outputs = self.predictor.predict_batch([images[indices[0]] for indices in missing.values()])
+            for (key, indices), output in zip(missing.items(), outputs):
+                self.cache.put(key, output)
+                for i in indices:
+                    results[i] = output
+        return results
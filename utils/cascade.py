@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午1:20
+@file: cascade.py
+@author: zj
+@description: Confidence-gated model cascade, a fast model for every plate and a large model for the unsure ones.
+
+    cascade = CascadePredictor(build_engine('crnn_tiny-plate.onnx'), build_engine('crnn-plate.onnx'), threshold=0.93)
+    cascade.predict_batch(images)        # [(text, confidence), ...]
+
+The sequence confidence is the one of the engine, the product of the max probabilities of the decoded frames. A sample
+is re-run through the slow model when its confidence is below the threshold or, with a grammar, when the fast
+prediction is not a valid plate. calibrate_cascade.py picks the threshold for a target accuracy on a validation split.
+"""
+
+import numpy as np
+
+from .dataset.plate import is_plate_valid
+
+
+class CascadePredictor:
+
+    def __init__(self, fast, slow, threshold=0.9, grammar=is_plate_valid):
+        """
+        fast, slow: predictors with predict_batch(images) -> [(text, confidence), ...]
+        grammar: text -> bool, predictions it rejects are escalated regardless of their confidence. None: disabled
+        """
+        self.fast = fast
+        self.slow = slow
+        self.threshold = threshold
+        self.grammar = grammar
+
+        self.num_samples = 0
+        self.num_escalated = 0
+
+    def escalate(self, results):
+        # Indices of the fast results that go to the slow model
+        return [i for i, (text, confidence) in enumerate(results)
+                if confidence < self.threshold or (self.grammar is not None and not self.grammar(text))]
+
+    def predict_batch(self, images):
+        results = self.fast.predict_batch(images)
+        indices = self.escalate(results)
+        if len(indices) > 0:
+            for i, result in zip(indices, self.slow.predict_batch([images[i] for i in indices])):
+                results[i] = result
+        self.num_samples += len(images)
+        self.num_escalated += len(indices)
+        return results
+
+    def stats(self):
+        return {'samples': self.num_samples, 'escalated': self.num_escalated,
+                'escalated_rate': self.num_escalated / max(self.num_samples, 1), 'threshold': self.threshold}
+
+
+def sweep_thresholds(confidences, fast_correct, slow_correct, invalid=None):
+    """
+    Cascade accuracy and escalated fraction for every distinct threshold of the fast confidences.
+    Returns (thresholds, accuracy, escalated), samples with confidence < threshold (or invalid) are escalated
+    """
+    confidences = np.asarray(confidences, dtype=np.float64)
+    fast_correct = np.asarray(fast_correct, dtype=np.float64)
+    slow_correct = np.asarray(slow_correct, dtype=np.float64)
+    invalid = np.zeros(len(confidences), dtype=bool) if invalid is None else np.asarray(invalid, dtype=bool)
+    n = len(confidences)
+
+    order = np.argsort(confidences, kind='stable')
+    conf, fast_ok, slow_ok, bad = confidences[order], fast_correct[order], slow_correct[order], invalid[order]
+    # Escalating the first k sorted samples: they are answered by the slow model, the rest by the fast model unless
+    # the grammar rejects them
+    head_correct = np.concatenate([[0.], np.cumsum(slow_ok)])
+    tail = np.where(bad, slow_ok, fast_ok)
+    tail_correct = np.concatenate([np.cumsum(tail[::-1])[::-1], [0.]])
+    tail_invalid = np.concatenate([np.cumsum(bad[::-1])[::-1], [0]])
+
+    # Only the k where the threshold conf[k] separates distinct confidences, k = n escalates everything
+    ks = np.concatenate([[0], np.nonzero(conf[1:] != conf[:-1])[0] + 1, [n]])
+    thresholds = np.concatenate([conf, [max(conf[-1], 1.) + 1e-6]])[ks]
+    accuracy = (head_correct[ks] + tail_correct[ks]) / n
+    escalated = (ks + tail_invalid[ks]) / n
+    return thresholds, accuracy, escalated
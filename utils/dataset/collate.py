@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午5:10
+@file: collate.py
+@author: zj
+@description: Aspect-preserving resize and padded batching for variable-width CRNN inputs.
+"""
+
+import cv2
+from PIL import Image
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data.dataloader import default_collate
+
+
+class KeepRatioResize:
+    """
+    Resize to a fixed height and keep the aspect ratio, the width is clipped to [min_width, max_width].
+    Works on HWC numpy images (cv2) and on PIL images
+    """
+
+    def __init__(self, height, max_width, min_width=None):
+        self.height = height
+        self.max_width = max_width
+        self.min_width = height if min_width is None else min_width
+
+    def get_width(self, w, h):
+        width = int(round(w * self.height / max(h, 1)))
+        return min(max(width, self.min_width), self.max_width)
+
+    def __call__(self, image):
+        if isinstance(image, Image.Image):
+            w, h = image.size
+            return image.resize((self.get_width(w, h), self.height), Image.BILINEAR)
+        h, w = image.shape[:2]
+        return cv2.resize(image, (self.get_width(w, h), self.height))
+
+
+def pad_collate(batch):
+    """
+    Collate (image, ...) samples whose CHW images have different widths. Images are right-padded with zeros to the
+    widest image of the batch, and the unpadded widths are appended to the batch: (images, ..., widths). Given the
+    widths, CRNN/CRNN_Nano zero the padding columns before every conv (crnn.masked_forward), so the pad value of the
+    normalized images does not matter
+    """
+    images = [sample[0] for sample in batch]
+    widths = torch.tensor([image.shape[-1] for image in images], dtype=torch.int64)
+    max_width = int(widths.max())
+    images = torch.stack([F.pad(image, (0, max_width - image.shape[-1])) for image in images])
+
+    others = default_collate([sample[1:] for sample in batch])
+    return (images, *others, widths)
@@ -4,9 +4,10 @@ from torch.utils.data import Dataset
 from PIL import Image
 import torchvision.transforms as transforms
 from utils.logger import LOGGER
+from utils.dataset.collate import KeepRatioResize
 
 class CustomPlateDataset(Dataset):
-    def __init__(self, data_root, label_file, input_shape=(168, 48), is_train=True):
+    def __init__(self, data_root, label_file, input_shape=(168, 48), is_train=True, keep_ratio=False):
         self.data_root = data_root
         self.input_shape = input_shape
         self.is_train = is_train
@@ -24,7 +25,9 @@ class CustomPlateDataset(Dataset):
                 self.labels.append(cleaned_label)
 
         # Define transforms
+        # keep_ratio: height input_shape[1], width up to 2 * input_shape[0], batch with pad_collate
         common_transforms = [
+            KeepRatioResize(input_shape[1], max_width=2 * input_shape[0]) if keep_ratio else
             transforms.Resize((input_shape[1], input_shape[0])),
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
@@ -12,8 +12,6 @@ import numpy as np
 
 import torch
 from torch.utils.data import Dataset
-from torchvision import transforms
-from torchvision.datasets import EMNIST
 
 DIGITS_CHARS = "0123456789#"
 
@@ -57,6 +55,8 @@ class EMNISTDataset(Dataset):
         #
         # So download EMNIST manually from https://www.nist.gov/itl/products-and-services/emnist-dataset
         # parse_emnist()
+        from torchvision import transforms
+        from torchvision.datasets import EMNIST
 
         self.emnist = EMNIST(data_root, split="digits", train=is_train, download=False)
         self.transform = transforms.Compose([
@@ -8,6 +8,7 @@
 """
 
 import os
+import re
 import random
 from pathlib import Path
 
@@ -15,7 +16,8 @@ import cv2
 import numpy as np
 import torch
 from torch.utils.data import Dataset
-from torchvision import transforms
+
+from .collate import KeepRatioResize
 
 RANK = int(os.getenv('RANK', -1))
 
@@ -27,6 +29,12 @@ PLATE_DICT = dict()
 for i in range(len(PLATE_CHARS)):
     PLATE_DICT[PLATE_CHARS[i]] = i
 
+# Mainland plate grammar: province, issuing-authority letter, then 5 characters (the last one may be 学/警/挂/...) or
+# 6 for new-energy plates. Civil aviation plates start with 民航
+PLATE_PROVINCES = "京沪津渝冀晋蒙辽吉黑苏浙皖闽赣鲁豫鄂湘粤桂琼川贵云藏陕甘青宁新"
+PLATE_PATTERN = re.compile(f"^(?:[{PLATE_PROVINCES}][A-HJ-NP-Z](?:[A-HJ-NP-Z0-9]{{4}}[A-HJ-NP-Z0-9学警港澳挂使领]"
+                           f"|[A-HJ-NP-Z0-9]{{6}})|民航[A-HJ-NP-Z0-9]{{5}})$")
+
 
 def load_data(data_root, pattern='*.jpg'):
     assert os.path.isdir(data_root)
@@ -49,6 +57,11 @@ def is_plate_right(plate_name):
     return True
 
 
+def is_plate_valid(plate_name):
+    # Whether a predicted plate follows PLATE_PATTERN, e.g. to reject truncated or doubled predictions
+    return PLATE_PATTERN.match(plate_name) is not None
+
+
 def create_plate_label(img_list):
     data_list = list()
     label_dict = dict()
@@ -77,10 +90,16 @@ def create_plate_label(img_list):
 class PlateDataset(Dataset):
 
     def __init__(self, data_root, is_train=True, input_shape=(160, 48),
-                 only_ccpd2019=False, only_ccpd2020=False, only_others=False):
+                 only_ccpd2019=False, only_ccpd2020=False, only_others=False, augment=True, keep_ratio=False,
+                 teacher_shape=None):
         self.data_root = data_root
         self.is_train = is_train
+        self.augment = augment
+        # Keep the aspect ratio (height input_shape[1], width up to 2 * input_shape[0]), batch with pad_collate
+        self.keep_ratio = KeepRatioResize(input_shape[1], max_width=2 * input_shape[0]) if keep_ratio else None
         self.input_shape = input_shape
+        # (w, h) of a distillation teacher, its input is resized from the same (augmented) crop: (data, label, teacher)
+        self.teacher_shape = teacher_shape
 
         if is_train:
             if only_ccpd2019:
@@ -139,6 +158,8 @@ class PlateDataset(Dataset):
         self.dataset_len = len(data_list)
         self.label_dict = label_dict
 
+        # torchvision is only needed for the training augmentation
+        from torchvision import transforms
         self.transform = transforms.Compose([
             transforms.ToPILImage(),  # 将 numpy array 或 tensor 转换成 PIL Image
             transforms.RandomRotation(15, fill=0),  # 限制旋转角度
@@ -156,15 +177,23 @@ class PlateDataset(Dataset):
         if image.shape[-1] == 4:
             image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
 
-        if self.is_train and random.random() > 0.5:
+        if self.is_train and self.augment and random.random() > 0.5:
             image = self.transform(image)
             image = np.array(image, dtype=np.uint8)
-        image = cv2.resize(image, self.input_shape)
+        teacher_image = None
+        if self.teacher_shape is not None:
+            teacher_image = cv2.resize(image, tuple(self.teacher_shape))
+        if self.keep_ratio is not None:
+            image = self.keep_ratio(image)
+        else:
+            image = cv2.resize(image, self.input_shape)
 
         data = torch.from_numpy(image).float() / 255.
         # HWC -> CHW
         data = data.permute(2, 0, 1)
 
+        if teacher_image is not None:
+            return data, label_name, torch.from_numpy(teacher_image).float().div(255.).permute(2, 0, 1)
         return data, label_name
 
     def __len__(self):
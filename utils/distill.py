@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午3:30
+@file: distill.py
+@author: zj
+@description: Frozen teacher for knowledge distillation, with optional on-disk cache of its per-frame log-probs.
+
+The teacher runs under torch.inference_mode on images of its own input size, PlateDataset(teacher_shape=...) resizes
+them from the same crop as the student input. Its frames are resampled to the student output width, so CRNN can teach
+LPRNet and vice versa. With a cache directory the resampled log-probs of every training sample are written to a float16
+memmap during the first epoch and read back afterwards, which requires the training data to be deterministic (no
+augmentation).
+"""
+
+import os
+import hashlib
+
+import numpy as np
+
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+
+from .logger import LOGGER
+from .general import load_ocr_model, PLATE_ARCHS
+
+RANK = int(os.getenv('RANK', -1))
+
+
+class IndexedDataset(Dataset):
+    """Return the sample index next to (data, label), used to address the teacher cache"""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        return (*self.dataset[index], index)
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def resample_frames(log_probs, width):
+    """
+    Resample [N, T, num_classes] log-probs to [N, width, num_classes] by linear interpolation of the probabilities
+    """
+    if log_probs.shape[1] == width:
+        return log_probs
+    # [N, T, C] -> [N, C, T]
+    probs = log_probs.float().exp().permute(0, 2, 1)
+    probs = F.interpolate(probs, size=width, mode='linear', align_corners=False)
+    probs = probs / probs.sum(dim=1, keepdim=True)
+    return probs.clamp(min=1e-8).log().permute(0, 2, 1).contiguous()
+
+
+class Teacher:
+
+    def __init__(self, pretrained, arch, device, num_classes, width, cache_dir=None, dataset_len=0):
+        kwargs = dict(PLATE_ARCHS[arch])
+        c, h, w = kwargs.pop('img_shape')
+        self.model, _ = load_ocr_model(pretrained=pretrained, device=device, shape=(1, c, h, w),
+                                       num_classes=num_classes, **kwargs)
+        for p in self.model.parameters():
+            p.requires_grad_(False)
+        self.input_size = (h, w)
+        self.width = width
+
+        self.cache = None
+        if cache_dir is not None:
+            # A new cache file for every teacher checkpoint / student width / dataset
+            key = f"{os.path.abspath(pretrained)}-{os.path.getmtime(pretrained)}-{arch}-{width}-{dataset_len}"
+            key = hashlib.md5(key.encode('utf-8')).hexdigest()[:16]
+            cache_path = os.path.join(cache_dir, f"teacher-{key}.logits")
+            filled_path = os.path.join(cache_dir, f"teacher-{key}.filled")
+            if RANK in {-1, 0} and not os.path.exists(filled_path):
+                os.makedirs(cache_dir, exist_ok=True)
+                np.memmap(cache_path, dtype=np.float16, mode='w+', shape=(dataset_len, width, num_classes)).flush()
+                np.memmap(filled_path, dtype=np.uint8, mode='w+', shape=(dataset_len,)).flush()
+            if RANK != -1:
+                dist.barrier()
+            self.cache = np.memmap(cache_path, dtype=np.float16, mode='r+', shape=(dataset_len, width, num_classes))
+            self.filled = np.memmap(filled_path, dtype=np.uint8, mode='r+', shape=(dataset_len,))
+            LOGGER.info(f"Teacher cache: {cache_path}, {int(self.filled.sum())}/{dataset_len} samples cached")
+
+    def __call__(self, images, indices=None):
+        # images: teacher inputs, other sizes are resized (resizing student inputs loses detail, prefer teacher_shape)
+        if self.cache is not None:
+            indices = indices.numpy()
+            if self.filled[indices].all():
+                return torch.from_numpy(self.cache[indices]).to(images.device).float()
+
+        with torch.inference_mode():
+            if tuple(images.shape[-2:]) != self.input_size:
+                images = F.interpolate(images, size=self.input_size, mode='bilinear', align_corners=False)
+            preds = resample_frames(self.model(images), self.width)
+        # Inference tensors cannot be saved for backward, the clone outside inference_mode is a normal tensor
+        preds = preds.float().clone()
+
+        if self.cache is not None:
+            self.cache[indices] = preds.cpu().numpy().astype(np.float16)
+            self.filled[indices] = 1
+        return preds
+
+    def flush(self):
+        if self.cache is not None:
+            self.cache.flush()
+            self.filled.flush()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午10:00
+@file: engine.py
+@author: zj
+@description: Inference engine shared by the predict scripts and the Gradio demo.
+
+    engine = build_engine('crnn_tiny-plate.pth')        # eager PyTorch, or .torchscript / .onnx files
+    results = engine.predict_batch([cv2.imread(p) for p in paths])   # [(text, confidence), ...]
+
+The engine does the preprocessing of the dataset the model was trained on (resize, color order, normalization) for a
+batch of BGR images, runs one backend call, and greedy-decodes every sample. confidence is the product of the max
+probabilities of the decoded frames.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import torch
+import torch.nn.functional as F
+
+from .general import load_ocr_model
+from .torchutil import unwrap_model
+from .converter import get_custom_plate_chars
+from .dataset.plate import PLATE_CHARS
+from .dataset.emnist import DIGITS_CHARS
+from .dataset.collate import KeepRatioResize, pad_collate
+from .model.e2e import greedy_decode
+from .autotune import load_profile
+from .metrics import observe_stage, BATCH_SIZE
+
+# chars: the character of every class index, color: input channels, mean/std: normalization of x / 255.
+# (H, W) is the model input size, LPRNet plate models use lprnet_size
+DATASETS = {
+    'plate': dict(chars=list(PLATE_CHARS), blank_label=0, color='bgr', mean=0., std=1., size=(48, 168),
+                  lprnet_size=(24, 94)),
+    # CustomPlateDataset: PIL RGB images, transforms.Normalize(0.5, 0.5), class 0 is the CTC blank
+    'custom': dict(chars=['_'] + get_custom_plate_chars(), blank_label=0, color='rgb', mean=0.5, std=0.5,
+                   size=(48, 168), lprnet_size=(24, 94)),
+    'emnist': dict(chars=list(DIGITS_CHARS), blank_label=len(DIGITS_CHARS) - 1, color='gray', mean=0., std=1.,
+                   size=(32, 160)),
+}
+
+
+class TorchBackend:
+    """Eager PyTorch model (or a torch.compile / AutocastModel wrapper of it)"""
+
+    def __init__(self, model, device, channels_last=False):
+        self.model = model
+        self.device = device
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        # Padded batches of different widths, see CRNN.output_lengths()
+        self.output_lengths = getattr(unwrap_model(model), 'output_lengths', None)
+        self.e2e = False
+        self.e2e_fixed = False
+
+    @torch.no_grad()
+    def __call__(self, data, widths=None, src=None, src_sizes=None):
+        data = data.to(self.device, memory_format=self.memory_format)
+        lengths = None
+        if widths is not None:
+            outputs = self.model(data, widths)
+            lengths = self.output_lengths(widths)
+        elif src is not None:
+            outputs = self.model(data, src=src.to(self.device), src_sizes=src_sizes.to(self.device))
+        else:
+            outputs = self.model(data)
+        return outputs.float().cpu(), lengths
+
+
+class TorchScriptBackend(TorchBackend):
+    """TorchScript model, loaded from a file or traced and frozen from an eager model"""
+
+    def __init__(self, model, device, example=None):
+        if isinstance(model, str):
+            model = torch.jit.load(model, map_location=device)
+        else:
+            with torch.no_grad():
+                model = torch.jit.freeze(torch.jit.trace(model, example.to(device)))
+        super().__init__(model.eval(), device)
+        # The trace only records the forward(x) path
+        self.output_lengths = None
+
+    def __call__(self, data, widths=None, src=None, src_sizes=None):
+        assert widths is None and src is None, 'keep_ratio/stn_source need the eager PyTorch backend'
+        return super().__call__(data)
+
+
+class ONNXBackend:
+    """ONNX Runtime model exported by pth2onnx.py, models with a static batch size are run in chunks"""
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.e2e = predictor.e2e
+        # pth2onnx.py --e2e fixed: the graph does not resize, its [N, H, W, C] input has a static height
+        self.e2e_fixed = predictor.e2e and isinstance(predictor.input_shape[1], int)
+        self.output_lengths = None
+
+    def __call__(self, data, widths=None, src=None, src_sizes=None):
+        assert widths is None and src is None, 'keep_ratio/stn_source need the eager PyTorch backend'
+        batch_size = self.predictor.batch_size or len(data)
+        outputs = [self.predictor(data[i:i + batch_size]) for i in range(0, len(data), batch_size)]
+        if self.e2e:
+            # (indices, probs) per chunk
+            return [torch.cat(x) for x in zip(*outputs)]
+        return torch.cat(outputs), None
+
+
+class OCREngine:
+
+    def __init__(self, backend, dataset='plate', input_size=None, keep_ratio=False, stn_source=False):
+        """
+        input_size: (H, W) of the model, default: the input size of the dataset
+        keep_ratio: resize to the model height and keep the aspect ratio, batches are padded (CRNN only)
+        stn_source: LPRNet+STNet, sample the STNet output from the full-size image
+        """
+        self.backend = backend
+        self.spec = DATASETS[dataset]
+        self.input_size = tuple(input_size or self.spec['size'])
+        self.keep_ratio = KeepRatioResize(self.input_size[0], max_width=2 * self.input_size[1]) if keep_ratio else None
+        self.stn_source = stn_source
+        # Seconds per stage of the last batch, all batches are recorded in utils/metrics.py
+        self.timings = dict()
+
+    def to_tensor(self, image):
+        # uint8 HWC (HW for gray) -> normalized float CHW
+        data = torch.from_numpy(np.ascontiguousarray(image)).float() / 255.
+        data = data.unsqueeze(0) if data.ndim == 2 else data.permute(2, 0, 1)
+        return (data - self.spec['mean']) / self.spec['std']
+
+    def convert_color(self, image):
+        # BGR (cv2.imread) to the color of the training data
+        color = self.spec['color']
+        if color == 'gray':
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[-1] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if color == 'rgb' else image
+
+    def resize(self, image):
+        h, w = self.input_size
+        if self.spec['color'] == 'rgb':
+            # CustomPlateDataset resizes PIL images
+            image = Image.fromarray(image)
+            image = self.keep_ratio(image) if self.keep_ratio else image.resize((w, h), Image.BILINEAR)
+            return np.asarray(image)
+        return self.keep_ratio(image) if self.keep_ratio else cv2.resize(image, (w, h))
+
+    def preprocess(self, images):
+        """
+        images: list of uint8 BGR images. Returns the [N, C, H, W] batch, the unpadded widths (keep_ratio) and the
+        zero-padded full-size images with their sizes (stn_source)
+        """
+        images = [self.convert_color(image) for image in images]
+        data = [self.to_tensor(self.resize(image)) for image in images]
+        widths = None
+        if self.keep_ratio:
+            data, widths = pad_collate([(x,) for x in data])
+        else:
+            data = torch.stack(data)
+
+        src = src_sizes = None
+        if self.stn_source:
+            src = [self.to_tensor(image) for image in images]
+            src_sizes = torch.tensor([x.shape[-2:] for x in src])
+            max_h, max_w = src_sizes.max(dim=0).values.tolist()
+            src = torch.stack([F.pad(x, (0, max_w - x.shape[-1], 0, max_h - x.shape[-2])) for x in src])
+        return data, widths, src, src_sizes
+
+    def decode(self, indices, probs):
+        labels, confidence = greedy_decode(indices, probs, blank_label=self.spec['blank_label'])
+        return ''.join(self.spec['chars'][i] for i in labels), confidence
+
+    def predict_batch(self, images):
+        """
+        images: list of uint8 BGR images (cv2.imread) of any size. Returns [(text, confidence), ...]
+        """
+        if len(images) == 0:
+            return []
+        BATCH_SIZE.observe(len(images))
+        if self.backend.e2e:
+            return self.predict_e2e(images)
+
+        t0 = time.perf_counter()
+        data, widths, src, src_sizes = self.preprocess(images)
+        t1 = observe_stage('preprocess', t0)
+        outputs, lengths = self.backend(data, widths=widths, src=src, src_sizes=src_sizes)
+        t2 = observe_stage('forward', t1)
+        max_log_probs, indices = outputs.max(dim=-1)
+        probs = max_log_probs.exp().numpy()
+        indices = indices.numpy()
+
+        results = list()
+        for i in range(len(images)):
+            n = indices.shape[1] if lengths is None else int(lengths[i])
+            results.append(self.decode(indices[i, :n], probs[i, :n]))
+        t3 = observe_stage('ctc_decode', t2)
+        self.timings = {'preprocess': t1 - t0, 'forward': t2 - t1, 'ctc_decode': t3 - t2}
+        return results
+
+    def predict_e2e(self, images):
+        # Preprocessing and argmax run in the graph, images of the same size go in one call
+        # The graph takes BGR (or gray) images, the color conversion of the dataset is part of it
+        t0 = time.perf_counter()
+        gray = self.spec['color'] == 'gray'
+        if gray:
+            images = [self.convert_color(image) for image in images]
+        else:
+            images = [image[..., :3] if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+                      for image in images]
+        if self.backend.e2e_fixed:
+            # Graphs exported with --e2e fixed take images of the model input size, resized as in preprocess()
+            images = [self.resize(image) for image in images]
+        if gray:
+            images = [image[..., None] for image in images]
+        same_size = len(set(image.shape for image in images)) == 1
+        if same_size:
+            images = torch.from_numpy(np.stack(images))
+        t1 = observe_stage('preprocess', t0)
+        if same_size:
+            indices, probs = self.backend(images)
+        else:
+            outputs = [self.backend(torch.from_numpy(image[None])) for image in images]
+            indices, probs = [torch.cat(x) for x in zip(*outputs)]
+        t2 = observe_stage('forward', t1)
+        results = [self.decode(i, p) for i, p in zip(indices.numpy(), probs.numpy())]
+        t3 = observe_stage('ctc_decode', t2)
+        self.timings = {'preprocess': t1 - t0, 'forward': t2 - t1, 'ctc_decode': t3 - t2}
+        return results
+
+
+def build_engine(weights, dataset='plate', backend=None, device=None, keep_ratio=False, stn_source=False,
+                 channels_last=False, session_options=None, **model_kwargs):
+    """
+    weights: .pth checkpoint, .torchscript file or .onnx model
+    backend: torch/torchscript/onnx, default: from the file suffix. A .pth checkpoint with backend='torchscript' is
+        traced and frozen after loading
+    session_options: onnxruntime.SessionOptions of .onnx models, default: the autotune.py profile
+    model_kwargs: architecture flags of load_ocr_model(), only used for .pth checkpoints
+    """
+    spec = DATASETS[dataset]
+    suffix = os.path.splitext(weights)[1]
+    profile = load_profile(weights)
+    if backend is None:
+        backend = {'.onnx': 'onnx', '.torchscript': 'torchscript'}.get(suffix, 'torch')
+        if backend == 'torch' and profile is not None and profile['backend'] == 'torchscript':
+            # autotune.py found the traced model faster on this host
+            backend = 'torchscript'
+    input_size = spec['lprnet_size'] if model_kwargs.get('use_lprnet') else spec['size']
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    if backend == 'onnx':
+        from .onnxutil import ONNXRuntimePredictor
+        predictor = ONNXRuntimePredictor(weights, session_options=session_options)
+        shape = predictor.input_shape
+        if predictor.e2e:
+            if isinstance(shape[1], int):
+                # --e2e fixed, [N, H, W, C] with a static height (and a static width unless --dynamic-width)
+                input_size = (shape[1], shape[2] if isinstance(shape[2], int) else input_size[1])
+        elif all(isinstance(x, int) for x in shape[2:]):
+            input_size = tuple(shape[2:])
+        assert not keep_ratio and not stn_source, 'keep_ratio/stn_source need the eager PyTorch backend'
+        engine_backend = ONNXBackend(predictor)
+    elif suffix == '.torchscript':
+        engine_backend = TorchScriptBackend(weights, device)
+    else:
+        c = 1 if spec['color'] == 'gray' else 3
+        model, device = load_ocr_model(pretrained=weights, device=device, shape=(1, c, *input_size),
+                                       num_classes=len(spec['chars']), channels_last=channels_last,
+                                       count_flops=False, **model_kwargs)
+        if backend == 'torchscript':
+            engine_backend = TorchScriptBackend(model, device, example=torch.zeros(1, c, *input_size))
+        else:
+            engine_backend = TorchBackend(model, device, channels_last=channels_last)
+    engine = OCREngine(engine_backend, dataset=dataset, input_size=input_size, keep_ratio=keep_ratio,
+                       stn_source=stn_source)
+    # Recommended batch size of the profile, e.g. for the serving micro-batcher
+    engine.batch_size = profile.get('batch_size', 1) if profile is not None else 1
+    return engine
@@ -24,13 +24,18 @@ class Evaluator:
         self.correct_num = 0.
         self.total_num = 0.
 
-    def update(self, outputs, targets):
+    def update(self, outputs, targets, lengths=None):
+        """
+        lengths: number of valid frames per sample for padded batches, None if all frames are valid
+        """
         assert len(outputs) == len(targets)
 
         correct_num = 0.
         total_num = len(outputs)
 
-        for output, target in zip(outputs, targets):
+        for i, (output, target) in enumerate(zip(outputs, targets)):
+            if lengths is not None:
+                output = output[:int(lengths[i])]
             _, max_index = torch.max(output, dim=1)
 
             raw_pred = list(max_index.numpy())
@@ -8,19 +8,17 @@
 """
 
 import os
-import thop
 import torch
 import random
 
 import platform
-import pkg_resources as pkg
 
 import numpy as np
 from copy import deepcopy
 
 from .logger import LOGGER
-from .model.crnn import CRNN
-from .model.lprnet import LPRNet
+from .torchutil import AutocastModel, select_amp_dtype
+from .autotune import load_profile, apply_torch_profile
 
 
 def emojis(str=''):
@@ -30,6 +28,8 @@ def emojis(str=''):
 
 def check_version(current='0.0.0', minimum='0.0.0', name='version ', pinned=False, hard=False, verbose=False):
     # Check version vs. required version
+    import pkg_resources as pkg
+
     current, minimum = (pkg.parse_version(x) for x in (current, minimum))
     result = (current == minimum) if pinned else (current >= minimum)  # bool
     s = f'WARNING ⚠️ {name}{minimum} is required by YOLOv5, but {name}{current} is currently installed'  # string
@@ -55,7 +55,7 @@ def init_seeds(seed=0, deterministic=False):
         os.environ['PYTHONHASHSEED'] = str(seed)
 
 
-def model_info(model, model_name, verbose=False, img_shape=(1, 3, 48, 168)):
+def model_info(model, model_name, verbose=False, img_shape=(1, 3, 48, 168), count_flops=True):
     # Model information. img_size may be int or list, i.e. img_size=640 or img_size=[640, 320]
     n_p = sum(x.numel() for x in model.parameters())  # number parameters
     n_g = sum(x.numel() for x in model.parameters() if x.requires_grad)  # number gradients
@@ -66,44 +66,113 @@ def model_info(model, model_name, verbose=False, img_shape=(1, 3, 48, 168)):
             print('%5g %40s %9s %12g %20s %10.3g %10.3g' %
                   (i, name, p.requires_grad, p.numel(), list(p.shape), p.mean(), p.std()))
 
-    try:  # FLOPs
-        p = next(model.parameters())
-        im = torch.empty(img_shape, device=p.device)  # input image in BCHW format
-        flops = thop.profile(deepcopy(model), inputs=(im,), verbose=False)[0] / 1E9 * 2  # stride GFLOPs
-        fs = f', {flops:.1f} GFLOPs'  # 640x640 GFLOPs
-    except Exception:
-        fs = ''
+    fs = ''
+    if count_flops:
+        try:  # FLOPs
+            flops = get_flops(model, img_shape=img_shape)
+            fs = f', {flops:.1f} GFLOPs'  # 640x640 GFLOPs
+        except Exception:
+            pass
 
     print(f"{model_name} summary: {len(list(model.modules()))} layers, {n_p} parameters, {n_g} gradients{fs}")
 
 
+def get_flops(model, img_shape=(1, 3, 48, 168)):
+    # GFLOPs of one forward pass with input img_shape
+    import thop
+
+    p = next(model.parameters())
+    im = torch.empty(img_shape, device=p.device)  # input image in BCHW format
+    return thop.profile(deepcopy(model), inputs=(im,), verbose=False)[0] / 1E9 * 2  # stride GFLOPs
+
+
+def load_pretrained(model, pretrained):
+    # Load a state_dict saved by the training scripts. Pruned checkpoints have fewer channels than the default
+    # architecture, so the model is first rebuilt to the layer shapes stored in the checkpoint
+    from .prune import rebuild_from_state_dict
+
+    ckpt = torch.load(pretrained, map_location='cpu')
+    ckpt = {k.replace("module.", ""): v for k, v in ckpt.items()}
+    model = rebuild_from_state_dict(model, ckpt)
+    model.load_state_dict(ckpt, strict=True)
+    return model
+
+
+# Plate architecture name (same as the checkpoint prefix written by train_plate.py) -> load_ocr_model() kwargs
+PLATE_ARCHS = {
+    'crnn': dict(img_shape=(3, 48, 168), not_tiny=True),
+    'crnn_tiny': dict(img_shape=(3, 48, 168)),
+    'crnn_conv': dict(img_shape=(3, 48, 168), not_tiny=True, use_conv_head=True),
+    'crnn_tiny_conv': dict(img_shape=(3, 48, 168), use_conv_head=True),
+    'crnn_nano': dict(img_shape=(3, 48, 168), use_nano=True),
+    'crnn_nano_w0.5': dict(img_shape=(3, 48, 168), use_nano=True, width_mult=0.5),
+    'crnn_nano_conv': dict(img_shape=(3, 48, 168), use_nano=True, use_conv_head=True),
+    'lprnet': dict(img_shape=(3, 24, 94), use_lprnet=True, use_origin_block=True),
+    'lprnet_plus': dict(img_shape=(3, 24, 94), use_lprnet=True),
+    'lprnet_stnet': dict(img_shape=(3, 24, 94), use_lprnet=True, use_origin_block=True, add_stnet=True),
+    'lprnet_plus_stnet': dict(img_shape=(3, 24, 94), use_lprnet=True, add_stnet=True),
+    # Batch-invariant global context (LPRNet per_sample_norm), for batched serving
+    'lprnet_plus_psn': dict(img_shape=(3, 24, 94), use_lprnet=True, per_sample_norm=True),
+    'lprnet_plus_stnet_psn': dict(img_shape=(3, 24, 94), use_lprnet=True, add_stnet=True, per_sample_norm=True),
+}
+
+
 def load_ocr_model(pretrained=None, device=None, shape=(1, 3, 48, 168), num_classes=100, not_tiny=False,
-                   use_lstm=False, use_lprnet=False, use_origin_block=False, add_stnet=False):
+                   use_lstm=False, use_lprnet=False, use_origin_block=False, add_stnet=False, use_compile=False,
+                   channels_last=False, use_conv_head=False, use_nano=False, width_mult=1.0,
+                   stnet_loc_size=(24, 94), amp_dtype='fp32', apply_profile=True, count_flops=True,
+                   per_sample_norm=False):
+    # Only the module of the requested architecture is imported
     if use_lprnet:
+        from .model.lprnet import LPRNet
         model = LPRNet(in_channel=shape[1], num_classes=num_classes, use_origin_block=use_origin_block,
-                       add_stnet=add_stnet)
+                       add_stnet=add_stnet, stnet_loc_size=stnet_loc_size, per_sample_norm=per_sample_norm)
+    elif use_nano:
+        from .model.crnn_nano import CRNNNano
+        model = CRNNNano(in_channel=shape[1], num_classes=num_classes, cnn_input_height=shape[2],
+                         width_mult=width_mult, use_gru=not use_lstm, use_conv_head=use_conv_head)
     else:
+        from .model.crnn import CRNN
         model = CRNN(in_channel=shape[1], num_classes=num_classes, cnn_input_height=shape[2], is_tiny=not not_tiny,
-                     use_gru=not use_lstm)
+                     use_gru=not use_lstm, use_conv_head=use_conv_head)
     if pretrained is not None:
         if isinstance(pretrained, list):
             pretrained = pretrained[0]
         print(f"Loading CRNN pretrained: {pretrained}")
-        ckpt = torch.load(pretrained, map_location='cpu')
-        ckpt = {k.replace("module.", ""): v for k, v in ckpt.items()}
-        model.load_state_dict(ckpt, strict=True)
+        model = load_pretrained(model, pretrained)
     model.eval()
 
     if device is None:
         device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     model = model.to(device)
+    # NHWC lets oneDNN (CPU) and cuDNN pick their faster convolution kernels
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if channels_last:
+        model = model.to(memory_format=memory_format)
+
+    if pretrained is not None:
+        model_name = os.path.splitext(os.path.basename(pretrained))[0]
+    else:
+        model_name = model.__class__.__name__
+    model_info(model, model_name, verbose=False, img_shape=shape, count_flops=count_flops)
 
-    # Warm
+    # Thread settings tuned for this host by autotune.py
+    profile = load_profile(pretrained) if apply_profile and device.type == 'cpu' else None
+    if profile is not None and profile['backend'] in ('torch', 'torchscript'):
+        apply_torch_profile(profile)
+
+    amp_dtype = select_amp_dtype(amp_dtype, device)
+    if amp_dtype != 'fp32':
+        # Mixed-precision inference, e.g. bf16 on CPUs with AMX/AVX512-BF16. Outputs are cast back to fp32
+        model = AutocastModel(model, device, amp_dtype)
+
+    if use_compile:
+        from .torchutil import compile_model
+        model = compile_model(model, device=device)
+
+    # Warm (also triggers compilation, or loads it from the compile cache)
     for _ in range(3):
-        data = torch.randn(shape).to(device)
+        data = torch.randn(shape).to(device, memory_format=memory_format)
         _ = model(data)
 
-    model_name = os.path.splitext(os.path.basename(pretrained))[0]
-    model_info(model, model_name, verbose=False, img_shape=shape)
-
     return model, device
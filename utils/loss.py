@@ -9,6 +9,7 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class CTCLoss(nn.Module):
@@ -17,12 +18,17 @@ class CTCLoss(nn.Module):
         super().__init__()
         self.loss = torch.nn.CTCLoss(blank=blank_label, reduction='mean', zero_infinity=True)
 
-    def forward(self, preds, targets, target_lengths=None):
+    def forward(self, preds, targets, target_lengths=None, input_lengths=None):
         N, cnn_output_width = preds.shape[:2]
         # [N, W, num_classes] -> [W, N, num_classes]
-        preds = preds.permute(1, 0, 2)
+        # CTC is always computed in fp32, the log-probs of fp16/bf16 autocast are too coarse for the alignment sums
+        preds = preds.permute(1, 0, 2).float()
 
-        input_lengths = torch.IntTensor(N).fill_(cnn_output_width).to(preds.device)
+        if input_lengths is None:
+            input_lengths = torch.IntTensor(N).fill_(cnn_output_width).to(preds.device)
+        else:
+            # Padded batch of variable-width images: the frames after input_lengths[i] are ignored
+            input_lengths = input_lengths.int().to(preds.device)
         if target_lengths is None:
             # Padded
             target_lengths = torch.IntTensor([len(t) for t in targets]).to(preds.device)
@@ -33,3 +39,29 @@ class CTCLoss(nn.Module):
             # print(preds.shape, targets.shape, input_lengths, target_lengths)
             loss = self.loss(preds, targets, input_lengths, target_lengths)
         return loss
+
+
+class DistillLoss(nn.Module):
+    """
+    CTC loss plus the per-frame KL divergence from the teacher to the student, both softened by temperature.
+    preds and teacher_preds are log_softmax outputs with the same number of frames
+    """
+
+    def __init__(self, blank_label=0, alpha=1.0, temperature=2.0):
+        super().__init__()
+        self.ctc_loss = CTCLoss(blank_label=blank_label)
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def forward(self, preds, targets, target_lengths=None, teacher_preds=None):
+        loss = self.ctc_loss(preds, targets, target_lengths)
+        if teacher_preds is None:
+            return loss
+
+        T = self.temperature
+        # log_softmax(log_probs / T) == log_softmax(logits / T)
+        student = F.log_softmax(preds.float() / T, dim=-1).flatten(0, 1)
+        teacher = F.log_softmax(teacher_preds.float() / T, dim=-1).flatten(0, 1)
+        kl_loss = F.kl_div(student, teacher, reduction='batchmean', log_target=True)
+        # T^2 keeps the gradient scale of the soft targets independent of the temperature
+        return loss + self.alpha * T * T * kl_loss
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午2:50
+@file: metrics.py
+@author: zj
+@description: Fixed-bucket histograms of the prediction stages, rendered in the Prometheus text format.
+
+    t0 = time.perf_counter()
+    ...                                      # e.g. resize and normalize a batch
+    t0 = observe_stage('preprocess', t0)     # records the elapsed time, returns the new start time
+
+    METRICS.render()                         # text for GET /metrics (serve_plate.py)
+
+An observation is a bisect over the bucket bounds and three integer/float updates under a lock, cheap enough to stay
+on in production. Stages (per batch): decode_image, preprocess (color, resize, normalize), forward, ctc_decode. Batch
+sizes, the queue wait and the end-to-end latency of a request have their own histograms.
+"""
+
+import time
+import bisect
+import threading
+
+# Seconds, from 50 us to 2.5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.,
+                   2.5)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, label_names=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        # label values -> [bucket counts (last one is +Inf), sum, count]
+        self.series = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0., 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {k: ([*v[0]], v[1], v[2]) for k, v in self.series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                bucket_labels = format_labels(labels + [('le', format_value(bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+    def quantile(self, q, *label_values):
+        # Upper bucket bound below which a fraction q of the observations fall, e.g. for logs and tests
+        with self.lock:
+            series = self.series.get(label_values)
+            counts = [*series[0]] if series is not None else []
+        total = sum(counts)
+        if total == 0:
+            return float('nan')
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            if cumulative >= q * total:
+                return bound
+        return float('inf')
+
+
+class Counter:
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, value=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(list(zip(self.label_names, label_values)))} {value}")
+        return lines
+
+
+class MetricSet:
+
+    def __init__(self):
+        self.metrics = dict()
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricSet()
+STAGE_SECONDS = METRICS.add(Histogram('crnn_stage_seconds', 'Latency of one prediction stage for a batch',
+                                      label_names=('stage',)))
+BATCH_SIZE = METRICS.add(Histogram('crnn_batch_size', 'Images per model call', buckets=BATCH_SIZE_BUCKETS))
+QUEUE_WAIT_SECONDS = METRICS.add(Histogram('crnn_queue_wait_seconds', 'Time a request waits for its batch to start'))
+REQUEST_SECONDS = METRICS.add(Histogram('crnn_request_seconds', 'End-to-end latency of a prediction request'))
+REQUESTS = METRICS.add(Counter('crnn_requests_total', 'Prediction requests by HTTP status', label_names=('status',)))
+
+
+def observe_stage(stage, t0):
+    # Record the time since t0 for stage, returns the current time as the start of the next stage
+    t = time.perf_counter()
+    STAGE_SECONDS.observe(t - t0, stage)
+    return t
@@ -10,15 +10,23 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.modules.utils import _pair
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+
+def is_compiling():
+    # torch.compiler.is_compiling() is only available in torch>=2.3
+    compiler = getattr(torch, 'compiler', None)
+    return compiler is not None and hasattr(compiler, 'is_compiling') and compiler.is_compiling()
 
 
 def initialize_weights(module):
     for m in module.modules():
-        if isinstance(m, nn.Conv2d):
+        if isinstance(m, (nn.Conv2d, nn.Conv1d)):
             torch.nn.init.xavier_uniform_(m.weight)
             if m.bias is not None:
                 torch.nn.init.zeros_(m.bias)
-        elif isinstance(m, nn.BatchNorm2d):
+        elif isinstance(m, (nn.BatchNorm2d, nn.BatchNorm1d)):
             torch.nn.init.ones_(m.weight)  # Initialize gamma with ones
             torch.nn.init.zeros_(m.bias)  # Initialize beta with zeros
         elif isinstance(m, nn.GRU) or isinstance(m, nn.LSTM):
@@ -33,9 +41,151 @@ def initialize_weights(module):
                 torch.nn.init.zeros_(m.bias)
 
 
+def conv_output_widths(module, widths):
+    """
+    Output widths of the Conv2d/MaxPool2d layers of module (applied in definition order) for the given input widths
+    """
+    for m in module.modules():
+        if isinstance(m, (nn.Conv2d, nn.MaxPool2d)):
+            k, s, p, d = [_pair(v)[1] for v in (m.kernel_size, m.stride, m.padding, m.dilation)]
+            widths = torch.div(widths + 2 * p - d * (k - 1) - 1, s, rounding_mode='floor') + 1
+    return widths
+
+
+def width_mask(x, widths):
+    # [N, W] mask of the unpadded columns (last axis) of x
+    return torch.arange(x.size(-1), device=x.device)[None, :] < widths.to(x.device)[:, None]
+
+
+def masked_batch_norm(bn, x, mask):
+    """
+    BatchNorm that computes the batch statistics (and updates the running statistics) over the positions where mask,
+    broadcastable to [N, 1, ...], is nonzero. Without batch statistics (eval mode) it is the plain module.
+    """
+    if not bn.training and bn.running_mean is not None:
+        return bn(x)
+    dims = [0] + list(range(2, x.dim()))
+    shape = [1, -1] + [1] * (x.dim() - 2)
+    mask = mask.to(torch.float32).expand(x.size(0), 1, *x.shape[2:])
+    count = mask.sum()
+    x_float = x.float()
+    mean = (x_float * mask).sum(dims) / count
+    var = ((x_float - mean.view(shape)) ** 2 * mask).sum(dims) / count
+    if bn.training and bn.track_running_stats:
+        with torch.no_grad():
+            bn.num_batches_tracked.add_(1)
+            momentum = bn.momentum if bn.momentum is not None else 1. / float(bn.num_batches_tracked)
+            bn.running_mean.mul_(1 - momentum).add_(mean, alpha=momentum)
+            # unbiased variance, as nn.BatchNorm
+            bn.running_var.mul_(1 - momentum).add_(var * count / (count - 1).clamp(min=1), alpha=momentum)
+    out = (x_float - mean.view(shape)) * torch.rsqrt(var.view(shape) + bn.eps)
+    if bn.affine:
+        out = out * bn.weight.view(shape) + bn.bias.view(shape)
+    return out.to(x.dtype)
+
+
+def masked_forward(module, x, widths):
+    """
+    Run the CNN module on right-padded [N, C, H, W] images of the given widths, returns (features, feature widths).
+    The padding columns are zeroed before every Conv2d/MaxPool2d, so each image sees the same zeros as the conv padding
+    of an image run alone, and the features of its unpadded columns do not depend on the rest of the batch.
+    In train mode BatchNorm2d statistics are computed over the unpadded columns only (masked_batch_norm).
+    Modules with a masked_forward(x, widths) method (InvertedResidual) handle their own inner layers.
+    """
+    if isinstance(module, nn.Sequential):
+        for m in module:
+            x, widths = masked_forward(m, x, widths)
+        return x, widths
+    if isinstance(module, (nn.Conv2d, nn.MaxPool2d)):
+        x = x * width_mask(x, widths)[:, None, None, :].to(x.dtype)
+        return module(x), conv_output_widths(module, widths)
+    if isinstance(module, nn.BatchNorm2d) and module.training:
+        return masked_batch_norm(module, x, width_mask(x, widths)[:, None, None, :]), widths
+    if hasattr(module, 'masked_forward'):
+        return module.masked_forward(x, widths)
+    return module(x), widths
+
+
+def sequence_forward(rnn, x, lengths=None):
+    """
+    Run the sequence head on [N, W, C] features. With per-sample frame lengths, padded frames are excluded from the
+    RNN by packing (so the backward direction starts at the last real frame), or zeroed before every conv head block.
+    """
+    if isinstance(rnn, nn.RNNBase):
+        # PROBLEM: torch/nn/modules/rnn.py:821: UserWarning: RNN module weights are not part of single contiguous chunk of memory. This means they need to be compacted at every call, possibly greatly increasing memory usage. To compact weights again call flatten_parameters(). (Triggered internally at  /pytorch/aten/src/ATen/native/cudnn/RNN.cpp:915.)
+        # FIX:
+        # 1. https://discuss.pytorch.org/t/rnn-module-weights-are-not-part-of-single-contiguous-chunk-of-memory/6011/20
+        # 2. https://pytorch.org/docs/stable/generated/torch.nn.RNNBase.html#torch.nn.RNNBase.flatten_parameters
+        # flatten_parameters() rewrites the weight storage in place and breaks the torch.compile graph. The weights are
+        # already flattened by nn.RNNBase._apply() when the model is moved with .to(device), so skip it when compiling.
+        if not is_compiling():
+            rnn.flatten_parameters()
+
+        if lengths is None:
+            x, _ = rnn(x)
+        else:
+            total_length = x.size(1)
+            x = pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            x, _ = rnn(x)
+            x, _ = pad_packed_sequence(x, batch_first=True, total_length=total_length)
+    else:
+        x = rnn(x, lengths)
+    return x
+
+
+class TemporalConvBlock(nn.Module):
+
+    def __init__(self, channels, kernel_size=3, dilation=1):
+        super().__init__()
+        # depthwise dilated conv over the time axis + pointwise conv across channels
+        self.block = nn.Sequential(
+            nn.Conv1d(channels, channels, kernel_size=kernel_size, padding=dilation * (kernel_size - 1) // 2,
+                      dilation=dilation, groups=channels, bias=False),
+            nn.BatchNorm1d(channels),
+            nn.ReLU(inplace=True),
+            nn.Conv1d(channels, channels, kernel_size=1, bias=False),
+            nn.BatchNorm1d(channels),
+        )
+        self.relu = nn.ReLU(inplace=True)
+
+    def forward(self, x, mask=None):
+        if mask is None:
+            return self.relu(x + self.block(x))
+        # BatchNorm statistics over the unpadded frames only, see masked_batch_norm
+        out = x
+        for m in self.block:
+            out = masked_batch_norm(m, out, mask) if isinstance(m, nn.BatchNorm1d) else m(out)
+        return self.relu(x + out)
+
+
+class TemporalConvHead(nn.Module):
+    """
+    Sequence modeling with stacked dilated 1D convolutions instead of a bidirectional RNN. All timesteps are computed in
+    parallel, and with dilations (1, 2, 4, 8) each output frame sees 31 input frames on both sides.
+    """
+
+    def __init__(self, channels, kernel_size=3, dilations=(1, 2, 4, 8)):
+        super().__init__()
+        self.blocks = nn.Sequential(*[TemporalConvBlock(channels, kernel_size=kernel_size, dilation=d)
+                                      for d in dilations])
+
+    def forward(self, x, lengths=None):
+        # [N, W, C] -> [N, C, W]
+        x = x.transpose(1, 2)
+        if lengths is None:
+            x = self.blocks(x)
+        else:
+            # Padded frames are zeroed before every block, as the conv padding of an unpadded sequence
+            mask = width_mask(x, lengths)[:, None, :].to(x.dtype)
+            for block in self.blocks:
+                x = block(x * mask, mask)
+        # [N, C, W] -> [N, W, C]
+        return x.transpose(1, 2)
+
+
 class CRNN(nn.Module):
 
-    def __init__(self, in_channel, num_classes, cnn_input_height, is_tiny=True, use_gru=True):
+    def __init__(self, in_channel, num_classes, cnn_input_height, is_tiny=True, use_gru=True, use_conv_head=False):
         super().__init__()
 
         if is_tiny:
@@ -105,7 +255,10 @@ class CRNN(nn.Module):
             rnn_input_size = 512 * cnn_output_height
             rnn_hidden_size = rnn_input_size // 2
 
-        if use_gru:
+        # 序列建模层
+        if use_conv_head:
+            self.rnn = TemporalConvHead(rnn_input_size)
+        elif use_gru:
             self.rnn = nn.GRU(input_size=rnn_input_size, hidden_size=rnn_hidden_size, num_layers=2, batch_first=True,
                               bidirectional=True)
         else:
@@ -117,24 +270,31 @@ class CRNN(nn.Module):
         # 添加权重初始化
         initialize_weights(self)
 
-    def forward(self, x):
+    def output_lengths(self, widths):
+        # Number of output frames for images of the given (unpadded) widths
+        return conv_output_widths(self.cnn, torch.as_tensor(widths)).clamp(min=1)
+
+    def forward(self, x, widths=None):
+        """
+        x: [N, C, H, W], images of different widths are right-padded to W
+        widths: [N], the unpadded image widths, None if all images use the full width
+        """
         # CNN 层
-        x = self.cnn(x)
+        x = self.cnn(x) if widths is None else masked_forward(self.cnn, x, widths)[0]
 
         # 调整展平顺序
         # [N, C, H, W] -> [N, W, C, H]
+        # permute() is a logical reordering, and contiguous() then materializes [N, W, C, H] in row-major order, so the
+        # flattened C*H features are identical for NCHW and channels_last feature maps. In both cases this is the one
+        # copy of the forward pass that changes layout
         x = x.permute(0, 3, 1, 2).contiguous()
         # [N, C, H, W] -> [N, W, C*H]
         x = x.view(x.size(0), x.size(1), -1)
 
-        # PROBLEM: torch/nn/modules/rnn.py:821: UserWarning: RNN module weights are not part of single contiguous chunk of memory. This means they need to be compacted at every call, possibly greatly increasing memory usage. To compact weights again call flatten_parameters(). (Triggered internally at  /pytorch/aten/src/ATen/native/cudnn/RNN.cpp:915.)
-        # FIX:
-        # 1. https://discuss.pytorch.org/t/rnn-module-weights-are-not-part-of-single-contiguous-chunk-of-memory/6011/20
-        # 2. https://pytorch.org/docs/stable/generated/torch.nn.RNNBase.html#torch.nn.RNNBase.flatten_parameters
-        self.rnn.flatten_parameters()
-
         # RNN 层
-        x, _ = self.rnn(x)
+        # [N, W, C*H] -> [N, W, C*H]
+        lengths = None if widths is None else self.output_lengths(widths).clamp(max=x.size(1))
+        x = sequence_forward(self.rnn, x, lengths)
 
         # 输出层
         x = self.fc(x)
@@ -173,3 +333,6 @@ if __name__ == '__main__':
 
     model = CRNN(in_channel=3, num_classes=100, cnn_input_height=48, is_tiny=True, use_gru=True)
     test_model(copy.deepcopy(data), model)
+
+    model = CRNN(in_channel=3, num_classes=100, cnn_input_height=48, is_tiny=True, use_conv_head=True)
+    test_model(copy.deepcopy(data), model)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午4:20
+@file: crnn_nano.py
+@author: zj
+@description: CRNN_Nano, a CRNN built from depthwise-separable / inverted-residual blocks (MobileNetV2 style).
+
+Compared with CRNN_Tiny, the dense 3x3 convs are replaced by inverted residual blocks with a width multiplier, the
+feature height is collapsed by a per-row depthwise conv instead of being flattened into the RNN input, and the sequence
+head is a single bidirectional GRU/LSTM layer (or the TemporalConvHead) on a few dozen channels.
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .crnn import TemporalConvHead, initialize_weights, conv_output_widths, masked_forward, sequence_forward
+
+
+def make_divisible(v, divisor=8):
+    # Round the channels to a multiple of divisor, and do not go down by more than 10%
+    new_v = max(divisor, int(v + divisor / 2) // divisor * divisor)
+    if new_v < 0.9 * v:
+        new_v += divisor
+    return new_v
+
+
+class InvertedResidual(nn.Module):
+
+    def __init__(self, ch_in, ch_out, stride=1, expand_ratio=4):
+        super().__init__()
+        hidden = ch_in * expand_ratio
+        self.use_residual = stride == 1 and ch_in == ch_out
+
+        layers = []
+        if expand_ratio != 1:
+            # pointwise expansion
+            layers += [
+                nn.Conv2d(ch_in, hidden, kernel_size=1, bias=False),
+                nn.BatchNorm2d(hidden),
+                nn.ReLU6(inplace=True),
+            ]
+        layers += [
+            # depthwise
+            nn.Conv2d(hidden, hidden, kernel_size=3, stride=stride, padding=1, groups=hidden, bias=False),
+            nn.BatchNorm2d(hidden),
+            nn.ReLU6(inplace=True),
+            # pointwise linear projection
+            nn.Conv2d(hidden, ch_out, kernel_size=1, bias=False),
+            nn.BatchNorm2d(ch_out),
+        ]
+        self.block = nn.Sequential(*layers)
+
+    def forward(self, x):
+        if self.use_residual:
+            return x + self.block(x)
+        return self.block(x)
+
+    def masked_forward(self, x, widths):
+        # Right-padded batches, see crnn.masked_forward
+        out, out_widths = masked_forward(self.block, x, widths)
+        if self.use_residual:
+            return x + out, out_widths
+        return out, out_widths
+
+
+class CRNNNano(nn.Module):
+    # t: expansion ratio, c: output channels, n: number of blocks, s: stride of the first block
+    # Only the height is downsampled after the stem, so a 168 pixel wide plate gives 84 frames
+    cfgs = [
+        (1, 16, 1, (1, 1)),
+        (4, 24, 2, (2, 1)),
+        (4, 32, 2, (2, 1)),
+        (4, 64, 2, (2, 1)),
+        (4, 96, 1, (1, 1)),
+    ]
+
+    def __init__(self, in_channel, num_classes, cnn_input_height, width_mult=1.0, use_gru=True, use_conv_head=False):
+        super().__init__()
+
+        ch_in = make_divisible(16 * width_mult)
+        layers = [
+            nn.Conv2d(in_channel, ch_in, kernel_size=3, stride=2, padding=1, bias=False),
+            nn.BatchNorm2d(ch_in),
+            nn.ReLU6(inplace=True),
+        ]
+        cnn_output_height = (cnn_input_height - 1) // 2 + 1
+        for t, c, n, s in self.cfgs:
+            ch_out = make_divisible(c * width_mult)
+            for i in range(n):
+                stride = s if i == 0 else 1
+                layers.append(InvertedResidual(ch_in, ch_out, stride=stride, expand_ratio=t))
+                ch_in = ch_out
+            cnn_output_height = (cnn_output_height - 1) // s[0] + 1
+        # Collapse the height with one depthwise kernel per row: [N, C, H, W] -> [N, C, 1, W]
+        layers += [
+            nn.Conv2d(ch_in, ch_in, kernel_size=(cnn_output_height, 1), groups=ch_in, bias=False),
+            nn.BatchNorm2d(ch_in),
+            nn.ReLU6(inplace=True),
+        ]
+        # 特征提取层
+        self.cnn = nn.Sequential(*layers)
+
+        # 序列建模层
+        rnn_input_size = ch_in
+        if use_conv_head:
+            self.rnn = TemporalConvHead(rnn_input_size)
+        elif use_gru:
+            self.rnn = nn.GRU(input_size=rnn_input_size, hidden_size=rnn_input_size // 2, num_layers=1,
+                              batch_first=True, bidirectional=True)
+        else:
+            self.rnn = nn.LSTM(input_size=rnn_input_size, hidden_size=rnn_input_size // 2, num_layers=1,
+                               batch_first=True, bidirectional=True)
+
+        self.fc = nn.Linear(in_features=rnn_input_size, out_features=num_classes)
+
+        initialize_weights(self)
+
+    def output_lengths(self, widths):
+        # Number of output frames for images of the given (unpadded) widths
+        return conv_output_widths(self.cnn, torch.as_tensor(widths)).clamp(min=1)
+
+    def forward(self, x, widths=None):
+        # CNN 层
+        x = self.cnn(x) if widths is None else masked_forward(self.cnn, x, widths)[0]
+
+        # [N, C, 1, W] -> [N, W, C]
+        x = x.flatten(2).permute(0, 2, 1).contiguous()
+
+        lengths = None if widths is None else self.output_lengths(widths).clamp(max=x.size(1))
+        x = sequence_forward(self.rnn, x, lengths)
+
+        # 输出层
+        x = self.fc(x)
+
+        out = F.log_softmax(x, dim=-1)
+        return out
+
+
+if __name__ == '__main__':
+    import time
+
+    data = torch.randn(10, 3, 48, 168)
+    for width_mult in [0.5, 1.0]:
+        for use_conv_head in [False, True]:
+            model = CRNNNano(in_channel=3, num_classes=100, cnn_input_height=48, width_mult=width_mult,
+                             use_conv_head=use_conv_head).eval()
+            t_start = time.time()
+            with torch.no_grad():
+                output = model(data)
+            print(f"width_mult: {width_mult} use_conv_head: {use_conv_head} time: {time.time() - t_start:.4f}")
+            print(data.shape, output.shape)
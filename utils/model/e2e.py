@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午8:30
+@file: e2e.py
+@author: zj
+@description: End-to-end wrapper for ONNX export, with preprocessing and greedy decoding inside the graph.
+
+The exported model takes raw uint8 [N, H, W, C] BGR images (as read by cv2.imread) and returns per-frame argmax
+indices [N, T] and their probabilities [N, T], instead of the float [N, T, num_classes] log-probs. Only the collapse of
+repeats and blanks (a few integer comparisons) is left to the client, see greedy_decode().
+"""
+
+from itertools import groupby
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class EndToEnd(nn.Module):
+
+    def __init__(self, model, input_size=(48, 168), resize=True, stn_source=False, rgb=False, mean=0., std=1.):
+        """
+        input_size: (H, W) input size of the model
+        resize: resize the images to input_size in the graph, otherwise they must already have that size
+        stn_source: LPRNet+STNet only, sample the STNet output from the full-resolution image, see STNet.forward()
+        rgb, mean, std: color order and normalization (x / 255. - mean) / std of the training data, e.g. the custom
+            dataset uses RGB with mean = std = 0.5 (its PIL resize also antialiases, which the graph does not)
+        """
+        super().__init__()
+        self.model = model
+        self.input_size = tuple(input_size)
+        self.resize = resize
+        self.stn_source = stn_source
+        self.rgb = rgb
+        self.mean = mean
+        self.std = std
+
+    def normalize(self, x):
+        return (x / 255. - self.mean) / self.std
+
+    def forward(self, images):
+        # uint8 [N, H, W, C] -> float [N, C, H, W]
+        src = images.permute(0, 3, 1, 2).float()
+        if self.rgb:
+            src = src[:, [2, 1, 0]]
+        x = src
+        if self.resize:
+            # Same as cv2.resize(INTER_LINEAR), which also uses half-pixel centers and rounds back to uint8
+            x = F.interpolate(x, size=self.input_size, mode='bilinear', align_corners=False)
+            x = x.round().clamp(0, 255)
+        x = self.normalize(x)
+
+        if self.stn_source:
+            log_probs = self.model(x, src=self.normalize(src))
+        else:
+            log_probs = self.model(x)
+        # [N, T, num_classes] -> [N, T]
+        max_log_probs, indices = log_probs.max(dim=-1)
+        return indices.int(), max_log_probs.exp()
+
+
+def greedy_decode(indices, probs=None, blank_label=0):
+    """
+    CTC greedy decoding of one sample of the end-to-end outputs, indices/probs: [T].
+    Returns the label indices and the confidence (product of the probabilities of the kept frames)
+    """
+    indices = np.asarray(indices).tolist()
+    labels = []
+    confidence = 1.
+    t = 0
+    for c, group in groupby(indices):
+        n = len(list(group))
+        if c != blank_label:
+            labels.append(c)
+            if probs is not None:
+                confidence *= float(np.max(probs[t:t + n]))
+        t += n
+    return labels, confidence
+
+
+if __name__ == '__main__':
+    from utils.model.crnn import CRNN
+
+    model = EndToEnd(CRNN(in_channel=3, num_classes=77, cnn_input_height=48).eval())
+    images = torch.randint(0, 256, (2, 140, 440, 3), dtype=torch.uint8)
+    indices, probs = model(images)
+    print(images.shape, indices.shape, probs.shape)
+    print(greedy_decode(indices[0], probs[0].detach().numpy()))
@@ -25,6 +25,15 @@ def init_weights(module):
         nn.init.constant_(module.bias, 0)
 
 
+def channel_max_pool(x, pool, memory_format=torch.contiguous_format):
+    # nn.MaxPool3d applied to a 4D [N, C, H, W] tensor treats C as the depth axis. With kernel (1, kh, kw) and stride
+    # (sc, sh, sw) it keeps every sc-th channel and max-pools H/W, which is the same as channel slicing followed by
+    # F.max_pool2d. Unlike max_pool3d, max_pool2d runs natively in channels_last
+    assert isinstance(pool, nn.MaxPool3d) and pool.kernel_size[0] == 1, pool
+    x = x[:, ::pool.stride[0]].contiguous(memory_format=memory_format)
+    return F.max_pool2d(x, kernel_size=pool.kernel_size[1:], stride=pool.stride[1:])
+
+
 class small_basic_block(nn.Module):
     def __init__(self, ch_in, ch_out):
         super(small_basic_block, self).__init__()
@@ -76,9 +85,16 @@ class small_basic_block_v2(nn.Module):
 
 
 class LPRNet(nn.Module):
-    def __init__(self, num_classes, in_channel=3, dropout_rate=0.5, use_origin_block=False, add_stnet=False):
+    def __init__(self, num_classes, in_channel=3, dropout_rate=0.5, use_origin_block=False, add_stnet=False,
+                 stnet_loc_size=(24, 94), per_sample_norm=False):
+        """
+        per_sample_norm: scale each global context feature map by the mean square over its own C, H, W instead of over
+            the whole batch, so a prediction does not depend on the other images of the batch. It adds no parameters:
+            existing checkpoints load unchanged and give the same outputs as before at batch size 1
+        """
         super(LPRNet, self).__init__()
         self.num_classes = num_classes
+        self.per_sample_norm = per_sample_norm
 
         if use_origin_block:
             small_block = small_basic_block
@@ -88,7 +104,7 @@ class LPRNet(nn.Module):
         self.add_stnet = add_stnet
         if self.add_stnet:
             from utils.model.stnet import STNet
-            self.stnet = STNet()
+            self.stnet = STNet(loc_size=stnet_loc_size)
 
         self.backbone = nn.Sequential(
             nn.Conv2d(in_channels=in_channel, out_channels=64, kernel_size=3, stride=1),  # 0
@@ -122,26 +138,45 @@ class LPRNet(nn.Module):
 
         self.apply(init_weights)
 
-    def forward(self, x):
+    def forward(self, x, src=None, src_sizes=None):
+        """
+        x: [N, 3, 24, 94]
+        src, src_sizes: optional original-resolution crops for STNet, see STNet.forward()
+        """
+        # Keep the input memory format (NCHW or channels_last) through the pooling layers and the global context
+        if not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last):
+            memory_format = torch.channels_last
+        else:
+            memory_format = torch.contiguous_format
+
         if self.add_stnet:
-            x = self.stnet(x)
+            x = self.stnet(x, src=src, src_sizes=src_sizes).contiguous(memory_format=memory_format)
 
         keep_features = list()
         for i, layer in enumerate(self.backbone.children()):
-            x = layer(x)
+            if isinstance(layer, nn.MaxPool3d):
+                x = channel_max_pool(x, layer, memory_format=memory_format)
+            else:
+                x = layer(x)
             if i in [2, 6, 13, 22]:  # [2, 4, 8, 11, 22]
                 keep_features.append(x)
 
         global_context = list()
         for i, f in enumerate(keep_features):
+            # Use the functional form instead of creating nn.AvgPool2d modules on every call, so that torch.compile
+            # can trace the forward without graph breaks
             if i in [0, 1]:
-                f = nn.AvgPool2d(kernel_size=5, stride=5)(f)
+                f = F.avg_pool2d(f, kernel_size=5, stride=5)
             if i in [2]:
-                f = nn.AvgPool2d(kernel_size=(4, 10), stride=(4, 2))(f)
+                f = F.avg_pool2d(f, kernel_size=(4, 10), stride=(4, 2))
             f_pow = torch.pow(f, 2)
-            f_mean = torch.mean(f_pow)
+            if self.per_sample_norm:
+                # Clamped, a sample whose ReLU features are all zero would otherwise divide 0 by 0
+                f_mean = torch.mean(f_pow, dim=(1, 2, 3), keepdim=True).clamp(min=1e-12)
+            else:
+                f_mean = torch.mean(f_pow)
             f = torch.div(f, f_mean)
-            global_context.append(f)
+            global_context.append(f.contiguous(memory_format=memory_format))
 
         x = torch.cat(global_context, 1)
         # [N, N_Class+448, H, W] -> [N, N_Class, H, W]
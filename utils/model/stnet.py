@@ -16,10 +16,46 @@ import torch
 import torch.nn.functional as F
 
 
+def affine_grid(theta, size):
+    """
+    Same as F.affine_grid(theta, size, align_corners=False), written with basic ops (arange/matmul) so that it also
+    exports to ONNX opsets without AffineGrid
+    theta: [N, 2, 3], size: (N, C, H, W) -> grid: [N, H, W, 2]
+    """
+    N, _, H, W = size
+    # Normalized coordinates of the pixel centers
+    xs = (torch.arange(W, device=theta.device, dtype=theta.dtype) * 2 + 1) / W - 1
+    ys = (torch.arange(H, device=theta.device, dtype=theta.dtype) * 2 + 1) / H - 1
+    ones = torch.ones(H, W, device=theta.device, dtype=theta.dtype)
+    base = torch.stack([xs.view(1, W).expand(H, W), ys.view(H, 1).expand(H, W), ones], dim=-1)
+    # [H*W, 3] x [N, 3, 2] -> [N, H*W, 2]
+    grid = torch.matmul(base.view(1, H * W, 3), theta.transpose(1, 2))
+    return grid.view(N, H, W, 2)
+
+
+def adjust_theta(theta, src_sizes, padded_size):
+    """
+    Map theta from the normalized coordinates of each crop to those of the zero-padded batch that holds it.
+    Crops are placed at the top-left corner, src_sizes: [N, 2] (h, w), padded_size: (H, W)
+    """
+    H, W = padded_size
+    sy = src_sizes[:, 0].to(theta.dtype) / H
+    sx = src_sizes[:, 1].to(theta.dtype) / W
+    # u_pad = s * u + (s - 1)
+    scale = torch.stack([sx, sy], dim=1).unsqueeze(-1)
+    shift = torch.stack([sx - 1, sy - 1], dim=1)
+    theta = theta * scale
+    return torch.cat([theta[:, :, :2], (theta[:, :, 2] + shift).unsqueeze(-1)], dim=-1)
+
+
 class STNet(nn.Module):
 
-    def __init__(self):
+    def __init__(self, loc_size=(24, 94)):
+        """
+        loc_size: (H, W) input size of the localization network, inputs of other sizes are resized to it
+        """
         super(STNet, self).__init__()
+        self.loc_size = tuple(loc_size)
 
         # Spatial transformer localization-network
         self.localization = nn.Sequential(
@@ -30,9 +66,13 @@ class STNet(nn.Module):
             nn.MaxPool2d(3, stride=3),
             nn.ReLU(True)
         )
+        # conv3 -> pool2 -> conv5 -> pool3, 24x94 gives 32 * 2 * 14
+        loc_h = ((loc_size[0] - 2) // 2 - 4) // 3
+        loc_w = ((loc_size[1] - 2) // 2 - 4) // 3
+        self.loc_features = 32 * loc_h * loc_w
         # Regressor for the 3x2 affine matrix
         self.fc_loc = nn.Sequential(
-            nn.Linear(32 * 14 * 2, 32),
+            nn.Linear(self.loc_features, 32),
             nn.ReLU(True),
             nn.Linear(32, 3 * 2)
         )
@@ -40,17 +80,31 @@ class STNet(nn.Module):
         self.fc_loc[2].weight.data.zero_()
         self.fc_loc[2].bias.data.copy_(torch.tensor([1, 0, 0, 0, 1, 0], dtype=torch.float))
 
-    def forward(self, x):
-        xs = self.localization(x)
-        xs = xs.view(-1, 32 * 14 * 2)
+    def forward(self, x, src=None, src_sizes=None):
+        """
+        x: [N, 3, H, W], the resized crops, also defines the output size
+        src: [N, 3, H', W'], optional original-resolution crops. The predicted transform then samples the output
+            directly from src, i.e. resize + spatial transform in one grid_sample instead of two interpolations
+        src_sizes: [N, 2], (h, w) of each crop when src is a zero-padded batch of crops with different sizes
+        """
+        xs = x
+        # Always resize in ONNX export, the traced shape check would otherwise drop it from models with a dynamic width
+        if torch.onnx.is_in_onnx_export() or tuple(xs.shape[-2:]) != self.loc_size:
+            xs = F.interpolate(xs, size=self.loc_size, mode='bilinear', align_corners=False)
+        xs = self.localization(xs)
+        xs = xs.flatten(1)  # also valid for channels_last features
         theta = self.fc_loc(xs)
         theta = theta.view(-1, 2, 3)
 
-        # /home/zj/anaconda3/envs/yolov5/lib/python3.8/site-packages/torch/nn/functional.py:3828: UserWarning: Default grid_sample and affine_grid behavior has changed to align_corners=False since 1.3.0. Please specify align_corners=True if the old behavior is desired. See the documentation of grid_sample for details.
-        #   warnings.warn(
         # align_corners=False is better than align_corners=True
-        grid = F.affine_grid(theta, x.size(), align_corners=False)
-        x = F.grid_sample(x, grid)
+        # Pass align_corners explicitly to grid_sample, the default-value warning is a graph break for torch.compile
+        if src is None:
+            src = x
+        elif src_sizes is not None:
+            theta = adjust_theta(theta, src_sizes, src.shape[-2:])
+        # Normalized coordinates do not depend on the resolution, so the same theta works for x and for src
+        grid = affine_grid(theta, (x.size(0), x.size(1), x.size(2), x.size(3)))
+        x = F.grid_sample(src, grid.to(src.dtype), align_corners=False)
 
         return x
 
@@ -61,3 +115,8 @@ if __name__ == '__main__':
     a = torch.randn(4, 3, 24, 94)
     output = model(a)
     print(a.shape, output.shape)
+
+    # Sample the 24x94 output directly from the original crops
+    src = torch.randn(4, 3, 140, 440)
+    output = model(a, src=src)
+    print(src.shape, output.shape)
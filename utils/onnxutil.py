@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午9:10
+@file: onnxutil.py
+@author: zj
+@description: ONNX Runtime inference, evaluation and int8 calibration helpers.
+"""
+
+import os
+import time
+
+import numpy as np
+
+import torch
+import onnxruntime
+from torch.utils.data import DataLoader
+
+from .evaluator import Evaluator
+from .autotune import load_profile, ort_session_options
+
+
+class ONNXRuntimePredictor:
+
+    def __init__(self, w, device=torch.device('cpu'), session_options=None):
+        """
+        session_options: onnxruntime.SessionOptions, default: the autotune.py profile of w on this host, if any
+        """
+        print(f'Loading {w} for ONNX Runtime inference...')
+        providers = ['CPUExecutionProvider']
+        if session_options is None:
+            session_options = ort_session_options(load_profile(w))
+        session = onnxruntime.InferenceSession(w, sess_options=session_options, providers=providers)
+        output_names = [x.name for x in session.get_outputs()]
+        meta = session.get_modelmeta().custom_metadata_map  # metadata
+        print(f"meta: {meta}")
+
+        self.session = session
+        self.output_names = output_names
+        self.device = device
+        self.meta = meta
+        # End-to-end models (pth2onnx.py --e2e) take uint8 HWC images and return argmax indices and probabilities
+        self.e2e = session.get_inputs()[0].type == 'tensor(uint8)'
+
+    @property
+    def input_shape(self):
+        # [N, C, H, W], dynamic axes are strings such as 'batch_size'
+        return self.session.get_inputs()[0].shape
+
+    @property
+    def batch_size(self):
+        # Static batch size of the model, None if the batch axis is dynamic
+        n = self.input_shape[0]
+        return n if isinstance(n, int) else None
+
+    def __call__(self, im):
+        im = im.cpu().numpy()  # torch to numpy
+        y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
+
+        if isinstance(y, (list, tuple)):
+            return self.from_numpy(y[0]) if len(y) == 1 else [self.from_numpy(x) for x in y]
+        else:
+            return self.from_numpy(y)
+
+    def from_numpy(self, x):
+        return torch.from_numpy(x).to(self.device) if isinstance(x, np.ndarray) else x
+
+
+class DatasetCalibrationReader:
+    """
+    Feed preprocessed images of a PlateDataset/CustomPlateDataset to onnxruntime.quantization.quantize_static().
+    num_samples images are drawn at random (fixed seed) from the dataset. It implements the CalibrationDataReader
+    interface (get_next/rewind) without subclassing it, so inference does not import onnxruntime.quantization
+    """
+
+    def __init__(self, dataset, input_name='input', batch_size=1, num_samples=512, seed=0):
+        indices = np.random.default_rng(seed).permutation(len(dataset))[:num_samples]
+        self.batches = [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
+        self.dataset = dataset
+        self.input_name = input_name
+        self.iterator = iter(self.batches)
+
+    def get_next(self):
+        batch = next(self.iterator, None)
+        if batch is None:
+            return None
+        images = np.stack([self.dataset[int(i)][0].numpy() for i in batch]).astype(np.float32)
+        return {self.input_name: images}
+
+    def rewind(self):
+        self.iterator = iter(self.batches)
+
+
+def evaluate_onnx(predictor, dataset, batch_size=64, num_workers=4):
+    # Plate accuracy of an ONNX model, models exported with a static batch size are run with that batch size
+    static_batch = predictor.batch_size
+    dataloader = DataLoader(dataset, batch_size=static_batch or batch_size, shuffle=False, num_workers=num_workers,
+                            drop_last=static_batch is not None and static_batch > 1)
+    evaluator = Evaluator(blank_label=0)
+    for images, targets in dataloader:
+        outputs = predictor(images)
+        evaluator.update(outputs.cpu(), dataset.convert(targets))
+    return evaluator.result()
+
+
+def onnx_latency(predictor, shape, n=50, warmup=10):
+    # Median latency (ms) of one run on a random input of the given shape
+    x = torch.randn(shape)
+    for _ in range(warmup):
+        predictor(x)
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        predictor(x)
+        times.append((time.perf_counter() - t0) * 1000)
+    return sorted(times)[n // 2]
+
+
+def file_size_mb(path):
+    return os.path.getsize(path) / 1024 / 1024
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午12:10
+@file: pool.py
+@author: zj
+@description: Pre-fork multi-process CPU inference pool with shared-memory input slots (Linux).
+
+    pool = WorkerPool('crnn_tiny-plate.pth', num_workers=8)
+    pool.start()
+    results = pool.predict_batch(images)       # [(text, confidence), ...], or pool.submit(images) -> Future
+    pool.close()
+
+Weights: PyTorch/TorchScript models are loaded once in the parent and the workers are forked afterwards, so the weight
+pages are shared copy-on-write and never copied (inference does not write to them). The parent loads with one thread,
+a forked child cannot use an OpenMP thread pool created by its parent. ONNX Runtime sessions are not fork-safe, each
+worker opens its own session of the model file (the file itself is shared through the page cache).
+
+Inputs: crops are copied into fixed-size slots of one shared-memory block and the workers get (slot, h, w, c) tuples,
+no image is pickled. Slots are reused through a free list, submit() reserves all slots of a batch at once and waits
+while fewer are free. Batches larger than num_slots are split by predict_batch(). Crops larger than a slot are
+downscaled to fit, the engine resizes them to the model input anyway.
+
+Tasks: every worker has its own pipe, a batch goes to the worker with the fewest tasks in flight. A worker that dies
+(OOM, crash of a native library) cannot leave a lock of a shared queue taken; the collector sees its process sentinel,
+fails its tasks with a RuntimeError and forks a replacement.
+
+Cores: worker i is pinned to its own subset of the allowed cores and runs as many intra-op threads as it has cores.
+"""
+
+import os
+import itertools
+import threading
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+
+from .logger import LOGGER
+from .metrics import STAGE_SECONDS, BATCH_SIZE
+
+
+def split_cores(num_workers, cores=None):
+    # Disjoint core sets, one per worker. With more workers than cores the workers share cores round-robin
+    cores = sorted(cores or os.sched_getaffinity(0))
+    k = len(cores) // num_workers
+    if k == 0:
+        return [[cores[i % len(cores)]] for i in range(num_workers)]
+    return [cores[i * k:(i + 1) * k] for i in range(num_workers)]
+
+
+def worker_loop(rank, engine, weights, engine_kwargs, cores, shm, slot_bytes, conn):
+    os.sched_setaffinity(0, cores)
+    if engine is None:
+        import onnxruntime
+        from .engine import build_engine
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = len(cores)
+        options.inter_op_num_threads = 1
+        engine = build_engine(weights, session_options=options, **engine_kwargs)
+    else:
+        import torch
+        torch.set_num_threads(len(cores))
+    # Warm up the thread pool and allocator of this process
+    engine.predict_batch([np.zeros((48, 168, 3), dtype=np.uint8)])
+    conn.send((None, rank, None))
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        task_id, slots = task
+        try:
+            # Views of the shared memory, valid until the parent reuses the slots after the result is sent
+            images = [np.frombuffer(shm.buf, dtype=np.uint8, count=h * w * c, offset=index * slot_bytes)
+                      .reshape((h, w, c) if c > 1 else (h, w)) for index, h, w, c in slots]
+            output = engine.predict_batch(images)
+            del images
+            # Stage timings of the worker, the parent records them in its metrics
+            conn.send((task_id, output, getattr(engine, 'timings', None)))
+        except Exception as e:
+            conn.send((task_id, None, repr(e)))
+
+
+class WorkerPool:
+
+    def __init__(self, weights, num_workers=None, slot_shape=(128, 512, 3), num_slots=256, cores=None,
+                 **engine_kwargs):
+        """
+        num_workers: default: one worker per 4 allowed cores
+        slot_shape: largest crop (H, W, C) a slot holds
+        num_slots: crops in flight, at least the batch size, e.g. 2 * num_workers * batch_size
+        engine_kwargs: dataset, backend and model flags of build_engine()
+        """
+        self.weights = weights
+        cores = sorted(cores or os.sched_getaffinity(0))
+        self.num_workers = num_workers or max(len(cores) // 4, 1)
+        self.core_sets = split_cores(self.num_workers, cores)
+        self.slot_shape = tuple(slot_shape)
+        self.slot_bytes = int(np.prod(slot_shape))
+        self.num_slots = num_slots
+        self.engine_kwargs = engine_kwargs
+
+        self.shm = None
+        self.buffer = None
+        self.engine = None
+        self.closing = False
+        # Per worker: process, pipe and the ids of its tasks in flight
+        self.processes = []
+        self.conns = []
+        self.in_flight = []
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.free_slots = list(range(num_slots))
+        self.slots_freed = threading.Condition()
+
+    def start(self):
+        self.ctx = get_context('fork')
+        self.shm = SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+        self.buffer = np.ndarray((self.num_slots * self.slot_bytes,), dtype=np.uint8, buffer=self.shm.buf)
+
+        backend = self.engine_kwargs.get('backend')
+        if not (backend == 'onnx' or (backend is None and self.weights.endswith('.onnx'))):
+            import torch
+            from .engine import build_engine
+
+            # Single-threaded in the parent, no OpenMP pool exists before the fork
+            torch.set_num_threads(1)
+            # Kept to fork replacements of dead workers
+            self.engine = build_engine(self.weights, device=torch.device('cpu'), apply_profile=False,
+                                       **self.engine_kwargs)
+
+        for rank in range(self.num_workers):
+            p, conn = self.spawn(rank)
+            self.processes.append(p)
+            self.conns.append(conn)
+            self.in_flight.append(set())
+        for conn in self.conns:
+            conn.recv()
+        LOGGER.info(f"{self.num_workers} workers ready, cores: {self.core_sets}")
+
+        self.collector = threading.Thread(target=self.collect, name='pool-collector', daemon=True)
+        self.collector.start()
+
+    def spawn(self, rank):
+        conn, child_conn = self.ctx.Pipe()
+        p = self.ctx.Process(target=worker_loop, daemon=True,
+                             args=(rank, self.engine, self.weights, self.engine_kwargs, self.core_sets[rank], self.shm,
+                                   self.slot_bytes, child_conn))
+        p.start()
+        child_conn.close()
+        return p, conn
+
+    def acquire_slots(self, n):
+        # All slots of a batch at once, so that waiting batches never hold a part of the free slots
+        with self.slots_freed:
+            self.slots_freed.wait_for(lambda: len(self.free_slots) >= n)
+            indices, self.free_slots = self.free_slots[:n], self.free_slots[n:]
+        return indices
+
+    def release_slots(self, indices):
+        with self.slots_freed:
+            self.free_slots.extend(indices)
+            self.slots_freed.notify_all()
+
+    def fit(self, image):
+        # Downscale crops that do not fit into a slot
+        h, w = image.shape[:2]
+        max_h, max_w = self.slot_shape[:2]
+        if image.ndim == 3 and image.shape[2] > self.slot_shape[2]:
+            image = image[..., :self.slot_shape[2]]
+        if h > max_h or w > max_w:
+            scale = min(max_h / h, max_w / w)
+            image = cv2.resize(image, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(image)
+
+    def submit(self, images):
+        """
+        images: list of uint8 BGR (or gray) crops. Returns a Future of [(text, confidence), ...]
+        """
+        assert len(images) <= self.num_slots, f'a batch of {len(images)} needs more than {self.num_slots} slots'
+        slots = []
+        for index, image in zip(self.acquire_slots(len(images)), images):
+            image = self.fit(image)
+            offset = index * self.slot_bytes
+            self.buffer[offset:offset + image.size] = image.reshape(-1)
+            h, w = image.shape[:2]
+            slots.append((index, h, w, 1 if image.ndim == 2 else image.shape[2]))
+
+        future = Future()
+        with self.lock:
+            task_id = next(self.counter)
+            rank = min(range(self.num_workers), key=lambda r: len(self.in_flight[r]))
+            self.pending[task_id] = (future, slots, rank)
+            self.in_flight[rank].add(task_id)
+            try:
+                self.conns[rank].send((task_id, slots))
+            except OSError:
+                # The worker is dead, the collector fails its tasks
+                pass
+        return future
+
+    def predict_batch(self, images):
+        if len(images) == 0:
+            return []
+        # Chunks of at most num_slots crops
+        futures = [self.submit(images[i:i + self.num_slots]) for i in range(0, len(images), self.num_slots)]
+        return [result for future in futures for result in future.result()]
+
+    def collect(self):
+        while not self.closing:
+            with self.lock:
+                conns = {conn: rank for rank, conn in enumerate(self.conns)}
+                sentinels = {p.sentinel: rank for rank, p in enumerate(self.processes)}
+            # Wakes up for results and for exited workers, the timeout only bounds the reaction to close()
+            for ready in wait(list(conns) + list(sentinels), timeout=1.):
+                if ready in conns:
+                    try:
+                        task_id, output, info = ready.recv()
+                    except (EOFError, OSError):
+                        # Exited, handled with its sentinel
+                        continue
+                    if task_id is not None:
+                        self.finish(task_id, output, info)
+                elif not self.closing:
+                    self.restart(sentinels[ready])
+
+    def finish(self, task_id, output, info):
+        with self.lock:
+            item = self.pending.pop(task_id, None)
+            if item is not None:
+                self.in_flight[item[2]].discard(task_id)
+        if item is None:
+            return
+        future, slots, _ = item
+        # The worker has finished reading the slots
+        self.release_slots([index for index, _, _, _ in slots])
+        if output is None:
+            future.set_exception(RuntimeError(info))
+            return
+        BATCH_SIZE.observe(len(slots))
+        for stage, seconds in (info or dict()).items():
+            STAGE_SECONDS.observe(seconds, stage)
+        future.set_result(output)
+
+    def restart(self, rank):
+        # Fail the tasks of a dead worker and fork a replacement
+        with self.lock:
+            exitcode = self.processes[rank].exitcode
+            LOGGER.error(f"Worker {rank} died with exit code {exitcode}, restart it")
+            self.conns[rank].close()
+            self.processes[rank], self.conns[rank] = self.spawn(rank)
+            task_ids = list(self.in_flight[rank])
+        for task_id in task_ids:
+            self.finish(task_id, None, f'worker {rank} died with exit code {exitcode}')
+
+    def close(self):
+        self.closing = True
+        self.collector.join()
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for p in self.processes:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        for conn in self.conns:
+            conn.close()
+        self.processes = []
+        self.conns = []
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午2:10
+@file: prune.py
+@author: zj
+@description: Structured channel pruning for CRNN and LPRNet.
+
+Channels are ranked by |gamma| of the BatchNorm2d that follows their convolution, or by the L1 norm of their filters
+for the convolutions inside small_basic_block (which have no BatchNorm). Scores are normalized per layer and one global
+threshold decides which channels are removed. Removed channels are deleted from the producing Conv2d/BatchNorm2d and
+from every consumer (next Conv2d, the GRU/LSTM input, LPRNet.container), so the result is a smaller dense model whose
+state_dict can be loaded back with rebuild_from_state_dict().
+
+LPRNet always needs fine-tuning after pruning. The stem output (backbone.0) is also the first global context feature,
+which LPRNet.forward divides by its mean square over the batch (or per sample with per_sample_norm). Removing stem
+channels takes their share out of that mean, so the kept channels are rescaled and container.0 sees different inputs
+even when the removed channels were small. The other groups do not touch the global context.
+
+"""
+
+import math
+from copy import deepcopy
+
+import torch
+import torch.nn as nn
+
+from .logger import LOGGER
+from .general import get_flops
+from .model.crnn import CRNN
+from .model.lprnet import LPRNet, small_basic_block, small_basic_block_v2
+
+
+def _set_module(model, name, module):
+    parent_name, _, attr = name.rpartition('.')
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, attr, module)
+
+
+def rebuild_from_state_dict(model, state_dict):
+    """
+    Replace the layers that prune_model() can shrink by layers with the channel counts stored in state_dict, so that
+    pruned checkpoints load into the architecture created from the usual command line flags. Only the pruned channel
+    dimensions may differ: the number of classes, the input channels and kernel sizes are left to the strict
+    load_state_dict(), which reports any other mismatch.
+    """
+    if not isinstance(model, (CRNN, LPRNet)):
+        return model
+    prunable = dict()
+    for _, _, _, layers in _groups(model):
+        for name, dim in layers:
+            prunable.setdefault(name, set()).add(dim)
+
+    for name, m in list(model.named_modules()):
+        dims = prunable.get(name, set())
+        if isinstance(m, nn.Conv2d) and f'{name}.weight' in state_dict:
+            weight = state_dict[f'{name}.weight']
+            if weight.shape == m.weight.shape or weight.shape[2:] != m.weight.shape[2:] or m.groups != 1:
+                continue
+            out_channels, in_channels = weight.shape[:2]
+            if (out_channels != m.out_channels and 'out' not in dims) or \
+                    (in_channels != m.in_channels and 'in' not in dims):
+                continue
+            new_m = nn.Conv2d(in_channels, out_channels, kernel_size=m.kernel_size, stride=m.stride,
+                              padding=m.padding, dilation=m.dilation, bias=m.bias is not None)
+        elif isinstance(m, nn.BatchNorm2d) and 'out' in dims and f'{name}.running_mean' in state_dict:
+            num_features = state_dict[f'{name}.running_mean'].shape[0]
+            if num_features == m.num_features:
+                continue
+            new_m = nn.BatchNorm2d(num_features, eps=m.eps, momentum=m.momentum, affine=m.affine)
+        elif isinstance(m, (nn.GRU, nn.LSTM)) and 'in' in dims and f'{name}.weight_ih_l0' in state_dict:
+            input_size = state_dict[f'{name}.weight_ih_l0'].shape[1]
+            if input_size == m.input_size:
+                continue
+            new_m = type(m)(input_size=input_size, hidden_size=m.hidden_size, num_layers=m.num_layers,
+                            batch_first=m.batch_first, bidirectional=m.bidirectional)
+        else:
+            continue
+        _set_module(model, name, new_m)
+    return model
+
+
+def _prune_conv_out(conv, keep):
+    conv.weight = nn.Parameter(conv.weight.data.index_select(0, keep))
+    if conv.bias is not None:
+        conv.bias = nn.Parameter(conv.bias.data.index_select(0, keep))
+    conv.out_channels = len(keep)
+
+
+def _prune_conv_in(conv, keep):
+    assert conv.groups == 1, conv
+    conv.weight = nn.Parameter(conv.weight.data.index_select(1, keep))
+    conv.in_channels = len(keep)
+
+
+def _prune_bn(bn, keep):
+    bn.weight = nn.Parameter(bn.weight.data.index_select(0, keep))
+    bn.bias = nn.Parameter(bn.bias.data.index_select(0, keep))
+    bn.running_mean = bn.running_mean.index_select(0, keep)
+    bn.running_var = bn.running_var.index_select(0, keep)
+    bn.num_features = len(keep)
+
+
+def _prune_rnn_in(rnn, keep, height):
+    # CRNN.forward flattens [C, H] into the RNN input, so the feature of channel c, row h is c * H + h
+    index = (keep[:, None] * height + torch.arange(height, device=keep.device)).flatten()
+    new_rnn = type(rnn)(input_size=len(index), hidden_size=rnn.hidden_size, num_layers=rnn.num_layers,
+                        batch_first=rnn.batch_first, bidirectional=rnn.bidirectional).to(keep.device)
+    state_dict = rnn.state_dict()
+    for k in state_dict.keys():
+        # weight_ih_l0 and weight_ih_l0_reverse
+        if k.startswith('weight_ih_l0'):
+            state_dict[k] = state_dict[k].index_select(1, index)
+    new_rnn.load_state_dict(state_dict)
+    return new_rnn
+
+
+def _crnn_groups(model):
+    # (name, channel scores, prune function) for every Conv2d -> BatchNorm2d pair in CRNN.cnn
+    layers = list(model.cnn.children())
+    pairs = [i for i in range(len(layers) - 1)
+             if isinstance(layers[i], nn.Conv2d) and isinstance(layers[i + 1], nn.BatchNorm2d)]
+
+    groups = list()
+    for k, i in enumerate(pairs):
+        conv, bn = layers[i], layers[i + 1]
+        if k + 1 < len(pairs):
+            def prune(keep, conv=conv, bn=bn, consumer=layers[pairs[k + 1]]):
+                _prune_conv_out(conv, keep)
+                _prune_bn(bn, keep)
+                _prune_conv_in(consumer, keep)
+        elif isinstance(model.rnn, nn.RNNBase):
+            def prune(keep, conv=conv, bn=bn, height=model.rnn.input_size // conv.out_channels):
+                _prune_conv_out(conv, keep)
+                _prune_bn(bn, keep)
+                model.rnn = _prune_rnn_in(model.rnn, keep, height)
+        else:
+            # The depthwise TemporalConvHead works on the flattened CNN features directly, keep the last conv intact
+            continue
+        consumer = f'cnn.{pairs[k + 1]}' if k + 1 < len(pairs) else 'rnn'
+        changed = [(f'cnn.{i}', 'out'), (f'cnn.{i + 1}', 'out'), (consumer, 'in')]
+        groups.append((f'cnn.{i}', bn.weight.detach().abs(), prune, changed))
+    return groups
+
+
+def _lprnet_groups(model):
+    backbone = model.backbone
+    groups = list()
+
+    # backbone.0: its output feeds the first small block and is the first global context feature,
+    # i.e. input channels [0, 64) of LPRNet.container. Pruning it changes the mean-square normalization of that
+    # feature, see the module docstring
+    stem, stem_bn, block = backbone[0], backbone[1], backbone[4]
+
+    def prune_stem(keep):
+        n = stem.out_channels
+        _prune_conv_out(stem, keep)
+        _prune_bn(stem_bn, keep)
+        _prune_conv_in(block.block[0], keep)
+        if hasattr(block, 'shortcut'):
+            _prune_conv_in(block.shortcut, keep)
+        container = model.container[0]
+        _prune_conv_in(container, torch.cat([keep, torch.arange(n, container.in_channels, device=keep.device)]))
+
+    changed = [('backbone.0', 'out'), ('backbone.1', 'out'), ('backbone.4.block.0', 'in'), ('container.0', 'in')]
+    if hasattr(block, 'shortcut'):
+        changed.append(('backbone.4.shortcut', 'in'))
+    groups.append(('backbone.0', stem_bn.weight.detach().abs(), prune_stem, changed))
+
+    # Bottleneck channels inside each small block (1x1 -> 3x1 -> 1x3 -> 1x1). The block outputs are kept intact,
+    # because the MaxPool3d layers subsample them along the channel axis
+    for i, m in enumerate(backbone.children()):
+        if not isinstance(m, (small_basic_block, small_basic_block_v2)):
+            continue
+        convs = [layer for layer in m.block if isinstance(layer, nn.Conv2d)]
+        names = [f'backbone.{i}.block.{k}' for k, layer in enumerate(m.block) if isinstance(layer, nn.Conv2d)]
+        for j in range(len(convs) - 1):
+            def prune(keep, producer=convs[j], consumer=convs[j + 1]):
+                _prune_conv_out(producer, keep)
+                _prune_conv_in(consumer, keep)
+
+            score = convs[j].weight.detach().abs().flatten(1).sum(1)
+            groups.append((f'backbone.{i}.conv{j}', score, prune, [(names[j], 'out'), (names[j + 1], 'in')]))
+
+    # backbone.16: conv (1, 4) -> BN -> ReLU -> Dropout -> conv (13, 1)
+    conv, bn, consumer = backbone[16], backbone[17], backbone[20]
+
+    def prune_head(keep):
+        _prune_conv_out(conv, keep)
+        _prune_bn(bn, keep)
+        _prune_conv_in(consumer, keep)
+
+    changed = [('backbone.16', 'out'), ('backbone.17', 'out'), ('backbone.20', 'in')]
+    groups.append(('backbone.16', bn.weight.detach().abs(), prune_head, changed))
+    return groups
+
+
+def _groups(model):
+    # (name, channel scores, prune function, [(layer name, 'in'/'out') changed by the prune function])
+    if isinstance(model, LPRNet):
+        return _lprnet_groups(model)
+    if isinstance(model, CRNN):
+        return _crnn_groups(model)
+    raise TypeError(f"Pruning is not supported for {type(model).__name__}")
+
+
+@torch.no_grad()
+def prune_model(model, threshold, min_ratio=0.1):
+    """
+    Return a pruned copy of model. Channels whose score, normalized by the largest score of the layer, is below
+    threshold are removed, while at least ceil(min_ratio * channels) channels of every layer are kept.
+    """
+    model = deepcopy(model)
+    for name, score, prune, _ in _groups(model):
+        score = score / score.max().clamp(min=1e-12)
+        n_keep = max(math.ceil(min_ratio * len(score)), int((score >= threshold).sum()), 1)
+        if n_keep < len(score):
+            keep = torch.argsort(score, descending=True)[:n_keep].sort().values
+            prune(keep)
+    return model
+
+
+def prune_to_flops(model, target_gflops, img_shape=(1, 3, 48, 168), min_ratio=0.1, steps=12):
+    # Binary search of the global threshold, FLOPs decrease monotonically with the threshold
+    gflops = get_flops(model, img_shape=img_shape)
+    LOGGER.info(f"Before pruning: {gflops:.3f} GFLOPs, target: {target_gflops:.3f} GFLOPs")
+    if gflops <= target_gflops:
+        return deepcopy(model), gflops
+
+    lo, hi = 0., 1.
+    best_model, best_gflops = None, None
+    for _ in range(steps):
+        threshold = (lo + hi) / 2
+        pruned = prune_model(model, threshold, min_ratio=min_ratio)
+        pruned_gflops = get_flops(pruned, img_shape=img_shape)
+        if pruned_gflops <= target_gflops:
+            best_model, best_gflops = pruned, pruned_gflops
+            hi = threshold
+        else:
+            lo = threshold
+    if best_model is None:
+        best_model = prune_model(model, 1., min_ratio=min_ratio)
+        best_gflops = get_flops(best_model, img_shape=img_shape)
+        LOGGER.warning(f"Target {target_gflops:.3f} GFLOPs is not reachable with min_ratio={min_ratio}")
+
+    n_p, n_pruned = sum(x.numel() for x in model.parameters()), sum(x.numel() for x in best_model.parameters())
+    LOGGER.info(f"After pruning: {best_gflops:.3f} GFLOPs, parameters {n_p} -> {n_pruned}")
+    return best_model, best_gflops
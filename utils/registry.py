@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午2:10
+@file: registry.py
+@author: zj
+@description: Versioned model registry with zero-downtime hot reload.
+
+    registry = ModelRegistry(poll_interval=2., warmup_batch_sizes=(1, 8, 32))
+    registry.register('plate', './runs/models/plate/', dataset='plate', arch='crnn_tiny')    # or a single model file
+    registry.register('emnist', './runs/models/emnist/', dataset='emnist')
+    registry.start()                                 # watch the sources in a background thread
+    registry.predict_batch('plate', images)          # or registry.predictor('plate').predict_batch(images)
+
+A source is a model file, reloaded when it is replaced, or a directory of versions (.pth/.torchscript/.onnx), of which
+the newest file is served. A new version is loaded and warmed up at the serving batch sizes in the watcher thread
+while the current version keeps serving, then swapped in atomically. Every batch leases the version it started on, so
+in-flight batches finish on the old version; it is released (WorkerPool.close()) when its last lease ends. A version
+that fails to load is logged and skipped until its file changes again, the current version stays.
+
+Build flags of a directory can also be given in its config.json, e.g. {"dataset": "plate", "arch": "lprnet_plus"}.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from .logger import LOGGER
+
+MODEL_SUFFIXES = ('.pth', '.torchscript', '.onnx')
+
+
+def latest_model(source):
+    # (path, mtime) of the model file to serve, None if there is none
+    if os.path.isfile(source):
+        return source, os.path.getmtime(source)
+    if not os.path.isdir(source):
+        return None
+    paths = [os.path.join(source, name) for name in os.listdir(source) if name.endswith(MODEL_SUFFIXES)]
+    if len(paths) == 0:
+        return None
+    path = max(paths, key=lambda p: (os.path.getmtime(p), p))
+    return path, os.path.getmtime(path)
+
+
+def expand_arch(arch=None, **kwargs):
+    # Build flags with the architecture flags of PLATE_ARCHS[arch], explicit flags take precedence
+    from .general import PLATE_ARCHS
+
+    if arch is None:
+        return kwargs
+    arch_kwargs = dict(PLATE_ARCHS[arch])
+    arch_kwargs.pop('img_shape')
+    return {**arch_kwargs, **kwargs}
+
+
+def default_build(path, **kwargs):
+    from .engine import build_engine
+
+    return build_engine(path, **expand_arch(**kwargs))
+
+
+class ModelVersion:
+
+    def __init__(self, name, path, mtime, engine):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.engine = engine
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+
+    def info(self):
+        return {'version': os.path.basename(self.path), 'path': self.path, 'mtime': self.mtime,
+                'loaded_at': self.loaded_at, 'in_flight': self.in_flight}
+
+
+class ModelRegistry:
+
+    def __init__(self, poll_interval=2., warmup_batch_sizes=(1, 8, 32), settle=1., build_fn=default_build):
+        """
+        settle: seconds a new file must be unchanged before it is loaded, so half-copied files are not picked up
+        build_fn: (path, **kwargs) -> object with predict_batch(images)
+        """
+        self.poll_interval = poll_interval
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.settle = settle
+        self.build_fn = build_fn
+
+        self.sources = dict()
+        self.models = dict()
+        self.failed = dict()
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, name, source, **kwargs):
+        """
+        source: model file or directory of versions. kwargs: build flags (dataset, arch, backend, ...), merged with the
+        config.json of a directory. The first version is loaded before returning
+        """
+        config = os.path.join(source, 'config.json')
+        if os.path.isdir(source) and os.path.isfile(config):
+            with open(config) as f:
+                kwargs = {**json.load(f), **kwargs}
+        self.sources[name] = (source, kwargs)
+        latest = latest_model(source)
+        assert latest is not None, f'no {"/".join(MODEL_SUFFIXES)} model in {source}'
+        assert self.load(name, *latest), f'failed to load {latest[0]}'
+
+    def add_listener(self, fn):
+        # fn(name, version) after every swap, e.g. to clear a prediction cache
+        self.listeners.append(fn)
+
+    def warmup(self, engine):
+        for batch_size in self.warmup_batch_sizes:
+            engine.predict_batch([np.zeros((48, 168, 3), dtype=np.uint8)] * batch_size)
+
+    def load(self, name, path, mtime):
+        source, kwargs = self.sources[name]
+        t0 = time.time()
+        try:
+            engine = self.build_fn(path, **kwargs)
+            self.warmup(engine)
+        except Exception:
+            LOGGER.exception(f"Failed to load {name} version {path}, keep serving the current version")
+            self.failed[name] = (path, mtime)
+            return False
+        version = ModelVersion(name, path, mtime, engine)
+
+        release = False
+        with self.lock:
+            old = self.models.get(name)
+            self.models[name] = version
+            if old is not None:
+                old.retired = True
+                release = old.in_flight == 0
+        if release:
+            self.release(old)
+        LOGGER.info(f"Serve {name} version {os.path.basename(path)} (loaded in {time.time() - t0:.1f} s)")
+        for fn in self.listeners:
+            fn(name, version)
+        return True
+
+    def release(self, version):
+        # Last lease of a retired version ended
+        close = getattr(version.engine, 'close', None)
+        if close is not None:
+            close()
+        version.engine = None
+
+    @contextmanager
+    def lease(self, name):
+        # The current version of name, kept alive until the block ends
+        with self.lock:
+            version = self.models[name]
+            version.in_flight += 1
+        try:
+            yield version
+        finally:
+            with self.lock:
+                version.in_flight -= 1
+                release = version.retired and version.in_flight == 0
+            if release:
+                self.release(version)
+
+    def predict_batch(self, name, images):
+        with self.lease(name) as version:
+            return version.engine.predict_batch(images)
+
+    def predictor(self, name):
+        return RegistryPredictor(self, name)
+
+    def poll(self):
+        # Load the sources whose newest file changed
+        for name, (source, _) in list(self.sources.items()):
+            latest = latest_model(source)
+            if latest is None:
+                continue
+            path, mtime = latest
+            current = self.models.get(name)
+            if current is not None and (current.path, current.mtime) == (path, mtime):
+                continue
+            if self.failed.get(name) == (path, mtime) or time.time() - mtime < self.settle:
+                continue
+            self.load(name, path, mtime)
+
+    def run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception:
+                LOGGER.exception('Model registry poll failed')
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='model-registry', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            versions = list(self.models.values())
+            self.models = dict()
+        for version in versions:
+            self.release(version)
+
+    def versions(self):
+        with self.lock:
+            return {name: version.info() for name, version in self.models.items()}
+
+
+class RegistryPredictor:
+    """predict_batch() on the current version of one registered model"""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    @property
+    def batch_size(self):
+        with self.registry.lease(self.name) as version:
+            return getattr(version.engine, 'batch_size', 1)
+
+    def predict_batch(self, images):
+        return self.registry.predict_batch(self.name, images)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/19 下午11:10
+@file: serving.py
+@author: zj
+@description: Dynamic micro-batching and a minimal asyncio HTTP/1.1 server/client for serve_plate.py.
+
+Requests put their input on an asyncio queue and await a future. One batching task takes the first queued request,
+waits up to max_wait_ms for more (or until max_batch_size requests are queued), and runs the whole batch through
+predict_fn in a worker thread, so the event loop keeps accepting requests while the model runs. Requests that arrive
+during a model call form the next batch. max_wait_ms=0 never waits and only batches what is already queued.
+"""
+
+import time
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .logger import LOGGER
+from .metrics import QUEUE_WAIT_SECONDS
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class HTTPError(Exception):
+    # Request rejected before its body is read, answered with status and a closed connection
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5., max_queue=1024, concurrency=1):
+        """
+        predict_fn: list of inputs -> list of results (same order), called from a worker thread
+        max_queue: requests beyond it are rejected with QueueFullError instead of growing the latency without bound
+        concurrency: batches in flight at once. 1 for a single model, which is not required to be thread-safe; the
+            number of workers for a WorkerPool (utils/pool.py)
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+
+        self.queue = None
+        self.task = None
+        self.slots = None
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batcher')
+
+        self.num_requests = 0
+        self.num_batches = 0
+        self.queue_wait = 0.
+
+    def start(self):
+        # Must be called from the running event loop
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise QueueFullError(f'more than {self.max_queue} queued requests')
+        return await future
+
+    async def collect(self):
+        # Block for the first request, then fill the batch until it is full or the wait time is over
+        loop = asyncio.get_event_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            getter = loop.create_task(self.queue.get())
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if getter in done:
+                batch.append(getter.result())
+            else:
+                getter.cancel()
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            # Collect the next batch only when it can start right away
+            await self.slots.acquire()
+            batch = await self.collect()
+            now = time.perf_counter()
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            for _, _, t in batch:
+                self.queue_wait += now - t
+                QUEUE_WAIT_SECONDS.observe(now - t)
+            loop.create_task(self.process(batch))
+
+    async def process(self, batch):
+        items = [item for item, _, _ in batch]
+        try:
+            results = await asyncio.get_event_loop().run_in_executor(self.executor, self.predict_fn, items)
+        except Exception as e:
+            LOGGER.exception(f"Batch of {len(batch)} failed")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+        for (_, future, _), result in zip(batch, results):
+            # The client may have gone away
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'mean_batch_size': self.num_requests / max(self.num_batches, 1),
+            'mean_queue_wait_ms': self.queue_wait / max(self.num_requests, 1) * 1000,
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'concurrency': self.concurrency,
+        }
+
+
+# HTTP ---------------------------------------------------------------------------------------------------------------
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+def json_response(obj, status=200):
+    return status, 'application/json; charset=utf-8', json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+async def read_message(reader, max_body=None):
+    """
+    Start line, headers (lower-case names) and body of one HTTP/1.1 message, None on a closed connection. Raises
+    HTTPError (the body left unread) for an invalid Content-Length or one larger than max_body
+    """
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise HTTPError(400, f'invalid Content-Length: {length}')
+    length = int(length)
+    if max_body is not None and length > max_body:
+        raise HTTPError(413, 'body too large')
+    body = await reader.readexactly(length) if length > 0 else b''
+    return start_line.decode('latin-1').strip(), headers, body
+
+
+class HTTPServer:
+    """
+    Keep-alive HTTP/1.1 server for small JSON APIs. routes: {(method, path): async handler(body) ->
+    (status, content_type, payload)}
+    """
+
+    def __init__(self, routes, max_body=8 * 1024 * 1024):
+        self.routes = routes
+        self.max_body = max_body
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    message = await read_message(reader, max_body=self.max_body)
+                    if message is not None and len(message[0].split(' ')) != 3:
+                        raise HTTPError(400, 'malformed request line')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as e:
+                    # The rest of the message is not read, the stream is out of sync, close the connection
+                    await self.respond(writer, *json_response({'error': str(e)}, e.status), keep_alive=False)
+                    break
+                if message is None:
+                    break
+                start_line, headers, body = message
+                method, path, _ = start_line.split(' ')
+                path = urlsplit(path).path
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                handler = self.routes.get((method, path))
+                if handler is None:
+                    status, content_type, payload = json_response({'error': f'no route {method} {path}'}, 404)
+                else:
+                    try:
+                        status, content_type, payload = await handler(body)
+                    except QueueFullError as e:
+                        status, content_type, payload = json_response({'error': str(e)}, 503)
+                    except Exception as e:
+                        LOGGER.exception(f"{method} {path} failed")
+                        status, content_type, payload = json_response({'error': repr(e)}, 500)
+
+                await self.respond(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, content_type, payload, keep_alive):
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1'))
+        writer.write(payload)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        LOGGER.info(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+class HTTPClient:
+    """One keep-alive connection, used by the load generator (benchmark.py serve)"""
+
+    def __init__(self, host='127.0.0.1', port=8000):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=b'', content_type='application/octet-stream'):
+        # Returns (status, body)
+        if self.writer is None:
+            await self.connect()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\n"
+                          f"Host: {self.host}:{self.port}\r\n"
+                          f"Content-Type: {content_type}\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1'))
+        self.writer.write(body)
+        await self.writer.drain()
+        message = await read_message(self.reader)
+        if message is None:
+            raise ConnectionError('connection closed by the server')
+        status_line, headers, payload = message
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return int(status_line.split(' ')[1]), payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
@@ -8,7 +8,6 @@
 """
 
 import os
-import thop
 import time
 import platform
 import subprocess
@@ -21,6 +20,8 @@ import torch.nn as nn
 
 from .logger import LOGGER
 
+COMPILE_CACHE_DIR = os.getenv('CRNN_COMPILE_CACHE', './runs/compile_cache')  # persistent torch.compile cache
+
 
 def device_count():
     # Returns number of CUDA devices available. Safe version of torch.cuda.device_count(). Supports Linux and Windows
@@ -75,6 +76,96 @@ def torch_distributed_zero_first(local_rank: int):
         dist.barrier(device_ids=[0])
 
 
+def compile_model(model, device=None, cache_dir=COMPILE_CACHE_DIR):
+    # torch.compile with a persistent Inductor cache. Inductor emits Triton kernels for CUDA tensors and C++/OpenMP
+    # kernels for CPU tensors, so the same call serves GPU and CPU-only hosts. Compiled graphs are written to cache_dir,
+    # later processes load them from there instead of compiling again
+    assert hasattr(torch, 'compile'), f'--compile requires torch>=2.0, but torch-{torch.__version__} is installed'
+    if device is None:
+        device = next(model.parameters()).device
+
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)  # must be set before the first compilation
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+
+    import torch._dynamo
+    import torch._inductor.config
+    torch._inductor.config.fx_graph_cache = True
+    if hasattr(torch._dynamo.config, 'allow_rnn'):
+        # By default dynamo falls back to eager for nn.GRU/nn.LSTM, which splits the CRNN graph in two
+        torch._dynamo.config.allow_rnn = True
+
+    LOGGER.info(f"torch.compile for {device.type.upper()} with inductor backend, cache: {cache_dir}")
+    return torch.compile(model, backend='inductor')
+
+
+AMP_DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def cpu_bf16_flags():
+    # CPU instruction sets with native bf16 matmul (Sapphire Rapids AMX, Cooper Lake / Zen4 AVX512-BF16)
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = set(f.read().split())
+    except OSError:
+        return []
+    return [flag for flag in ('amx_bf16', 'avx512_bf16') if flag in flags]
+
+
+def select_amp_dtype(amp_dtype='auto', device=None):
+    """
+    Resolve --amp-dtype for the device. 'auto' keeps the previous behaviour: fp16 on CUDA and fp32 on CPU.
+    fp16 autocast is CUDA only, bf16 works on CPU and on CUDA
+    """
+    device_type = 'cpu' if device is None else torch.device(device).type
+    if amp_dtype == 'auto':
+        return 'fp16' if device_type == 'cuda' else 'fp32'
+    assert amp_dtype in AMP_DTYPES, f"amp_dtype should be one of auto/{'/'.join(AMP_DTYPES)}, got {amp_dtype}"
+    assert amp_dtype != 'fp16' or device_type == 'cuda', 'fp16 autocast requires a CUDA device, use bf16 on CPU'
+    if amp_dtype == 'bf16' and device_type == 'cpu' and not cpu_bf16_flags():
+        LOGGER.warning('bf16 autocast on a CPU without AMX/AVX512-BF16, it is emulated and usually slower than fp32')
+    return amp_dtype
+
+
+def amp_autocast(device, amp_dtype):
+    # torch.autocast for the device type, a no-op for fp32
+    return torch.autocast(device_type=torch.device(device).type, dtype=AMP_DTYPES[amp_dtype],
+                          enabled=amp_dtype != 'fp32')
+
+
+def amp_grad_scaler(amp_dtype):
+    # Only fp16 needs loss scaling, bf16 has the exponent range of fp32
+    return torch.cuda.amp.GradScaler(enabled=amp_dtype == 'fp16')
+
+
+class AutocastModel(nn.Module):
+    """Run the wrapped model under autocast and return fp32 outputs, used for mixed-precision inference"""
+
+    def __init__(self, model, device, amp_dtype):
+        super().__init__()
+        self.model = model
+        self.device_type = torch.device(device).type
+        self.amp_dtype = amp_dtype
+
+    def forward(self, *args, **kwargs):
+        with amp_autocast(self.device_type, self.amp_dtype):
+            out = self.model(*args, **kwargs)
+        return out.float()
+
+
+def unwrap_model(model):
+    # Strip torch.compile / DDP / AutocastModel wrappers
+    while True:
+        if hasattr(model, '_orig_mod'):
+            model = model._orig_mod
+        elif isinstance(model, (AutocastModel, nn.parallel.DistributedDataParallel)):
+            model = model.model if isinstance(model, AutocastModel) else model.module
+        else:
+            return model
+
+
 def time_sync():
     # PyTorch-accurate time
     if torch.cuda.is_available():
@@ -82,6 +173,19 @@ def time_sync():
     return time.time()
 
 
+@torch.no_grad()
+def measure_latency(model, x, n=50, warmup=10):
+    # Median forward latency (ms) of model(x), robust to scheduler noise on shared CPU hosts
+    for _ in range(warmup):
+        model(x)
+    times = []
+    for _ in range(n):
+        t0 = time_sync()
+        model(x)
+        times.append((time_sync() - t0) * 1000)
+    return sorted(times)[n // 2]
+
+
 def profile(input, ops, n=10, device=None):
     """ YOLOv5 speed/memory/FLOPs profiler
     Usage:
@@ -104,6 +208,7 @@ def profile(input, ops, n=10, device=None):
             m = m.half() if hasattr(m, 'half') and isinstance(x, torch.Tensor) and x.dtype is torch.float16 else m
             tf, tb, t = 0, 0, [0, 0, 0]  # dt forward, backward
             try:
+                import thop
                 flops = thop.profile(m, inputs=(x,), verbose=False)[0] / 1E9 * 2  # GFLOPs
             except Exception:
                 flops = 0
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+@date: 2026/10/20 上午3:20
+@file: video.py
+@author: zj
+@description: Plate recognition on video, IoU tracking of the plate boxes and temporal voting per track.
+
+    recognizer = VideoPlateRecognizer(build_engine('crnn_tiny-plate.onnx'), every=5)
+    for frame_idx, frame in read_frames('gate.mp4'):
+        recognizer.update(frame, frame_idx, boxes_of(frame_idx))     # [[x1, y1, x2, y2], ...]
+    tracks = recognizer.finish()         # [{'id': 0, 'plate': '宁A87J92', 'confidence': 0.97, ...}, ...]
+
+Boxes come from a detector (callback) or a sidecar file, the recognizer only reads plates. A box is matched to the
+track of the previous frames with the highest IoU. A track is recognized on its first frame, every `every` frames after
+that, and whenever its crop changed by more than change_threshold of the bits of its dHash (utils/cache.py), the crops
+of all tracks due in a frame go through one predict_batch() call. The (text, confidence) of every recognition of a track
+are fused by a confidence-weighted vote, first on the text length, then per character.
+"""
+
+import os
+import json
+from collections import defaultdict
+
+import cv2
+
+from .cache import perceptual_key
+
+
+def box_iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.
+    inter = w * h
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def crop_box(frame, box):
+    # Crop clipped to the frame, None if nothing is left
+    h, w = frame.shape[:2]
+    x1, y1 = max(int(round(box[0])), 0), max(int(round(box[1])), 0)
+    x2, y2 = min(int(round(box[2])), w), min(int(round(box[3])), h)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    return frame[y1:y2, x1:x2]
+
+
+def crop_change(a, b):
+    # Fraction of differing dHash bits of two perceptual keys
+    bits = len(a) * 4
+    return bin(int(a, 16) ^ int(b, 16)).count('1') / bits
+
+
+def vote(results, grammar=None):
+    """
+    Fuse [(text, confidence), ...] of one track. Returns (text, confidence), the confidence is the mean over all
+    results of the confidence voting for the weakest character of the fused text
+    grammar: text -> bool, results it rejects do not vote unless all of them are rejected
+    """
+    if grammar is not None:
+        valid = [r for r in results if grammar(r[0])]
+        results = valid if len(valid) > 0 else results
+    results = [(text, confidence) for text, confidence in results if len(text) > 0]
+    if len(results) == 0:
+        return '', 0.
+
+    lengths = defaultdict(float)
+    for text, confidence in results:
+        lengths[len(text)] += confidence
+    length = max(lengths, key=lambda k: (lengths[k], k))
+
+    chars = []
+    support = []
+    for i in range(length):
+        weights = defaultdict(float)
+        for text, confidence in results:
+            if len(text) == length:
+                weights[text[i]] += confidence
+        char = max(weights, key=weights.get)
+        chars.append(char)
+        support.append(weights[char])
+    return ''.join(chars), min(support) / len(results)
+
+
+class Track:
+
+    def __init__(self, track_id, box, frame_idx):
+        self.id = track_id
+        self.box = box
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.num_frames = 0
+        self.misses = 0
+
+        # Frame and dHash of the last recognized crop
+        self.recognized_frame = None
+        self.recognized_key = None
+        self.results = []
+
+    def due(self, frame_idx, key, every, change_threshold):
+        if self.recognized_frame is None or frame_idx - self.recognized_frame >= every:
+            return True
+        return change_threshold is not None and crop_change(key, self.recognized_key) > change_threshold
+
+    def summary(self, grammar=None):
+        plate, confidence = vote(self.results, grammar)
+        counts = defaultdict(int)
+        for text, _ in self.results:
+            counts[text] += 1
+        return {'id': self.id, 'plate': plate, 'confidence': confidence, 'first_frame': self.first_frame,
+                'last_frame': self.last_frame, 'box': [float(v) for v in self.box], 'frames': self.num_frames,
+                'recognitions': len(self.results),
+                'candidates': sorted(counts.items(), key=lambda kv: -kv[1])[:5]}
+
+
+class VideoPlateRecognizer:
+
+    def __init__(self, predictor, every=5, change_threshold=0.25, iou_threshold=0.3, max_age=10, grammar=None):
+        """
+        predictor: anything with predict_batch(images) -> [(text, confidence), ...] (OCREngine, WorkerPool, ...)
+        every: recognize a track at most every `every` frames unless its crop changes
+        change_threshold: fraction of dHash bits that must differ from the last recognized crop to recognize it again
+            before `every` frames passed, None: only every `every` frames
+        max_age: frames a track survives without a matching box
+        grammar: text -> bool used by the vote, e.g. is_plate_valid
+        """
+        self.predictor = predictor
+        self.every = every
+        self.change_threshold = change_threshold
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.grammar = grammar
+
+        self.tracks = []
+        self.finished = []
+        self.next_id = 0
+
+        self.num_frames = 0
+        self.num_crops = 0
+        self.num_recognitions = 0
+
+    def match(self, boxes):
+        # Greedy assignment by descending IoU, returns {box index: track}
+        pairs = [(box_iou(track.box, box), i, j) for i, box in enumerate(boxes) for j, track in enumerate(self.tracks)]
+        pairs = sorted([p for p in pairs if p[0] >= self.iou_threshold], reverse=True)
+        matches = dict()
+        used = set()
+        for _, i, j in pairs:
+            if i not in matches and j not in used:
+                matches[i] = self.tracks[j]
+                used.add(j)
+        return matches
+
+    def update(self, frame, frame_idx, boxes):
+        """Track the boxes of one frame and recognize the tracks that are due, returns the active tracks"""
+        self.num_frames += 1
+        matches = self.match(boxes)
+        seen = set()
+        due = []
+        for i, box in enumerate(boxes):
+            track = matches.get(i)
+            if track is None:
+                track = Track(self.next_id, box, frame_idx)
+                self.next_id += 1
+                self.tracks.append(track)
+            track.box = box
+            track.last_frame = frame_idx
+            track.misses = 0
+            seen.add(track.id)
+
+            crop = crop_box(frame, box)
+            if crop is None:
+                continue
+            track.num_frames += 1
+            self.num_crops += 1
+            key = perceptual_key(crop)
+            if track.due(frame_idx, key, self.every, self.change_threshold):
+                due.append((track, crop, key))
+
+        if len(due) > 0:
+            for (track, _, key), result in zip(due, self.predictor.predict_batch([crop for _, crop, _ in due])):
+                track.results.append(result)
+                track.recognized_frame = frame_idx
+                track.recognized_key = key
+            self.num_recognitions += len(due)
+
+        # Tracks without a box for more than max_age frames are finished
+        active = []
+        for track in self.tracks:
+            if track.id not in seen:
+                track.misses += 1
+            if track.misses > self.max_age:
+                self.finished.append(track)
+            else:
+                active.append(track)
+        self.tracks = active
+        return active
+
+    def process(self, frames, box_fn):
+        """frames: iterable of (frame_idx, frame), box_fn: (frame, frame_idx) -> boxes. Returns finish()"""
+        for frame_idx, frame in frames:
+            self.update(frame, frame_idx, box_fn(frame, frame_idx))
+        return self.finish()
+
+    def finish(self, min_frames=1):
+        # Summaries of all tracks recognized at least once and seen in min_frames frames, by first frame
+        tracks = sorted(self.finished + self.tracks, key=lambda t: (t.first_frame, t.id))
+        return [track.summary(self.grammar) for track in tracks
+                if len(track.results) > 0 and track.num_frames >= min_frames]
+
+    def stats(self):
+        return {'frames': self.num_frames, 'crops': self.num_crops, 'recognitions': self.num_recognitions,
+                'recognized_rate': self.num_recognitions / max(self.num_crops, 1), 'tracks': self.next_id}
+
+
+def read_frames(path, stride=1):
+    # (frame index, BGR frame) of a video file, every stride-th frame (the others are grabbed, not decoded)
+    capture = cv2.VideoCapture(path)
+    assert capture.isOpened(), f'cannot open {path}'
+    frame_idx = 0
+    try:
+        while True:
+            if frame_idx % stride != 0:
+                if not capture.grab():
+                    break
+                frame_idx += 1
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame_idx, frame
+            frame_idx += 1
+    finally:
+        capture.release()
+
+
+def load_boxes(path):
+    """
+    Boxes of a sidecar file, {frame index: [[x1, y1, x2, y2], ...]}
+        .json: {"0": [[x1, y1, x2, y2], ...], "1": [...]}
+        other: one box per line, "frame x1 y1 x2 y2 [score ...]" separated by spaces or commas, # comments
+    """
+    boxes = defaultdict(list)
+    if os.path.splitext(path)[1] == '.json':
+        with open(path) as f:
+            for frame_idx, frame_boxes in json.load(f).items():
+                boxes[int(frame_idx)].extend([float(v) for v in box[:4]] for box in frame_boxes)
+        return boxes
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].replace(',', ' ').split()
+            if len(line) < 5:
+                continue
+            boxes[int(float(line[0]))].append([float(v) for v in line[1:5]])
+    return boxes